@@ -4,7 +4,12 @@ from enum import Enum
 from dataclasses import dataclass
 from typing import Any, Dict, List
 
-from config import Config
+from utils.normalize import (
+    intern_str,
+    normalize_housenumber,
+    normalize_street,
+    ULIC_FEATURES
+)
 
 
 class OsmType(Enum):
@@ -30,23 +35,7 @@ class Address:
     street: str  # if no street then None or empty str
     source: str
 
-    ULIC_FEATURES = [
-        'ul.', 'ulica',
-        'al.', 'aleja',
-        'pl.', 'plac',
-        'skwer',
-        'bulw.', 'bulwar',
-        'rondo',
-        'park',
-        'rynek',
-        'szosa',
-        'droga',
-        'os.', 'osiedle',
-        'ogród',
-        'wyspa',
-        'wyb.', 'wybrzeże',
-        'inne'
-    ]
+    ULIC_FEATURES = ULIC_FEATURES
 
     @property
     def min_unique(self) -> str:
@@ -54,17 +43,23 @@ class Address:
         :return: minimal unique string for each address which contains
             city, street (optionally), housenumber
         """
-        street = self.street if self.street else ''
+        return self.match_key()
 
-        housenumber = self.housenumber
-        if Config.IGNORE_CASE_SENSITIVE_HOUSENUMBER:
-            housenumber = housenumber.lower()
-
-        if Config.IGNORE_STREET_FEATURES:
-            street = street.lower()
-            for feature in self.ULIC_FEATURES:
-                street = street.replace(feature, '')
-            street = street.strip()
+    def match_key(
+        self,
+        ignore_case_sensitive_housenumber: bool = False,
+        ignore_street_features: bool = False
+    ) -> str:
+        """
+        :param ignore_case_sensitive_housenumber: e.g. 12a is same as 12A
+        :param ignore_street_features: skip ULIC_FEATURES in street name
+        :return: min_unique string normalized with given options
+        """
+        street = normalize_street(self.street, ignore_street_features)
+        housenumber = normalize_housenumber(
+            self.housenumber,
+            ignore_case_sensitive_housenumber
+        )
 
         return f'{self.city}{street}{housenumber}'
 
@@ -132,20 +127,49 @@ class OsmAddress(Address):
         else:
             point = Point(element['center']['lat'], element['center']['lon'])
 
-        if 'addr:street' in element['tags']:
-            city = element['tags'].get('addr:city', None)
+        tags = element['tags']
+        if 'addr:street' in tags:
+            city = tags.get('addr:city', None)
         else:
-            city = element['tags'].get('addr:place', None)
+            city = tags.get('addr:place', None)
 
         return OsmAddress(
             osm_id=element['id'],
             osm_type=osm_type,
             point=point,
-            city=city,
-            city_simc=element['tags'].get('addr:city:simc', None),
-            street=element['tags'].get('addr:street', None),
-            housenumber=element['tags'].get('addr:housenumber', None),
-            postcode=element['tags'].get('addr:postcode', None),
-            source=element['tags'].get('source:addr', None),
-            all_obj_tags=element['tags']
+            city=intern_str(city),
+            city_simc=intern_str(tags.get('addr:city:simc', None)),
+            street=intern_str(tags.get('addr:street', None)),
+            housenumber=intern_str(tags.get('addr:housenumber', None)),
+            postcode=intern_str(tags.get('addr:postcode', None)),
+            source=intern_str(tags.get('source:addr', None)),
+            all_obj_tags=tags
+        )
+
+    @staticmethod
+    def parse_from_osm_csv_row(row: Dict[str, str]) -> OsmAddress:
+        """
+        :param row: Overpass [out:csv] row with ::type, ::id, ::lat, ::lon
+            and tags columns (empty value means that tag doesn't exist)
+        """
+        tags = {
+            k: v for k, v in row.items() if v and not k.startswith('@')
+        }
+
+        if 'addr:street' in tags:
+            city = tags.get('addr:city', None)
+        else:
+            city = tags.get('addr:place', None)
+
+        return OsmAddress(
+            osm_id=int(row['@id']),
+            osm_type=OsmType(row['@type']),
+            point=Point(float(row['@lat']), float(row['@lon'])),
+            city=intern_str(city),
+            city_simc=intern_str(tags.get('addr:city:simc', None)),
+            street=intern_str(tags.get('addr:street', None)),
+            housenumber=intern_str(tags.get('addr:housenumber', None)),
+            postcode=intern_str(tags.get('addr:postcode', None)),
+            source=intern_str(tags.get('source:addr', None)),
+            all_obj_tags=tags
         )
@@ -1,11 +1,31 @@
 from collections import Counter
-from typing import Dict, List, Set, Union
+from dataclasses import dataclass
+from itertools import repeat
+from operator import attrgetter, itemgetter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union
+)
 
 from address import Address, OsmAddress
-from config import Config
+from utils.geo import cluster_points, distance
+from utils.key_hash import KeyHashIndex
 from utils.poi_tags import is_poi
 
 
+KeyFunc = Callable[[Address], str]
+
+
+def is_addr_tag(key: str) -> bool:
+    return key.startswith('addr:') or key == 'source:addr'
+
+
 def addr_tags_distribution(addresses: List[OsmAddress]) -> Counter:
     """
     :return: tags counter distribution of usage addr* tags + source:addr
@@ -13,7 +33,7 @@ def addr_tags_distribution(addresses: List[OsmAddress]) -> Counter:
     tags = Counter()
     for addr in addresses:
         for key in addr.all_obj_tags.keys():
-            if key.startswith('addr:') or key == 'source:addr':
+            if is_addr_tag(key):
                 tags[key] += 1
 
     return tags
@@ -30,24 +50,34 @@ def addr_type_distribution(addresses: List[OsmAddress]) -> Counter:
     return osm_type
 
 
-def addr_duplicates(osm_addresses: List[OsmAddress]) -> List[List[OsmAddress]]:
+def is_excluded_poi(osm_addr: OsmAddress) -> bool:
+    """
+    :return: True if address is on POI (but not building) object
     """
+    return is_poi(osm_addr) and 'building' not in osm_addr.all_obj_tags.keys()
+
+
+def addr_duplicates(
+    osm_addresses: List[OsmAddress],
+    exclude_poi: bool = False,
+    key: KeyFunc = attrgetter('min_unique')
+) -> List[List[OsmAddress]]:
+    """
+    :param exclude_poi: skip addresses on POI objects (except buildings)
+    :param key: function which returns address matching key
     :return: duplicated addresses (checks by city street and housenumber)
     """
     duplicated_osm_addr: Dict[str, List[OsmAddress]] = dict()
 
     for osm_addr in osm_addresses:
-        if (
-            Config.DUPLICATES_EXCLUDE_POI
-                and is_poi(osm_addr)
-                and 'building' not in osm_addr.all_obj_tags.keys()
-        ):
+        if exclude_poi and is_excluded_poi(osm_addr):
             continue
 
-        if osm_addr.min_unique not in duplicated_osm_addr:
-            duplicated_osm_addr[osm_addr.min_unique] = []
+        addr_key = key(osm_addr)
+        if addr_key not in duplicated_osm_addr:
+            duplicated_osm_addr[addr_key] = []
 
-        duplicated_osm_addr[osm_addr.min_unique].append(osm_addr)
+        duplicated_osm_addr[addr_key].append(osm_addr)
 
     return list(filter(lambda v: len(v) > 1, duplicated_osm_addr.values()))
 
@@ -55,18 +85,335 @@ def addr_duplicates(osm_addresses: List[OsmAddress]) -> List[List[OsmAddress]]:
 def addr_missing(
     addresses1: List[Address],
     addresses2: List[Address],
+    key: KeyFunc = attrgetter('min_unique'),
+    compact_keys: bool = False
 ) -> List[Union[Address, OsmAddress]]:
     """
+    :param key: function which returns address matching key
+    :param compact_keys: store 64-bit hashes of keys instead of strings
     :return: diff between datasets
         it returns missing addresses in addresses1 from adddress2
     """
+    if compact_keys:
+        index = KeyHashIndex(addresses1, key)
+        exists = index.contains_many(key(addr2) for addr2 in addresses2)
+        return [
+            addr2 for addr2, addr_exists in zip(addresses2, exists)
+            if not addr_exists
+        ]
+
     all_min_unique_addr1: Set[str] = set()
     for addr1 in addresses1:
-        all_min_unique_addr1.add(addr1.min_unique)
+        all_min_unique_addr1.add(key(addr1))
 
     missing_addresses = []
     for addr2 in addresses2:
-        if addr2.min_unique not in all_min_unique_addr1:
+        if key(addr2) not in all_min_unique_addr1:
             missing_addresses.append(addr2)
 
     return missing_addresses
+
+
+# Matched addresses farther than it (in metres) are reported as different
+MATCHED_MAX_DISTANCE = 100.0
+# e-mapa addresses joined with compact index in one vectorized search
+JOIN_CHUNK_SIZE = 2 ** 16
+
+
+@dataclass
+class MatchedAddress:
+    emapa_address: Address
+    osm_address: OsmAddress
+    differences: List[str]  # tags with different values or 'position'
+    distance: float         # metres
+
+
+@dataclass
+class JoinResult:
+    missing_emapa_addresses: List[Address]
+    matched_with_differences: List[MatchedAddress]
+    matched_keys: Set[str]  # empty with KeyHashIndex
+    # only with KeyHashIndex – 1 for OSM addresses (by position) with key
+    # of any e-mapa address, keys strings are not stored
+    matched_osm_positions: Optional[bytearray] = None
+
+
+@dataclass
+class AddressesAnalysis:
+    osm_type_distribution: Counter
+    osm_tags_distribution: Counter
+    duplicated_osm_addresses: List[List[OsmAddress]]
+    # same address far apart (only with duplicates_max_distance)
+    distant_osm_addresses: List[List[OsmAddress]]
+    missing_emapa_addresses: List[Address]
+    excess_osm_addresses: List[OsmAddress]
+    matched_with_differences: List[MatchedAddress]
+
+
+def _addr_differences(
+    emapa_addr: Address,
+    osm_addr: OsmAddress,
+    distance: float,
+    matched_max_distance: float
+) -> List[str]:
+    differences = []
+    if emapa_addr.postcode != osm_addr.postcode:
+        differences.append('addr:postcode')
+    if emapa_addr.city_simc != osm_addr.city_simc:
+        differences.append('addr:city:simc')
+    if distance > matched_max_distance:
+        differences.append('position')
+
+    return differences
+
+
+def addr_join(
+    osm_index: Union[Dict[str, List[OsmAddress]], KeyHashIndex],
+    emapa_addresses: List[Address],
+    key: KeyFunc = attrgetter('min_unique'),
+    matched_max_distance: float = MATCHED_MAX_DISTANCE
+) -> JoinResult:
+    """
+    Hash join of e-mapa addresses with OSM addresses (single pass over
+    e-mapa addresses). Each matched e-mapa address is compared with the
+    nearest OSM address with the same key.
+
+    :param osm_index: OSM addresses grouped by key (hash index)
+        or compact KeyHashIndex
+    :param key: function which returns address matching key
+    :param matched_max_distance: matched addresses farther than it (metres)
+        have 'position' difference
+    """
+    missing_emapa_addresses = []
+    matched_with_differences = []
+    matched_keys: Set[str] = set()
+    matched_osm_positions: Optional[bytearray] = None
+    # positions of OSM candidates of each e-mapa address (compact index)
+    emapa_positions: Iterable[Optional[List[int]]] = repeat(None)
+    if isinstance(osm_index, KeyHashIndex):
+        matched_osm_positions = bytearray(len(osm_index))
+        # keys of a chunk are hashed and searched at once (vectorized)
+        emapa_positions = (
+            positions
+            for i in range(0, len(emapa_addresses), JOIN_CHUNK_SIZE)
+            for positions in osm_index.positions_many([
+                key(addr)
+                for addr in emapa_addresses[i:i + JOIN_CHUNK_SIZE]
+            ])
+        )
+
+    for emapa_addr, positions in zip(emapa_addresses, emapa_positions):
+        if positions is None:
+            addr_key = key(emapa_addr)
+            osm_candidates = osm_index.get(addr_key)
+        else:
+            for position in positions:
+                matched_osm_positions[position] = 1
+            osm_candidates = osm_index.addresses_at(positions) or None
+
+        if osm_candidates is None:
+            missing_emapa_addresses.append(emapa_addr)
+            continue
+
+        if matched_osm_positions is None:
+            matched_keys.add(addr_key)
+        osm_addr, addr_distance = min(
+            (
+                (osm_addr, distance(emapa_addr.point, osm_addr.point))
+                for osm_addr in osm_candidates
+            ),
+            key=itemgetter(1)
+        )
+        differences = _addr_differences(
+            emapa_addr,
+            osm_addr,
+            addr_distance,
+            matched_max_distance
+        )
+        if differences:
+            matched_with_differences.append(MatchedAddress(
+                emapa_address=emapa_addr,
+                osm_address=osm_addr,
+                differences=differences,
+                distance=addr_distance
+            ))
+
+    return JoinResult(
+        missing_emapa_addresses=missing_emapa_addresses,
+        matched_with_differences=matched_with_differences,
+        matched_keys=matched_keys,
+        matched_osm_positions=matched_osm_positions
+    )
+
+
+def _split_distant_duplicates(
+    duplicated_osm_addresses: List[List[OsmAddress]],
+    max_distance: float
+) -> Tuple[List[List[OsmAddress]], List[List[OsmAddress]]]:
+    """
+    :return: (duplicates within max_distance, same addresses far apart)
+    """
+    duplicates = []
+    distant = []
+    for block in duplicated_osm_addresses:
+        clusters = cluster_points([addr.point for addr in block], max_distance)
+        for cluster in clusters:
+            if len(cluster) > 1:
+                duplicates.append([block[i] for i in cluster])
+
+        if len(clusters) > 1:
+            distant.append(block)
+
+    return duplicates, distant
+
+
+def analyze_addresses(
+    emapa_addresses: List[Address],
+    osm_addresses: List[OsmAddress],
+    duplicates_exclude_poi: bool = False,
+    key: KeyFunc = attrgetter('min_unique'),
+    duplicates_max_distance: Optional[float] = None,
+    matched_max_distance: float = MATCHED_MAX_DISTANCE,
+    compact_keys: bool = False
+) -> AddressesAnalysis:
+    """
+    Computes in single pass over OSM addresses the same results as
+    addr_type_distribution, addr_tags_distribution, addr_duplicates and
+    addr_missing (in both directions – using one addr_join).
+
+    :param duplicates_exclude_poi: skip addresses on POI objects (except
+        buildings) in duplicates
+    :param key: function which returns address matching key
+    :param duplicates_max_distance: if set (in metres), duplicates are only
+        addresses closer than it, others are returned as distant addresses
+    :param matched_max_distance: see addr_join
+    :param compact_keys: use indexes of 64-bit key hashes instead of keys
+        strings (less memory, more CPU)
+    """
+    if compact_keys:
+        return _analyze_addresses_compact(
+            emapa_addresses,
+            osm_addresses,
+            duplicates_exclude_poi,
+            key,
+            duplicates_max_distance,
+            matched_max_distance
+        )
+
+    osm_type = Counter()
+    tags = Counter()
+    osm_keys: List[str] = []
+    osm_index: Dict[str, List[OsmAddress]] = dict()
+    duplicated_osm_addr: Dict[str, List[OsmAddress]] = dict()
+
+    for osm_addr in osm_addresses:
+        osm_type[osm_addr.osm_type] += 1
+        for tag_key in osm_addr.all_obj_tags.keys():
+            if is_addr_tag(tag_key):
+                tags[tag_key] += 1
+
+        addr_key = key(osm_addr)
+        osm_keys.append(addr_key)
+        if addr_key not in osm_index:
+            osm_index[addr_key] = []
+
+        osm_index[addr_key].append(osm_addr)
+
+        if duplicates_exclude_poi and is_excluded_poi(osm_addr):
+            continue
+
+        if addr_key not in duplicated_osm_addr:
+            duplicated_osm_addr[addr_key] = []
+
+        duplicated_osm_addr[addr_key].append(osm_addr)
+
+    join = addr_join(osm_index, emapa_addresses, key, matched_max_distance)
+    # OSM addresses keys which are not in the e-mapa can't be matched
+    excess_osm_addresses = [
+        osm_addr
+        for osm_addr, addr_key in zip(osm_addresses, osm_keys)
+        if addr_key not in join.matched_keys
+    ]
+
+    duplicates = [v for v in duplicated_osm_addr.values() if len(v) > 1]
+    distant = []
+    if duplicates_max_distance is not None:
+        duplicates, distant = _split_distant_duplicates(
+            duplicates,
+            duplicates_max_distance
+        )
+
+    return AddressesAnalysis(
+        osm_type_distribution=osm_type,
+        osm_tags_distribution=tags,
+        duplicated_osm_addresses=duplicates,
+        distant_osm_addresses=distant,
+        missing_emapa_addresses=join.missing_emapa_addresses,
+        excess_osm_addresses=excess_osm_addresses,
+        matched_with_differences=join.matched_with_differences
+    )
+
+
+def _analyze_addresses_compact(
+    emapa_addresses: List[Address],
+    osm_addresses: List[OsmAddress],
+    duplicates_exclude_poi: bool,
+    key: KeyFunc,
+    duplicates_max_distance: Optional[float],
+    matched_max_distance: float
+) -> AddressesAnalysis:
+    """
+    Same as analyze_addresses, but keys strings are not stored
+    (only KeyHashIndex with 64-bit hashes of keys)
+    """
+    osm_type = Counter()
+    tags = Counter()
+    duplicates_candidates: List[OsmAddress] = []
+
+    for osm_addr in osm_addresses:
+        osm_type[osm_addr.osm_type] += 1
+        for tag_key in osm_addr.all_obj_tags.keys():
+            if is_addr_tag(tag_key):
+                tags[tag_key] += 1
+
+        if duplicates_exclude_poi and is_excluded_poi(osm_addr):
+            continue
+
+        duplicates_candidates.append(osm_addr)
+
+    osm_index = KeyHashIndex(osm_addresses, key)
+    if duplicates_exclude_poi:
+        duplicates_index = KeyHashIndex(duplicates_candidates, key)
+    else:
+        duplicates_index = osm_index
+
+    duplicates = [
+        [duplicates_candidates[position] for position in positions]
+        for positions in duplicates_index.duplicated_positions()
+    ]
+    distant = []
+    if duplicates_max_distance is not None:
+        duplicates, distant = _split_distant_duplicates(
+            duplicates,
+            duplicates_max_distance
+        )
+
+    join = addr_join(osm_index, emapa_addresses, key, matched_max_distance)
+
+    return AddressesAnalysis(
+        osm_type_distribution=osm_type,
+        osm_tags_distribution=tags,
+        duplicated_osm_addresses=duplicates,
+        distant_osm_addresses=distant,
+        missing_emapa_addresses=join.missing_emapa_addresses,
+        # OSM addresses not marked by the join (without second pass)
+        excess_osm_addresses=[
+            osm_addr
+            for osm_addr, matched in zip(
+                osm_addresses,
+                join.matched_osm_positions
+            )
+            if not matched
+        ],
+        matched_with_differences=join.matched_with_differences
+    )
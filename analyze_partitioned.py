@@ -0,0 +1,368 @@
+import math
+import os
+import pickle
+
+from collections import Counter
+from collections.abc import Sized
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass
+from operator import attrgetter, itemgetter
+from os import path
+from tempfile import TemporaryDirectory
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+from address import Address, OsmAddress
+from analyze import (
+    AddressesAnalysis,
+    analyze_addresses,
+    is_addr_tag,
+    is_excluded_poi,
+    KeyFunc,
+    MatchedAddress,
+    MATCHED_MAX_DISTANCE
+)
+from config import gettext as _, logger
+from utils.key_hash import key_hash
+
+
+# Number of partitions if sizes of datasets aren't known (e.g. generators)
+PARTITIONS = 64
+# Max number of files written at once by one spill (open files limit)
+MAX_PARTITIONS = 256
+# Approx. pickled size of an address, used to estimate number of partitions
+SPILL_BYTES_PER_ADDRESS = 400
+# Approx. ratio of memory used by loaded addresses to their pickled size
+MEMORY_PER_SPILL_BYTE = 4
+# Max number of successive splits of a partition exceeding memory budget
+MAX_SPLIT_DEPTH = 4
+
+_Record = Tuple[int, Address]  # index in the input dataset, address
+
+
+@dataclass
+class _Partition:
+    spill_dir: str
+    name: str
+    # product of partitions counts of all splits which created the
+    # partition, next split uses the following digits of the key hash
+    hash_divisor: int
+
+    def filename(self, dataset: str) -> str:
+        return path.join(self.spill_dir, f'{dataset}_{self.name}.pickle')
+
+    def memory(self) -> int:
+        """
+        :return: estimated memory (bytes) of the loaded partition
+        """
+        return MEMORY_PER_SPILL_BYTE * sum(
+            path.getsize(self.filename(dataset))
+            for dataset in ('emapa', 'osm')
+        )
+
+
+@dataclass
+class _PartitionResult:
+    # addresses with their indexes in the input datasets (for ordering)
+    missing_emapa_addresses: List[_Record]
+    excess_osm_addresses: List[_Record]
+    # e-mapa index, matched address
+    matched_with_differences: List[Tuple[int, MatchedAddress]]
+    # ordering key (first index of key group, first index of block), block
+    duplicated_osm_addresses: List[Tuple[Tuple[int, int], List[OsmAddress]]]
+    distant_osm_addresses: List[Tuple[Tuple[int, int], List[OsmAddress]]]
+
+
+def _partition_of(addr_key: str, hash_divisor: int, partitions: int) -> int:
+    # key_hash – stable between processes (unlike hash() of str)
+    return key_hash(addr_key) // hash_divisor % partitions
+
+
+def _iter_spill_file(filename: str) -> Iterator[_Record]:
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def _spill(
+    records: Iterable[_Record],
+    partitions: List[_Partition],
+    dataset: str,
+    key: KeyFunc,
+    hash_divisor: int,
+    osm_type: Optional[Counter] = None,
+    tags: Optional[Counter] = None
+) -> None:
+    """
+    Writes (index, address) records to files of partitions by key hash in
+    one pass, so records can be streamed. Optionally counts OSM type and
+    tags distribution in the same pass.
+
+    :param dataset: 'emapa' or 'osm'
+    :param hash_divisor: key hash is divided by it before partitioning
+    """
+    with ExitStack() as stack:
+        files = [
+            stack.enter_context(open(partition.filename(dataset), 'wb'))
+            for partition in partitions
+        ]
+        for record in records:
+            addr = record[1]
+            if osm_type is not None:
+                osm_type[addr.osm_type] += 1
+                tags.update(filter(is_addr_tag, addr.all_obj_tags.keys()))
+
+            pickle.dump(
+                record,
+                files[_partition_of(key(addr), hash_divisor, len(files))],
+                protocol=pickle.HIGHEST_PROTOCOL
+            )
+
+
+def _create_partitions(
+    spill_dir: str,
+    name_prefix: str,
+    hash_divisor: int,
+    count: int
+) -> List[_Partition]:
+    return [
+        _Partition(spill_dir, f'{name_prefix}{i}', hash_divisor)
+        for i in range(count)
+    ]
+
+
+def _split_partition(
+    partition: _Partition,
+    memory_budget: int,
+    key: KeyFunc,
+    depth: int = 0
+) -> List[_Partition]:
+    """
+    Splits partition exceeding memory budget (recursively) by the next
+    digits of key hash, so addresses with the same key stay together – a
+    key group bigger than memory budget can't be split (warning).
+
+    :return: partitions replacing the given partition
+    """
+    memory = partition.memory()
+    if memory <= memory_budget:
+        return [partition]
+    if depth >= MAX_SPLIT_DEPTH:
+        logger.warning(
+            _('Partition needs ~{} MB which exceeds memory budget.')
+            .format(math.ceil(memory / 2 ** 20))
+        )
+        return [partition]
+
+    count = min(math.ceil(memory / memory_budget), MAX_PARTITIONS)
+    parts = _create_partitions(
+        partition.spill_dir,
+        f'{partition.name}_',
+        partition.hash_divisor * count,
+        count
+    )
+    for dataset in ('emapa', 'osm'):
+        _spill(
+            _iter_spill_file(partition.filename(dataset)),
+            parts,
+            dataset,
+            key,
+            partition.hash_divisor
+        )
+        os.remove(partition.filename(dataset))
+
+    splits = []
+    for part in parts:
+        if part.memory() == 0:
+            for dataset in ('emapa', 'osm'):
+                os.remove(part.filename(dataset))
+        else:
+            splits += _split_partition(part, memory_budget, key, depth + 1)
+
+    return splits
+
+
+def _analyze_partition(
+    partition: _Partition,
+    duplicates_exclude_poi: bool,
+    key: KeyFunc,
+    duplicates_max_distance: Optional[float],
+    matched_max_distance: float,
+    compact_keys: bool
+) -> _PartitionResult:
+    emapa_records = list(_iter_spill_file(partition.filename('emapa')))
+    osm_records = list(_iter_spill_file(partition.filename('osm')))
+
+    indexes = {
+        id(addr): index for index, addr in emapa_records + osm_records
+    }
+    # first index of key group used by duplicates (same order as in-memory)
+    group_first_index = dict()
+    for index, osm_addr in osm_records:
+        if duplicates_exclude_poi and is_excluded_poi(osm_addr):
+            continue
+        group_first_index.setdefault(key(osm_addr), index)
+
+    analysis = analyze_addresses(
+        [addr for _index, addr in emapa_records],
+        [addr for _index, addr in osm_records],
+        duplicates_exclude_poi,
+        key,
+        duplicates_max_distance,
+        matched_max_distance,
+        compact_keys
+    )
+
+    def with_index(addresses: List[Address]) -> List[_Record]:
+        return [(indexes[id(addr)], addr) for addr in addresses]
+
+    def with_order(
+        blocks: List[List[OsmAddress]]
+    ) -> List[Tuple[Tuple[int, int], List[OsmAddress]]]:
+        return [
+            (
+                (group_first_index[key(block[0])], indexes[id(block[0])]),
+                block
+            )
+            for block in blocks
+        ]
+
+    return _PartitionResult(
+        missing_emapa_addresses=with_index(analysis.missing_emapa_addresses),
+        excess_osm_addresses=with_index(analysis.excess_osm_addresses),
+        matched_with_differences=[
+            (indexes[id(matched.emapa_address)], matched)
+            for matched in analysis.matched_with_differences
+        ],
+        duplicated_osm_addresses=with_order(analysis.duplicated_osm_addresses),
+        distant_osm_addresses=with_order(analysis.distant_osm_addresses)
+    )
+
+
+def _estimate_partitions(
+    emapa_addresses: Iterable[Address],
+    osm_addresses: Iterable[OsmAddress],
+    memory_budget: int
+) -> int:
+    """
+    :return: number of partitions which fit into memory budget (at least one
+        per CPU), PARTITIONS if sizes of datasets aren't known
+    """
+    if not isinstance(emapa_addresses, Sized) or \
+            not isinstance(osm_addresses, Sized):
+        return PARTITIONS
+
+    memory = MEMORY_PER_SPILL_BYTE * SPILL_BYTES_PER_ADDRESS * (
+        len(emapa_addresses) + len(osm_addresses)
+    )
+    return min(
+        max(math.ceil(memory / memory_budget), os.cpu_count() or 1),
+        MAX_PARTITIONS
+    )
+
+
+def analyze_addresses_partitioned(
+    emapa_addresses: Iterable[Address],
+    osm_addresses: Iterable[OsmAddress],
+    memory_budget: int,
+    duplicates_exclude_poi: bool = False,
+    key: KeyFunc = attrgetter('min_unique'),
+    duplicates_max_distance: Optional[float] = None,
+    matched_max_distance: float = MATCHED_MAX_DISTANCE,
+    spill_dir: Optional[str] = None,
+    partitions: Optional[int] = None,
+    compact_keys: bool = False
+) -> AddressesAnalysis:
+    """
+    Partitioned version of analyze_addresses with identical results.
+    Both datasets are streamed (iterated once) into spill files
+    hash-partitioned by key, so all addresses with the same key are in the
+    same partition. Partitions exceeding memory budget are split again.
+    Partitions are analyzed independently in parallel processes (as many as
+    fit into memory budget) and results are merged in the input order.
+
+    Datasets can be generators (e.g. parsers.prg.iter_prg_addresses), then
+    neither of them is held in memory. Results contain copies of addresses
+    loaded from the spill files.
+
+    :param memory_budget: max memory (bytes) of partitions analyzed
+        concurrently by worker processes (without memory of the calling
+        process)
+    :param key: picklable function which returns address matching key
+    :param spill_dir: directory for temporary spill files (default: system)
+    :param partitions: initial number of partitions (default: estimated by
+        sizes of datasets and memory budget)
+    :param compact_keys: see analyze_addresses
+    """
+    if partitions is None:
+        partitions = _estimate_partitions(
+            emapa_addresses,
+            osm_addresses,
+            memory_budget
+        )
+    osm_type = Counter()
+    tags = Counter()
+
+    with TemporaryDirectory(dir=spill_dir) as tmp_dir:
+        spilled = _create_partitions(tmp_dir, '', partitions, partitions)
+        _spill(enumerate(emapa_addresses), spilled, 'emapa', key, 1)
+        _spill(
+            enumerate(osm_addresses),
+            spilled,
+            'osm',
+            key,
+            1,
+            osm_type,
+            tags
+        )
+        analyzed = [
+            split
+            for partition in spilled
+            for split in _split_partition(partition, memory_budget, key)
+        ]
+
+        partition_memory = max(partition.memory() for partition in analyzed)
+        max_workers = max(1, min(
+            memory_budget // max(partition_memory, 1),
+            os.cpu_count() or 1
+        ))
+        logger.debug(
+            f'Analyzing {len(analyzed)} partitions using {max_workers} '
+            f'processes'
+        )
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results: List[_PartitionResult] = list(executor.map(
+                _analyze_partition,
+                analyzed,
+                *[
+                    [arg] * len(analyzed)
+                    for arg in (
+                        duplicates_exclude_poi,
+                        key,
+                        duplicates_max_distance,
+                        matched_max_distance,
+                        compact_keys
+                    )
+                ]
+            ))
+
+    def merge(attr: str) -> List[Any]:
+        records = []
+        for result in results:
+            records.extend(getattr(result, attr))
+
+        return [value for _order, value in sorted(records, key=itemgetter(0))]
+
+    return AddressesAnalysis(
+        osm_type_distribution=osm_type,
+        osm_tags_distribution=tags,
+        duplicated_osm_addresses=merge('duplicated_osm_addresses'),
+        distant_osm_addresses=merge('distant_osm_addresses'),
+        missing_emapa_addresses=merge('missing_emapa_addresses'),
+        excess_osm_addresses=merge('excess_osm_addresses'),
+        matched_with_differences=merge('matched_with_differences')
+    )
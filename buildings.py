@@ -0,0 +1,299 @@
+import math
+
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Any, Dict, List, Optional, Tuple
+
+from address import Address, OsmType, Point
+from analyze import KeyFunc
+from utils.geo import METRES_PER_DEGREE
+from utils.rtree import BBox, RTree
+
+
+# Missing addresses farther than it (metres) from all buildings are not
+# assigned to any building
+BUILDINGS_MAX_DISTANCE = 50.0
+
+# (lon, lat) or projected (x, y) in metres
+Coordinates = Tuple[float, float]
+Ring = List[Coordinates]
+
+
+@dataclass
+class Building:
+    osm_id: int
+    osm_type: OsmType
+    rings: List[Ring]  # closed rings (lon, lat), outer and inner
+    tags: Dict[str, str]
+
+    @property
+    def shorten_osm_obj(self) -> str:
+        return {OsmType.WAY: 'w', OsmType.RELATION: 'r'}[self.osm_type] \
+            + str(self.osm_id)
+
+    def address(self) -> Optional[Address]:
+        """
+        :return: address from tags of the building or None if it has no
+            housenumber
+        """
+        if 'addr:housenumber' not in self.tags:
+            return None
+
+        if 'addr:street' in self.tags:
+            city = self.tags.get('addr:city', None)
+        else:
+            city = self.tags.get('addr:place', None)
+
+        lon, lat = self.rings[0][0]
+        return Address(
+            point=Point(lat, lon),
+            city_simc=self.tags.get('addr:city:simc', None),
+            housenumber=self.tags['addr:housenumber'],
+            postcode=self.tags.get('addr:postcode', None),
+            city=city,
+            street=self.tags.get('addr:street', None),
+            source=self.tags.get('source:addr', None)
+        )
+
+
+@dataclass
+class BuildingAssignment:
+    emapa_address: Address
+    building: Optional[Building]  # None – no building within max distance
+    inside: bool
+    distance: float  # metres, 0 if inside
+    # building has address (with other matching key than e-mapa address)
+    conflict: bool
+
+
+def _geometry_coordinates(
+    geometry: List[Optional[Dict[str, float]]]
+) -> Ring:
+    # Overpass returns null for nodes outside of the bbox of split query
+    return [(node['lon'], node['lat']) for node in geometry if node]
+
+
+def _assemble_rings(ways: List[Ring]) -> List[Ring]:
+    """
+    :param ways: ways of multipolygon members (closed or parts of rings)
+    :return: closed rings joined from ways by their end nodes (unclosed
+        rings are skipped)
+    """
+    rings = []
+    open_ways = []
+    for way in ways:
+        if len(way) >= 4 and way[0] == way[-1]:
+            rings.append(way)
+        elif len(way) >= 2:
+            open_ways.append(way)
+
+    while open_ways:
+        ring = list(open_ways.pop())
+        while ring[0] != ring[-1]:
+            for i, way in enumerate(open_ways):
+                if way[0] == ring[-1]:
+                    ring.extend(way[1:])
+                    break
+                if way[-1] == ring[-1]:
+                    ring.extend(reversed(way[:-1]))
+                    break
+            else:
+                break
+
+            del open_ways[i]
+
+        if len(ring) >= 4 and ring[0] == ring[-1]:
+            rings.append(ring)
+
+    return rings
+
+
+def parse_buildings(elements: List[Dict[str, Any]]) -> List[Building]:
+    """
+    :param elements: Overpass ways and multipolygon relations with geometry
+        (out geom)
+    :return: buildings with at least one closed ring
+    """
+    buildings = []
+    for element in elements:
+        if element['type'] == 'way':
+            rings = _assemble_rings(
+                [_geometry_coordinates(element.get('geometry', []))]
+            )
+        else:
+            rings = _assemble_rings([
+                _geometry_coordinates(member.get('geometry', []))
+                for member in element.get('members', [])
+                if member['type'] == 'way'
+            ])
+
+        if rings:
+            buildings.append(Building(
+                osm_id=element['id'],
+                osm_type=OsmType(element['type']),
+                rings=rings,
+                tags=element.get('tags', {})
+            ))
+
+    return buildings
+
+
+def _contains(rings: List[Ring], x: float, y: float) -> bool:
+    # even-odd rule – points in inner rings (holes) are outside
+    inside = False
+    for ring in rings:
+        x1, y1 = ring[0]
+        for x2, y2 in ring[1:]:
+            if (y1 > y) != (y2 > y) \
+                    and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+                inside = not inside
+            x1, y1 = x2, y2
+
+    return inside
+
+
+def _segment_distance(
+    x: float, y: float,
+    x1: float, y1: float,
+    x2: float, y2: float
+) -> float:
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    t = 0.0
+    if length2 > 0:
+        t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length2))
+
+    return math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def _area(rings: List[Ring]) -> float:
+    # shoelace, outer and inner rings (without holes subtraction)
+    return sum(
+        abs(sum(
+            x1 * y2 - x2 * y1
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:])
+        )) / 2
+        for ring in rings
+    )
+
+
+@dataclass
+class _IndexedBuilding:
+    building: Building
+    rings: List[Ring]  # projected
+    area: float
+
+    def distance(self, x: float, y: float) -> float:
+        if _contains(self.rings, x, y):
+            return 0.0
+
+        return min(
+            _segment_distance(x, y, x1, y1, x2, y2)
+            for ring in self.rings
+            for (x1, y1), (x2, y2) in zip(ring, ring[1:])
+        )
+
+
+class BuildingIndex:
+    """
+    R-tree of buildings in local planar projection (metres), accurate
+    enough for distances within a commune.
+    """
+    def __init__(self, buildings: List[Building]):
+        mean_lat = 0.0
+        if buildings:
+            mean_lat = sum(b.rings[0][0][1] for b in buildings) \
+                / len(buildings)
+        self.x_scale = METRES_PER_DEGREE * math.cos(math.radians(mean_lat))
+        self.y_scale = METRES_PER_DEGREE
+
+        entries: List[Tuple[BBox, _IndexedBuilding]] = []
+        for building in buildings:
+            rings = [
+                [self.project(lon, lat) for lon, lat in ring]
+                for ring in building.rings
+            ]
+            xs = [x for ring in rings for x, _y in ring]
+            ys = [y for ring in rings for _x, y in ring]
+            entries.append((
+                (min(xs), min(ys), max(xs), max(ys)),
+                _IndexedBuilding(building, rings, _area(rings))
+            ))
+        self._tree: RTree[_IndexedBuilding] = RTree(entries)
+
+    def project(self, lon: float, lat: float) -> Coordinates:
+        return lon * self.x_scale, lat * self.y_scale
+
+    def find(
+        self,
+        point: Point,
+        max_distance: float
+    ) -> Optional[Tuple[Building, float]]:
+        """
+        :return: the smallest building containing the point (distance 0)
+            or the nearest one within max_distance (metres)
+        """
+        x, y = self.project(point.lon, point.lat)
+        containing = [
+            indexed for indexed in self._tree.search_point(x, y)
+            if _contains(indexed.rings, x, y)
+        ]
+        if containing:
+            return min(containing, key=attrgetter('area')).building, 0.0
+
+        nearest = self._tree.nearest(
+            x,
+            y,
+            _IndexedBuilding.distance,
+            max_distance
+        )
+        if nearest is None:
+            return None
+
+        indexed, building_distance = nearest
+        return indexed.building, building_distance
+
+
+def assign_buildings(
+    addresses: List[Address],
+    buildings: List[Building],
+    key: KeyFunc = attrgetter('min_unique'),
+    max_distance: float = BUILDINGS_MAX_DISTANCE
+) -> List[BuildingAssignment]:
+    """
+    Assigns each address to the building which contains it or, if there is
+    no such building, to the nearest one.
+
+    :param key: function which returns address matching key, building
+        address with other key is a conflict
+    :param max_distance: max distance (metres) to the nearest building
+    :return: assignment of each address (in the same order)
+    """
+    index = BuildingIndex(buildings)
+    assignments = []
+    for addr in addresses:
+        found = index.find(addr.point, max_distance)
+        if found is None:
+            assignments.append(BuildingAssignment(
+                emapa_address=addr,
+                building=None,
+                inside=False,
+                distance=0.0,
+                conflict=False
+            ))
+            continue
+
+        building, building_distance = found
+        building_address = building.address()
+        assignments.append(BuildingAssignment(
+            emapa_address=addr,
+            building=building,
+            inside=building_distance == 0.0,
+            distance=building_distance,
+            conflict=(
+                building_address is not None
+                and key(building_address) != key(addr)
+            )
+        ))
+
+    return assignments
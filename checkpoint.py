@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import pathlib
+import pickle
+import time
+import uuid
+
+from os import path
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Sequence,
+    TypeVar
+)
+
+from config import gettext as _, logger
+from utils.compression import (
+    compressed_filename,
+    NO_COMPRESSION,
+    open_compressed
+)
+
+
+# Increase when format of stored stages changes (e.g. Address fields)
+CHECKPOINT_VERSION = 2
+MANIFEST_FILENAME = 'manifest.json'
+# hours, downloaded data stored in checkpoints is downloaded again after it
+CHECKPOINTS_MAX_AGE = 24.0
+
+T = TypeVar('T')
+
+
+class Checkpoints:
+    """
+    Results of the diff stages stored in a directory with manifest.
+    A stage is reused if its key (values of inputs e.g. options and ids of
+    results of upstream stages) didn't change, so changed options recompute
+    only stages which use them (and stages which depend on them).
+    """
+    def __init__(self, directory: str, compression: str = NO_COMPRESSION):
+        """
+        :param compression: of stored stages, see utils.compression
+        """
+        self.directory = directory
+        self.compression = compression
+        self.manifest_filename = path.join(directory, MANIFEST_FILENAME)
+        self.stages: Dict[str, Dict[str, Any]] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.manifest_filename, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return dict()
+
+        if manifest.get('version') != CHECKPOINT_VERSION:
+            logger.info(
+                _('Ignoring checkpoints with different version: {}').format(
+                    self.directory
+                )
+            )
+            return dict()
+
+        return manifest['stages']
+
+    def _save_manifest(self) -> None:
+        # write and rename to not lose manifest if process is killed
+        with open(self.manifest_filename + '.tmp', 'w') as f:
+            json.dump(
+                {'version': CHECKPOINT_VERSION, 'stages': self.stages},
+                f,
+                indent=2
+            )
+        os.replace(self.manifest_filename + '.tmp', self.manifest_filename)
+
+    def _stage_filename(self, name: str) -> str:
+        return compressed_filename(
+            path.join(self.directory, f'{name}.pickle'),
+            self.compression
+        )
+
+    def stage_key(
+        self,
+        inputs: Sequence[Any],
+        depends: Iterable[str] = ()
+    ) -> str:
+        """
+        :param inputs: json serializable values used by the stage
+        :param depends: names of upstream stages (must be already stored)
+        """
+        values = [list(inputs), [self.stages[d]['id'] for d in depends]]
+        return hashlib.sha256(
+            json.dumps(values, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def stage(
+        self,
+        name: str,
+        inputs: Sequence[Any],
+        compute: Callable[[], T],
+        depends: Iterable[str] = (),
+        max_age: Optional[float] = None,
+        is_valid: Optional[Callable[[T], bool]] = None
+    ) -> T:
+        """
+        Loads result of the stage or computes and stores it.
+
+        :param name: unique name of the stage
+        :param inputs: json serializable values used by compute
+        :param compute: function which returns picklable result of the stage
+        :param depends: names of upstream stages
+        :param max_age: seconds, older result is computed again (e.g.
+            downloaded data)
+        :param is_valid: function which checks if the stored result can be
+            reused (e.g. files created by the stage still exist)
+        """
+        key = self.stage_key(inputs, depends)
+        record = self.stages.get(name)
+        if record is not None and record['key'] == key:
+            if max_age is not None \
+                    and time.time() - record.get('created', 0) > max_age:
+                logger.info(_('Expired checkpoint of stage: {}').format(name))
+            else:
+                try:
+                    # stored with compression of the run which computed it
+                    with open_compressed(record['file'], 'rb') as f:
+                        result = pickle.load(f)
+                    if is_valid is None or is_valid(result):
+                        logger.info(
+                            _('Loaded checkpoint of stage: {}').format(name)
+                        )
+                        return result
+
+                    logger.info(
+                        _('Outdated checkpoint of stage: {}').format(name)
+                    )
+                except (IOError, pickle.UnpicklingError, EOFError):
+                    logger.warning(
+                        _('Couldn\'t load checkpoint of stage: {}').format(
+                            name
+                        )
+                    )
+
+        result = compute()
+
+        filename = self._stage_filename(name)
+        pathlib.Path(self.directory).mkdir(parents=True, exist_ok=True)
+        # temporary name with the same suffix (compression)
+        tmp_filename = path.join(
+            self.directory,
+            'tmp.' + path.basename(filename)
+        )
+        with open_compressed(tmp_filename, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, filename)
+        if record is not None and record.get('file', filename) != filename:
+            try:
+                os.remove(record['file'])
+            except OSError:
+                pass
+
+        # new id invalidates all downstream stages
+        self.stages[name] = {
+            'key': key,
+            'id': uuid.uuid4().hex,
+            'file': filename,
+            'created': time.time()
+        }
+        self._save_manifest()
+        logger.debug(f'Saved checkpoint of stage: {name}')
+
+        return result
+
+    def invalidate(self, *names: str) -> None:
+        """
+        Forces recomputing of given stages (e.g. when source data changed)
+        and, as a result, all stages which depend on them.
+        """
+        if not any(name in self.stages for name in names):
+            return
+
+        for name in names:
+            self.stages.pop(name, None)
+        self._save_manifest()
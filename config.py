@@ -1,9 +1,15 @@
+from functools import lru_cache
 from logging import Formatter, getLogger, LogRecord, INFO, StreamHandler
-from gettext import bindtextdomain, textdomain, translation
+from gettext import (
+    bindtextdomain,
+    NullTranslations,
+    textdomain,
+    translation
+)
 from locale import getdefaultlocale
 from os import path
 from sys import stdout
-from typing import Final
+from typing import Final, Optional
 
 
 class Config:
@@ -12,16 +18,6 @@ class Config:
     DATA_DIR: Final = path.join(ROOT_DIR, 'data')
     OUTPUT_BASE: Final = path.join(ROOT_DIR, 'out')
 
-    TERYT_TERC: str = ''  # commune (gmina) id – 7 characters str
-    AREA_NAME: str = ''   # area name from teryt – commune (gmina) name
-    OUTPUT_DIR: str = ''  # path for all output files
-
-    DUPLICATES_EXCLUDE_POI: bool = False
-    NO_STREET_NAMES_UPDATE_CHECK: bool = False
-    NO_STREET_ALT_NAMES_REPLACE: bool = False
-    IGNORE_CASE_SENSITIVE_HOUSENUMBER: bool = False
-    IGNORE_STREET_FEATURES: bool = False
-
 
 class SimpleFormatter(Formatter):
     """
@@ -57,13 +53,40 @@ logger.setLevel(INFO)
 logger.addHandler(_logger_handler)
 
 
-_lang_translations: Final = translation(
-    'base',
-    localedir=Config.TRANSLATION_DIR,
-    languages=[getdefaultlocale()[0]]
-)
-# https://stackoverflow.com/a/35964548
-bindtextdomain('argparse', Config.TRANSLATION_DIR)
-textdomain('argparse')
-_lang_translations.install()
-gettext: Final = _lang_translations.gettext
+# Translations are loaded only by setup_locale() (e.g. CLI entry point),
+# library/worker code paths use untranslated messages.
+_lang_translations: NullTranslations = NullTranslations()
+
+
+@lru_cache(maxsize=None)
+def _load_translations(language: Optional[str]) -> NullTranslations:
+    return translation(
+        'base',
+        localedir=Config.TRANSLATION_DIR,
+        languages=[language] if language else None,
+        fallback=True
+    )
+
+
+def setup_locale(language: Optional[str] = None) -> None:
+    """
+    Loads translations (once per process) for user messages and argparse,
+    and installs _ into builtins.
+
+    :param language: e.g. pl_PL, None – default system locale
+    """
+    global _lang_translations
+
+    if language is None:
+        language = getdefaultlocale()[0]
+
+    _lang_translations = _load_translations(language)
+
+    # https://stackoverflow.com/a/35964548
+    bindtextdomain('argparse', Config.TRANSLATION_DIR)
+    textdomain('argparse')
+    _lang_translations.install()
+
+
+def gettext(message: str) -> str:
+    return _lang_translations.gettext(message)
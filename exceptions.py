@@ -1,5 +1,42 @@
-class ServiceNotFound(Exception):
+class DiffError(Exception):
+    """
+    Base exception for errors which stop addresses diff of a commune
+    """
+    pass
+
+
+class ServiceNotFound(DiffError):
     """
     Raises when e.g commune use different addresses system (e.g. geoportal)
     """
     pass
+
+
+class PrgDataError(DiffError):
+    """
+    Raises when PRG addresses of the commune couldn't be read from the index
+    or the PRG CSV file doesn't have required columns
+    """
+    pass
+
+
+class DiffCancelled(DiffError):
+    """
+    Raises when the diff was cancelled before its next stage (e.g. job of
+    the worker was leased by other worker)
+    """
+    pass
+
+
+class EmapaDownloadError(DiffError):
+    """
+    Raises when e-mapa data couldn't be downloaded or saved
+    """
+    pass
+
+
+class OverpassDownloadError(DiffError):
+    """
+    Raises when OSM data couldn't be downloaded from the Overpass API
+    """
+    pass
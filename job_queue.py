@@ -0,0 +1,549 @@
+import multiprocessing
+import os
+import pathlib
+import socket
+import sys
+import uuid
+
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager, suppress
+from functools import partial
+from os import path
+from threading import Event, Thread
+from time import sleep, time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config, gettext as _, logger, setup_locale
+from exceptions import DiffCancelled
+from main import (
+    add_diff_arguments,
+    check_teryt_terc,
+    create_diff_options,
+    positive_int,
+    run_diff
+)
+from utils.overpass import set_request_slot
+from utils.street_names_mappings import update_street_names_mappings
+
+
+QUEUE_DIR = path.join(Config.OUTPUT_BASE, 'queue')
+
+LEASE_DURATION = 300  # seconds, job is released if worker doesn't heartbeat
+HEARTBEAT_INTERVAL = 60  # seconds
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 5  # seconds of waiting for a job or an Overpass slot
+
+OVERPASS_SLOTS = 2  # default rate limit of overpass-api.de
+# Slot is held for the whole request (query timeout is 900 s), the lease
+# only releases slots of killed workers
+OVERPASS_SLOT_LEASE = 1200  # seconds
+
+# Statuses of jobs – directories of the queue
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+_SLOTS = 'overpass_slots'
+
+# Fields of job filenames: <teryt_terc>@<attempts>[@<worker>]
+_SEPARATOR = '@'
+
+
+def _job_filename(teryt_terc: str, attempts: int, worker: str = '') -> str:
+    fields = [teryt_terc, str(attempts)] + ([worker] if worker else [])
+    return _SEPARATOR.join(fields)
+
+
+def _parse_job_filename(filename: str) -> Tuple[str, int, str]:
+    """
+    :return: teryt_terc, attempts, worker ('' if not leased)
+    """
+    teryt_terc, attempts, *worker = filename.split(_SEPARATOR, 2)
+    return teryt_terc, int(attempts), ''.join(worker)
+
+
+class JobQueue:
+    """
+    Queue of communes to diff in a directory shared by workers of many
+    processes, also on many hosts (e.g. NFS). Each job is a file in the
+    directory of its status, jobs change status only by atomic rename, so
+    only one worker succeeds when many workers lease the same job.
+    A job is leased by a worker and extended by heartbeats (modification
+    time of the leased file), so jobs of killed workers are leased again
+    after lease expires – clocks of hosts must be synchronized (e.g. NTP).
+    The directory contains also files of Overpass requests slots
+    (exclusively created) to limit concurrent requests of all workers.
+    """
+    def __init__(
+        self,
+        directory: str = QUEUE_DIR,
+        lease_duration: float = LEASE_DURATION
+    ):
+        """
+        :param lease_duration: seconds after which a job is released if its
+            worker doesn't heartbeat
+        """
+        self.directory = directory
+        self.lease_duration = lease_duration
+        for status in (PENDING, LEASED, DONE, FAILED, _SLOTS):
+            pathlib.Path(directory, status).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, status: str, filename: str = '') -> str:
+        return path.join(self.directory, status, filename)
+
+    def _jobs(self, status: str) -> List[str]:
+        return sorted(os.listdir(self._path(status)))
+
+    def _modified(self, status: str, filename: str) -> Optional[float]:
+        """
+        :return: modification time of the file (start of its lease) or None
+            if it was renamed or removed by other worker in the meantime
+        """
+        try:
+            return path.getmtime(self._path(status, filename))
+        except FileNotFoundError:
+            return None
+
+    def _leased_filename(self, teryt_terc: str, worker: str) -> Optional[str]:
+        for filename in self._jobs(LEASED):
+            leased_terc, _attempts, leased_worker = \
+                _parse_job_filename(filename)
+            if leased_terc == teryt_terc and leased_worker == worker:
+                return filename
+        return None
+
+    def add(self, teryt_tercs: List[str]) -> None:
+        """
+        Adds communes as pending jobs (also resets already added ones).
+        """
+        added = set(teryt_tercs)
+        for status in (PENDING, LEASED, DONE, FAILED):
+            for filename in self._jobs(status):
+                # done and failed jobs are named by teryt_terc only
+                if filename.partition(_SEPARATOR)[0] in added:
+                    with suppress(FileNotFoundError):
+                        os.remove(self._path(status, filename))
+
+        for teryt_terc in added:
+            pathlib.Path(self._path(PENDING, _job_filename(teryt_terc, 0))) \
+                .touch()
+
+    def lease(
+        self,
+        worker: str,
+        max_attempts: int = MAX_ATTEMPTS
+    ) -> Optional[str]:
+        """
+        :param worker: unique id of the worker (without '/')
+        :param max_attempts: jobs with expired leases after that many
+            attempts are marked as failed
+        :return: teryt_terc of leased job or None if there is no job
+        """
+        now = time()
+        candidates = [
+            (PENDING, filename) for filename in self._jobs(PENDING)
+        ]
+        for filename in self._jobs(LEASED):
+            modified = self._modified(LEASED, filename)
+            if modified is None or modified + self.lease_duration >= now:
+                continue
+            teryt_terc, attempts, _worker = _parse_job_filename(filename)
+            if attempts >= max_attempts:
+                self._fail(LEASED, filename, 'lease expired')
+            else:
+                candidates.append((LEASED, filename))
+
+        # as ORDER BY attempts, teryt_terc
+        candidates.sort(key=lambda c: _parse_job_filename(c[1])[1::-1])
+        for status, filename in candidates:
+            teryt_terc, attempts, _worker = _parse_job_filename(filename)
+            try:
+                # new lease starts now (rename keeps modification time)
+                os.utime(self._path(status, filename), (now, now))
+                os.rename(
+                    self._path(status, filename),
+                    self._path(
+                        LEASED,
+                        _job_filename(teryt_terc, attempts + 1, worker)
+                    )
+                )
+            except FileNotFoundError:
+                continue  # leased by other worker
+
+            return teryt_terc
+
+        return None
+
+    def _fail(self, status: str, filename: str, error: str) -> None:
+        teryt_terc = _parse_job_filename(filename)[0]
+        try:
+            os.rename(
+                self._path(status, filename),
+                self._path(FAILED, teryt_terc)
+            )
+        except FileNotFoundError:
+            return  # changed by other worker
+
+        with open(self._path(FAILED, teryt_terc), 'w') as f:
+            f.write(error)
+
+    def heartbeat(self, teryt_terc: str, worker: str) -> bool:
+        """
+        :return: False if the job is not leased by the worker anymore
+        """
+        filename = self._leased_filename(teryt_terc, worker)
+        if filename is None:
+            return False
+        try:
+            os.utime(self._path(LEASED, filename))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(
+        self,
+        teryt_terc: str,
+        worker: str,
+        error: Optional[str] = None,
+        max_attempts: int = MAX_ATTEMPTS
+    ) -> None:
+        """
+        Marks leased job as done or, if error is given, as pending to retry
+        (failed after max_attempts).
+        """
+        filename = self._leased_filename(teryt_terc, worker)
+        if filename is None:
+            return
+
+        attempts = _parse_job_filename(filename)[1]
+        if error is not None and attempts >= max_attempts:
+            self._fail(LEASED, filename, error)
+            return
+
+        if error is None:
+            target = self._path(DONE, teryt_terc)
+        else:
+            target = self._path(PENDING, _job_filename(teryt_terc, attempts))
+        with suppress(FileNotFoundError):
+            os.rename(self._path(LEASED, filename), target)
+
+    def has_active_leases(self) -> bool:
+        """
+        :return: True if any job is leased and its lease didn't expire
+            (it can be still released to retry)
+        """
+        now = time()
+        for filename in self._jobs(LEASED):
+            modified = self._modified(LEASED, filename)
+            if modified is not None and modified + self.lease_duration >= now:
+                return True
+        return False
+
+    def status(self) -> Dict[str, int]:
+        """
+        :return: number of jobs by status
+        """
+        counts = {
+            status: len(self._jobs(status))
+            for status in (PENDING, LEASED, DONE, FAILED)
+        }
+        return {status: count for status, count in counts.items() if count}
+
+    def failed(self) -> List[Tuple[str, str]]:
+        """
+        :return: teryt_terc and error of failed jobs
+        """
+        failed = []
+        for teryt_terc in self._jobs(FAILED):
+            with suppress(FileNotFoundError):
+                with open(self._path(FAILED, teryt_terc)) as f:
+                    failed.append((teryt_terc, f.read()))
+        return failed
+
+    def _acquire_slot(self, slot: str, token: str) -> bool:
+        slot_filename = self._path(_SLOTS, slot)
+        modified = self._modified(_SLOTS, slot)
+        if modified is not None and modified + OVERPASS_SLOT_LEASE < time():
+            # slot of killed worker – renamed first, so only one worker
+            # removes it
+            stale_filename = f'{slot_filename}.{token}'
+            with suppress(FileNotFoundError):
+                os.rename(slot_filename, stale_filename)
+                os.remove(stale_filename)
+        try:
+            fd = os.open(slot_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w') as f:
+            f.write(token)
+        return True
+
+    def _release_slot(self, slot: str, token: str) -> None:
+        slot_filename = self._path(_SLOTS, slot)
+        with suppress(FileNotFoundError):
+            with open(slot_filename) as f:
+                held = f.read() == token
+            if held:
+                os.remove(slot_filename)
+
+    @contextmanager
+    def overpass_slot(self, worker: str, slots: int) -> Iterator[None]:
+        """
+        Waits for one of the slots of Overpass requests shared by all workers
+        and holds it until exit of the context.
+
+        :param slots: max concurrent Overpass requests of all workers
+        """
+        token = f'{worker}:{uuid.uuid4().hex}'
+        while True:
+            slot = next(
+                (
+                    str(i) for i in range(slots)
+                    if self._acquire_slot(str(i), token)
+                ),
+                None
+            )
+            if slot is not None:
+                break
+
+            logger.debug(f'Waiting for Overpass slot ({slots} used)')
+            sleep(POLL_INTERVAL)
+
+        try:
+            yield
+        finally:
+            self._release_slot(slot, token)
+
+
+def _heartbeat(
+    queue: JobQueue,
+    teryt_terc: str,
+    worker: str,
+    stop: Event,
+    lost: Event
+) -> None:
+    """
+    Extends lease of the job every HEARTBEAT_INTERVAL until stop is set.
+    If the job is leased by other worker (or the lease couldn't be
+    extended), it sets lost and finishes.
+    """
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            leased = queue.heartbeat(teryt_terc, worker)
+        except OSError as e:
+            logger.error(
+                _('Error with extending lease of commune {} job: {}')
+                .format(teryt_terc, e)
+            )
+            leased = False
+
+        if not leased:
+            logger.warning(
+                _('Lease of commune {} job expired, cancelling diff.')
+                .format(teryt_terc)
+            )
+            lost.set()
+            return
+
+
+def run_worker(
+    args: Namespace,
+    queue_dir: str = QUEUE_DIR,
+    output_base: str = Config.OUTPUT_BASE,
+    overpass_slots: int = OVERPASS_SLOTS,
+    max_attempts: int = MAX_ATTEMPTS
+) -> int:
+    """
+    Leases and runs diffs of communes until all jobs are done or failed.
+
+    :param args: parsed arguments of diff options (see add_diff_arguments)
+    :param queue_dir: directory of the queue (shared by workers)
+    :param output_base: directory (shared by workers) for outputs
+    :param overpass_slots: max concurrent Overpass requests of all workers
+    :return: number of processed jobs
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    queue = JobQueue(queue_dir)
+    set_request_slot(partial(queue.overpass_slot, worker, overpass_slots))
+
+    processed = 0
+    while True:
+        teryt_terc = queue.lease(worker, max_attempts)
+        if teryt_terc is None:
+            # jobs of other workers can still be released to retry
+            if not queue.has_active_leases():
+                break
+            sleep(POLL_INTERVAL)
+            continue
+
+        logger.info(
+            _('Worker {} leased commune: {}').format(worker, teryt_terc)
+        )
+        stop_heartbeat = Event()
+        lease_lost = Event()
+        heartbeat = Thread(
+            target=_heartbeat,
+            args=(
+                queue,
+                teryt_terc,
+                worker,
+                stop_heartbeat,
+                lease_lost
+            ),
+            daemon=True
+        )
+        heartbeat.start()
+
+        error = None
+        try:
+            # diff is cancelled (and its report isn't saved) if the job is
+            # leased by other worker
+            run_diff(
+                create_diff_options(args, teryt_terc, output_base),
+                lease_lost
+            )
+        except DiffCancelled:
+            pass
+        except Exception as e:
+            logger.exception(
+                _('Diff of commune {} failed: {}').format(teryt_terc, repr(e))
+            )
+            error = repr(e)
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        if lease_lost.is_set():
+            logger.warning(
+                _('Skipping result of commune {} leased by other worker.')
+                .format(teryt_terc)
+            )
+            continue
+
+        queue.complete(teryt_terc, worker, error, max_attempts)
+        processed += 1
+
+    logger.info(
+        _('Worker {} finished after {} jobs.').format(worker, processed)
+    )
+    return processed
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description=_(
+            'Queue of communes diffs shared by workers of many processes '
+            'and hosts.'
+        )
+    )
+    parser.add_argument(
+        '--queue',
+        help=_(
+            'queue directory, on a filesystem shared by all hosts of '
+            'workers (default: {}).'
+        ).format(QUEUE_DIR),
+        default=QUEUE_DIR,
+        dest='queue_dir'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = subparsers.add_parser(
+        'add',
+        help=_('add communes to the queue.')
+    )
+    add_parser.add_argument(
+        'teryt_terc',
+        help=_('ids of communes (gmina) – 7 characters.'),
+        nargs='+',
+        type=str
+    )
+
+    subparsers.add_parser('status', help=_('show number of jobs by status.'))
+
+    worker_parser = subparsers.add_parser(
+        'worker',
+        help=_('run diffs of communes from the queue.')
+    )
+    worker_parser.add_argument(
+        '--processes',
+        help=_('number of worker processes (default: 1).'),
+        type=positive_int,
+        default=1,
+        dest='processes'
+    )
+    worker_parser.add_argument(
+        '--overpass-slots',
+        help=_(
+            'max concurrent Overpass requests of all workers, should be '
+            'the same for all of them (default: {}).'
+        ).format(OVERPASS_SLOTS),
+        type=positive_int,
+        default=OVERPASS_SLOTS,
+        dest='overpass_slots'
+    )
+    worker_parser.add_argument(
+        '--max-attempts',
+        help=_('max attempts of a job (default: {}).').format(MAX_ATTEMPTS),
+        type=positive_int,
+        default=MAX_ATTEMPTS,
+        dest='max_attempts'
+    )
+    worker_parser.add_argument(
+        '--output-base',
+        help=_(
+            'output directory (shared by workers) for directories '
+            'of communes (default: {}).'
+        ).format(Config.OUTPUT_BASE),
+        default=Config.OUTPUT_BASE,
+        dest='output_base'
+    )
+    add_diff_arguments(worker_parser)
+
+    return parser
+
+
+if __name__ == '__main__':
+    setup_locale()
+
+    args = create_parser().parse_args()
+
+    if args.command == 'add':
+        if not all(map(check_teryt_terc, args.teryt_terc)):
+            sys.exit(1)
+        JobQueue(args.queue_dir).add(args.teryt_terc)
+
+    elif args.command == 'status':
+        job_queue = JobQueue(args.queue_dir)
+        for status, count in sorted(job_queue.status().items()):
+            logger.info(f'{status}: {count}')
+        for teryt_terc, error in job_queue.failed():
+            logger.info(_('Failed {}: {}').format(teryt_terc, error))
+
+    elif args.command == 'worker':
+        if not args.no_street_names_update_check:
+            # check once instead of once per commune
+            update_street_names_mappings()
+            args.no_street_names_update_check = True
+
+        worker_kwargs = {
+            'args': args,
+            'queue_dir': args.queue_dir,
+            'output_base': args.output_base,
+            'overpass_slots': args.overpass_slots,
+            'max_attempts': args.max_attempts
+        }
+        if args.processes == 1:
+            run_worker(**worker_kwargs)
+        else:
+            processes = [
+                multiprocessing.Process(
+                    target=run_worker,
+                    kwargs=worker_kwargs
+                )
+                for _i in range(args.processes)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
@@ -1,283 +1,145 @@
-import json
-import pathlib
 import sys
 
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError, Namespace
 from os import path
-from typing import Any, Dict, List, Optional, Tuple
-
-from analyze import (
-    addr_type_distribution,
-    addr_tags_distribution,
-    addr_duplicates,
-    addr_missing
+from threading import Event
+from typing import Optional
+
+from analyze import MATCHED_MAX_DISTANCE
+from buildings import BUILDINGS_MAX_DISTANCE
+from checkpoint import CHECKPOINTS_MAX_AGE
+from config import Config, gettext as _, logger, setup_locale
+from exceptions import (
+    EmapaDownloadError,
+    OverpassDownloadError,
+    PrgDataError,
+    ServiceNotFound
 )
-from address import Address, OsmAddress
-from config import Config, gettext as _, logger
-from parsers.emapa import parse_emapa_file, parse_emapa_url
 from parsers.teryt import parse_teryt_terc_file
-from exceptions import ServiceNotFound
-from utils.alt_street_names import (
-    parse_streets_names_from_elements,
-    replace_streets_with_osm_alt_names
-)
-from utils.emapa_downloader import (
-    download_emapa_gml,
-    download_punktyadresowe_metadata
-)
-from utils.overpass import (
-    download_osm_data,
-    is_element,
-    QUERY_ADDR,
-    QUERY_STREET
-)
-from utils.street_names_mappings import (
-    replace_streets_with_osm_names,
-    STREET_NAMES_FILENAME
-)
+from report import log_reports, save_report
+from session import DiffOptions, DiffResult, DiffSession
+from utils.compression import COMPRESSIONS, DEFAULT_COMPRESSION
+from utils.emapa_downloader import PAGE_SIZE as EMAPA_PAGE_SIZE
+from utils.overpass import split_depth_filename
+from utils.tiles import MAX_ZOOM
+from utils.transport import collect_http_stats, log_http_stats
+from utils.street_names_mappings import STREET_NAMES_FILENAME
+from writers.registry import DEFAULT_OUTPUT_FORMAT, OUTPUT_FORMATS
 
 
 TERYT_TERC_FILE: str = path.join(Config.DATA_DIR, 'terc.csv')
 
 
-def download_emapa_addresses() -> List[Address]:
-    try:
-        metadata = download_punktyadresowe_metadata(Config.TERYT_TERC[:-1])
-        local_system_url = parse_emapa_url(metadata)
+def run_diff(
+    options: DiffOptions,
+    cancel: Optional[Event] = None
+) -> DiffResult:
+    """
+    Runs diff of the commune, logs and saves its report.
+
+    :param cancel: see DiffSession, the report isn't saved if it's set
+    :raises ServiceNotFound, EmapaDownloadError, OverpassDownloadError,
+        PrgDataError, DiffCancelled:
+    """
+    session = DiffSession(options, cancel)
+    with collect_http_stats() as http_stats:
+        result = session.run()
+
+    log_reports(result)
+    log_http_stats(http_stats)
+    report_depends = ['diff']
+    if options.buildings:
+        report_depends.append('buildings')
+    session.stage(
+        'report',
+        [
+            options.output_format,
+            options.tile_zoom,
+            options.ids_batch_size,
+            options.coverage_db,
+            options.buildings
+        ],
+        lambda: save_report(result),
+        report_depends,
+        # saved again if any file was deleted
+        is_valid=lambda filenames: all(map(path.isfile, filenames))
+    )
+    return result
 
-        gml_filename = path.join(Config.OUTPUT_DIR, 'emapa_addresses_raw.gml')
-        download_emapa_gml(Config.TERYT_TERC[:-1], gml_filename)
 
+def main(options: DiffOptions) -> None:
+    try:
+        run_diff(options)
     except ServiceNotFound:
         logger.error(
             _('Not found e-mapa service for teryt_terc: {}').format(
-                Config.TERYT_TERC
+                options.teryt_terc
             )
         )
         sys.exit(2)
-    except IOError as err:
+    except EmapaDownloadError as err:
         logger.error(_('Error with downloading/saving data: {}').format(err))
         sys.exit(3)
-
-    emapa_addresess: List[Address] = parse_emapa_file(
-        gml_filename,
-        local_system_url
-    )
-    for addr in emapa_addresess:
-        addr.source_addr = local_system_url
-
-    logger.info(_('Parsed {} e-mapa addresses.').format(len(emapa_addresess)))
-    return emapa_addresess
-
-
-def download_osm_addresses() -> List[OsmAddress]:
-    osm_data: Optional[Dict[str, Any]] = download_osm_data(
-        Config.TERYT_TERC,
-        QUERY_ADDR
-    )
-    if osm_data is None:
-        logger.error(
-            _('Error with downloading OSM (Overpass) addresses data.')
-        )
-        sys.exit(4)
-
-    elements: List[Dict[str, Any]] = list(
-        filter(is_element, osm_data['elements'])
-    )
-
-    logger.debug(_('Downloaded {} OSM addresses elements.').format(
-        len(elements))
-    )
-    osm_addresses: List[OsmAddress] = list(
-        map(OsmAddress.parse_from_osm_element, elements)
-    )
-    logger.info(_('Parsed {} OSM addresses.').format(len(osm_addresses)))
-
-    return osm_addresses
-
-
-def download_osm_alt_streets_names() -> Dict[str, str]:
-    osm_data: Optional[Dict[str, Any]] = download_osm_data(
-        Config.TERYT_TERC,
-        QUERY_STREET
-    )
-    if osm_data is None:
-        logger.error(
-            _('Error with downloading OSM (Overpass) street names data.')
-        )
+    except OverpassDownloadError as err:
+        logger.error(err)
         sys.exit(4)
+    except PrgDataError as err:
+        logger.error(err)
+        sys.exit(5)
 
-    elements: List[Dict[str, Any]] = osm_data['elements']
-    logger.debug(
-        _('Downloaded {} OSM street elements.').format(len(elements))
-    )
 
-    osm_streets: Dict[str, str] = parse_streets_names_from_elements(elements)
-    unique_street = set(w['tags']['name'] for w in elements)
-    logger.info(
-        _('Parsed {} OSM unique streets with {} alternate names.').format(
-            len(unique_street),
-            len(osm_streets)
-        )
-    )
-
-    return osm_streets
-
-
-def report_osm_type(osm_addresses: List[OsmAddress]) -> str:
-    osm_type_dist = addr_type_distribution(osm_addresses).most_common()
-    return _('OSM object type:') + ' \n{}'.format(
-        '\n'.join(f'{k}: {v}' for k, v in osm_type_dist)
-    )
-
-
-def report_key_value_distribution(osm_addresses: List[OsmAddress]) -> str:
-    kv_dist: List[Tuple] = addr_tags_distribution(osm_addresses).most_common()
-    return _('Key-values distribution:') + '\n{}'.format(
-        '\n'.join(
-            f'{k}: {v} ({v * 100 / len(osm_addresses):.2f}%)'
-            for k, v in kv_dist
-        )
-    )
-
-
-def report_duplicates(
-    duplicated_addresses: List[List[OsmAddress]],
-    osm_address: List[OsmAddress]
-) -> str:
-    return _('Duplicated OSM addresses:') + ' {}/{} ({:.2f}%)'.format(
-        len(duplicated_addresses),
-        len(osm_address),
-        len(duplicated_addresses) * 100 / len(osm_address)
-    )
-
-
-def save_missing_addresses(missing_emapa_addresses: List[Address]) -> None:
-    geojson: Dict[str, Any] = Address.addresses_to_geojson(
-        missing_emapa_addresses
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser()
+    parser.add_argument(
+        'teryt_terc',
+        help=_('id of commune (gmina) – 7 characters.'),
+        type=str,
     )
-    filename = 'emapa_addresses_missing.geojson'
-    with open(path.join(Config.OUTPUT_DIR, filename), 'w') as f:
-        json.dump(geojson, f, indent=4)
+    add_diff_arguments(parser)
 
+    return parser
 
-def save_duplicated_addresses(
-    duplicated_osm_addresses: List[List[OsmAddress]]
-) -> None:
-    if (
-        duplicated_osm_addresses
-        and type(duplicated_osm_addresses[0][0]) != OsmAddress
-    ):
-        raise AssertionError
 
-    filename = 'osm_addresses_duplicates.txt'
-    with open(path.join(Config.OUTPUT_DIR, filename), 'w') as f:
-        f.write(
-            '# ' + _(
-                'You can load it in the JOSM '
-                'using "Download object" function (CTRL + SHIFT + O).'
-            )
+def positive_int(value: str) -> int:
+    """
+    Type of argparse arguments which must be greater than 0.
+    """
+    number = int(value)
+    if number <= 0:
+        raise ArgumentTypeError(
+            _('must be greater than 0: {}').format(value)
         )
-        f.write('\n# ' + _('Each line is for 1 address'))
-
-        for duplication_block in duplicated_osm_addresses:
-            shorten_osm_obj_sequence = ','.join([
-                addr.shorten_osm_obj for addr in duplication_block
-            ])
-            f.write('\n' + shorten_osm_obj_sequence)
+    return number
 
 
-def save_excess_addresses(excess_osm_addresses: List[OsmAddress]) -> None:
-    assert type(excess_osm_addresses[0]) == OsmAddress
-
-    shorten_osm_obj_sequence = ','.join([
-        addr.shorten_osm_obj for addr in excess_osm_addresses
-    ])
-    filename = 'osm_addresses_excess.txt'
-    with open(path.join(Config.OUTPUT_DIR, filename), 'w') as f:
-        f.write(
-            '# ' + _(
-                'You can load it in the JOSM '
-                'using "Download object" function (CTRL + SHIFT + O).'
-            )
+def non_negative_float(value: str) -> float:
+    """
+    Type of argparse arguments with distance in metres.
+    """
+    number = float(value)
+    if not number >= 0:  # also NaN
+        raise ArgumentTypeError(
+            _('must not be negative: {}').format(value)
         )
-        f.write('\n' + shorten_osm_obj_sequence)
-
-
-def save_all_emapa_addresses(emapa_addresses: List[Address]) -> None:
-    geojson: Dict[str, Any] = Address.addresses_to_geojson(emapa_addresses)
-
-    filename = 'emapa_addresses_all.geojson'
-    with open(path.join(Config.OUTPUT_DIR, filename), 'w') as f:
-        json.dump(geojson, f, indent=4)
-
+    return number
 
-def main():
-    # Create teryt_terc output directory if not exists
-    pathlib.Path(Config.OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
 
-    # Download e-mapa and OSM adddresses and streets
-    emapa_addresses: List[Address] = download_emapa_addresses()
-    replace_streets_with_osm_names(emapa_addresses)
-    osm_addresses: List[OsmAddress] = download_osm_addresses()
-
-    if not Config.NO_STREET_ALT_NAMES_REPLACE:
-        osm_alt_streets_names = download_osm_alt_streets_names()
-        replace_streets_with_osm_alt_names(
-            emapa_addresses,
-            osm_alt_streets_names
+def tile_zoom(value: str) -> int:
+    """
+    Type of argparse argument with zoom of slippy map tiles.
+    """
+    zoom = int(value)
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ArgumentTypeError(
+            _('must be between 0 and {}: {}').format(MAX_ZOOM, value)
         )
-
-    # Analysis reports
-    logger.info(
-        f'\n{report_osm_type(osm_addresses)}\n',
-        extra={'simple_fmt': True}
-    )
-    logger.info(
-        f'{report_key_value_distribution(osm_addresses)}\n',
-        extra={'simple_fmt': True}
-    )
-
-    duplicated_osm_addresses = addr_duplicates(osm_addresses)
-    logger.info(
-        f'{report_duplicates(duplicated_osm_addresses, osm_addresses)}\n',
-        extra={'simple_fmt': True}
-    )
-
-    missing_emapa_addresses = addr_missing(osm_addresses, emapa_addresses)
-    logger.info(
-        _('Missing OSM addresses which exist in the e-mapa: {}').format(
-            len(missing_emapa_addresses)
-        ),
-        extra={'simple_fmt': True}
-    )
-
-    excess_osm_addresses: List[OsmAddress] = addr_missing(
-        emapa_addresses,
-        osm_addresses
-    )
-    logger.info(
-        _('Excess OSM addresses which do not exist in the e-mapa: {}').format(
-            len(excess_osm_addresses)
-        ),
-        extra={'simple_fmt': True}
-    )
-
-    # Save data to files
-    save_duplicated_addresses(duplicated_osm_addresses)
-    save_missing_addresses(missing_emapa_addresses)
-    save_excess_addresses(excess_osm_addresses)
-    save_all_emapa_addresses(emapa_addresses)
+    return zoom
 
 
-if __name__ == '__main__':
-    # Parse and check arguments from user input
-    parser = ArgumentParser()
-    parser.add_argument(
-        'teryt_terc',
-        help=_('id of commune (gmina) – 7 characters.'),
-        type=str,
-    )
+def add_diff_arguments(parser: ArgumentParser) -> None:
+    """
+    Adds arguments of DiffOptions (except commune) to the parser.
+    """
     parser.add_argument(
         '--duplicates-exclude-poi',
         help=_(
@@ -323,25 +185,226 @@ if __name__ == '__main__':
         action='store_true',
         dest='ignore_street_features'
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        '--output-format',
+        help=_(
+            'format of the files with e-mapa addresses (default: {}). '
+            'gpkg contains spatial index, osm can be opened in the JOSM.'
+        ).format(DEFAULT_OUTPUT_FORMAT),
+        choices=sorted(OUTPUT_FORMATS.keys()),
+        default=DEFAULT_OUTPUT_FORMAT,
+        dest='output_format'
+    )
+    parser.add_argument(
+        '--tile-zoom',
+        help=_(
+            'additionally save missing, excess and duplicated addresses '
+            'partitioned by slippy map tiles at given zoom (e.g. 14) '
+            'with index file: tiles/index.json.'
+        ),
+        type=tile_zoom,
+        default=None,
+        dest='tile_zoom'
+    )
+    parser.add_argument(
+        '--ids-batch-size',
+        help=_(
+            'max number of OSM objects ids in one line of excess addresses '
+            'file, to keep JOSM "Download object" requests small.'
+        ),
+        type=positive_int,
+        default=None,
+        dest='ids_batch_size'
+    )
+    parser.add_argument(
+        '--duplicates-max-distance',
+        help=_(
+            'report as duplicates only same addresses closer than given '
+            'distance in metres, others are saved to {} file.'
+        ).format('osm_addresses_duplicates_distant.txt'),
+        type=non_negative_float,
+        default=None,
+        dest='duplicates_max_distance'
+    )
+    parser.add_argument(
+        '--matched-max-distance',
+        help=_(
+            'matched addresses farther than given distance in metres '
+            'are reported as different position (default: {}).'
+        ).format(MATCHED_MAX_DISTANCE),
+        type=non_negative_float,
+        default=MATCHED_MAX_DISTANCE,
+        dest='matched_max_distance'
+    )
+    parser.add_argument(
+        '--compact-osm-query',
+        help=_(
+            'download OSM addresses as CSV with addr:*, building and POI '
+            'tags only (faster, key-values distribution is limited to them).'
+        ),
+        action='store_true',
+        dest='compact_osm_query'
+    )
+    parser.add_argument(
+        '--memory-budget',
+        help=_(
+            'compute diff in partitions (spilled to disk) analyzed by '
+            'parallel processes using together at most given memory in MB. '
+            'Downloaded datasets are still loaded in memory.'
+        ),
+        type=positive_int,
+        default=None,
+        dest='memory_budget'
+    )
+    parser.add_argument(
+        '--compact-keys',
+        help=_(
+            'store 64-bit hashes of addresses keys instead of strings '
+            'to reduce memory usage of diff.'
+        ),
+        action='store_true',
+        dest='compact_keys'
+    )
+    parser.add_argument(
+        '--prg-index',
+        help=_(
+            'use addresses from the PRG index directory (created by '
+            'python -m parsers.prg) instead of downloading the e-mapa.'
+        ),
+        default=None,
+        dest='prg_index_dir'
+    )
+    parser.add_argument(
+        '--emapa-page-size',
+        help=_(
+            'max number of e-mapa features in one request, bigger datasets '
+            'are downloaded in concurrent pages (default: {}).'
+        ).format(EMAPA_PAGE_SIZE),
+        type=positive_int,
+        default=EMAPA_PAGE_SIZE,
+        dest='emapa_page_size'
+    )
+    parser.add_argument(
+        '--checkpoints',
+        help=_(
+            'save results of each stage (downloads, parsing, diff, report) '
+            'in the {} directory and resume from them, e.g. to continue '
+            'an interrupted batch or to rerun diff with other options '
+            'without downloading data again.'
+        ).format('out/<teryt_terc>/checkpoints'),
+        action='store_true',
+        dest='checkpoints'
+    )
+    parser.add_argument(
+        '--checkpoints-max-age',
+        help=_(
+            'hours after which data downloaded in checkpoints is downloaded '
+            'again, 0 – always download (default: {}).'
+        ).format(CHECKPOINTS_MAX_AGE),
+        type=non_negative_float,
+        default=CHECKPOINTS_MAX_AGE,
+        dest='checkpoints_max_age'
+    )
+    parser.add_argument(
+        '--raw-compression',
+        help=_(
+            'compression of downloaded e-mapa GML and checkpoints '
+            '(default: {}).'
+        ).format(DEFAULT_COMPRESSION),
+        choices=sorted(COMPRESSIONS.keys()),
+        default=DEFAULT_COMPRESSION,
+        dest='raw_compression'
+    )
+    parser.add_argument(
+        '--coverage-db',
+        help=_(
+            'SQLite file with coverage rollups of many communes, updated '
+            'after each diff (e.g. out/coverage.sqlite).'
+        ),
+        default=None,
+        dest='coverage_db'
+    )
+    parser.add_argument(
+        '--buildings',
+        help=_(
+            'assign missing addresses to OSM buildings which contain them '
+            'or are the nearest, and mark buildings with other address.'
+        ),
+        action='store_true',
+        dest='buildings'
+    )
+    parser.add_argument(
+        '--buildings-max-distance',
+        help=_(
+            'max distance in metres of missing address to the nearest '
+            'building (default: {}).'
+        ).format(BUILDINGS_MAX_DISTANCE),
+        type=non_negative_float,
+        default=BUILDINGS_MAX_DISTANCE,
+        dest='buildings_max_distance'
+    )
+
+
+def create_diff_options(
+    args: Namespace,
+    teryt_terc: str,
+    output_base: str = Config.OUTPUT_BASE
+) -> DiffOptions:
+    """
+    :param args: parsed arguments added by add_diff_arguments
+    :param teryt_terc: commune (gmina) id – 7 characters
+    :param output_base: directory for output directories of communes
+    """
+    return DiffOptions(
+        teryt_terc=teryt_terc,
+        output_dir=path.join(output_base, teryt_terc),
+        duplicates_exclude_poi=args.duplicates_exclude_poi,
+        no_street_names_update_check=args.no_street_names_update_check,
+        no_street_alt_names_replace=args.no_street_alt_names_replace,
+        ignore_case_sensitive_housenumber=args.ignore_cs_housenumber,
+        ignore_street_features=args.ignore_street_features,
+        output_format=args.output_format,
+        tile_zoom=args.tile_zoom,
+        ids_batch_size=args.ids_batch_size,
+        duplicates_max_distance=args.duplicates_max_distance,
+        matched_max_distance=args.matched_max_distance,
+        compact_osm_query=args.compact_osm_query,
+        memory_budget=args.memory_budget,
+        compact_keys=args.compact_keys,
+        prg_index_dir=args.prg_index_dir,
+        emapa_page_size=args.emapa_page_size,
+        checkpoints=args.checkpoints,
+        checkpoints_max_age=args.checkpoints_max_age,
+        raw_compression=args.raw_compression,
+        coverage_db=args.coverage_db,
+        buildings=args.buildings,
+        buildings_max_distance=args.buildings_max_distance,
+        overpass_split_depth_filename=split_depth_filename(output_base)
+    )
+
 
-    teryt_terc: str = args.teryt_terc
+def check_teryt_terc(teryt_terc: str) -> bool:
+    """
+    :return: True if commune exists in the TERYT TERC file
+    """
     try:
         area_name = parse_teryt_terc_file(TERYT_TERC_FILE, teryt_terc)
         logger.info(
             _('Parsed teryt_terc ({}) as: {}').format(teryt_terc, area_name)
         )
+        return True
     except (ValueError, IOError) as e:
         logger.error(_('Cannot parse teryt terc parameter!') + f' {e}')
-        sys.exit(1)
+        return False
 
-    Config.TERYT_TERC = teryt_terc
-    Config.AREA_NAME = area_name
-    Config.OUTPUT_DIR = path.join(Config.OUTPUT_BASE, teryt_terc)
-    Config.DUPLICATES_EXCLUDE_POI = args.duplicates_exclude_poi
-    Config.NO_STREET_NAMES_UPDATE_CHECK = args.no_street_names_update_check
-    Config.NO_STREET_ALT_NAMES_REPLACE = args.no_street_alt_names_replace
-    Config.IGNORE_CASE_SENSITIVE_HOUSENUMBER = args.ignore_cs_housenumber
-    Config.IGNORE_STREET_FEATURES = args.ignore_street_features
 
-    main()
+if __name__ == '__main__':
+    setup_locale()
+
+    # Parse and check arguments from user input
+    args = create_parser().parse_args()
+
+    if not check_teryt_terc(args.teryt_terc):
+        sys.exit(1)
+
+    main(create_diff_options(args, args.teryt_terc))
@@ -1,11 +1,13 @@
 from lxml import etree
 
-from typing import Optional, List
+from typing import Iterator, Optional, List
 
 from address import Address, Point
+from utils.compression import open_compressed
+from utils.normalize import intern_str
 
 
-ADDRESS_XML_PATH = 'wfs:member/ms:punkty_adresowe'
+ADDRESS_XML_TAG = '{*}punkty_adresowe'  # in wfs:member
 
 
 def _parse_gml_address_element(
@@ -34,34 +36,46 @@ def _parse_gml_address_element(
     ).text.strip().split()))
 
     return Address(
-        city=city,
-        city_simc=simc,
-        street=street,
-        housenumber=housenumber,
-        postcode=postcode,
+        city=intern_str(city),
+        city_simc=intern_str(simc),
+        street=intern_str(street),
+        housenumber=intern_str(housenumber),
+        postcode=intern_str(postcode),
         point=Point(lat, lon),
         source=address_source
     )
 
 
+def iter_emapa_file(input_filename: str, source: str) -> Iterator[Address]:
+    """
+    :param input_filename: gml file with addresses data, can be compressed
+        (see utils.compression)
+    :param source: URL to local map system from above file is downloaded
+    :return: parsed addresses (streaming, the file is read lazily)
+    """
+    with open_compressed(input_filename, 'rb') as f:
+        # streaming – parsed elements are removed from the tree
+        for _event, addresss_elem in etree.iterparse(f, tag=ADDRESS_XML_TAG):
+            yield _parse_gml_address_element(
+                addresss_elem,
+                addresss_elem.nsmap,
+                source
+            )
+
+            member = addresss_elem.getparent()
+            addresss_elem.clear()
+            while member.getprevious() is not None:
+                del member.getparent()[0]
+
+
 def parse_emapa_file(input_filename: str, source: str) -> List[Address]:
     """
-    :param input_filename: gml file with addresses data
+    :param input_filename: gml file with addresses data, can be compressed
+        (see utils.compression)
     :param source: URL to local map system from above file is downloaded
     :return: List of parsed addresses
     """
-    addresses = []
-    tree = etree.parse(input_filename)
-    root = tree.getroot()
-
-    for addresss_elem in root.xpath(ADDRESS_XML_PATH, namespaces=root.nsmap):
-        addresses.append(_parse_gml_address_element(
-            addresss_elem,
-            root.nsmap,
-            source
-        ))
-
-    return addresses
+    return list(iter_emapa_file(input_filename, source))
 
 
 def parse_emapa_url(content: str) -> Optional[str]:
@@ -0,0 +1,367 @@
+import csv
+import json
+import os
+import pathlib
+import re
+import shutil
+import sys
+import tempfile
+
+from argparse import ArgumentParser, ArgumentTypeError
+from datetime import datetime, timezone
+from os import path
+from typing import Dict, IO, Iterator, List, Optional
+
+from address import Address, Point
+from config import Config, gettext as _, logger, setup_locale
+from exceptions import PrgDataError
+from utils.geo import puwg1992_to_wgs84
+from utils.normalize import intern_str
+
+
+PRG_SOURCE = 'gugik.gov.pl'
+PRG_INDEX_DIR = path.join(Config.OUTPUT_BASE, 'prg')
+PRG_INDEX_MANIFEST = 'index.json'
+
+# Default columns of the national PRG address points CSV dump (';'
+# separated), they can be changed for other header by the --column option.
+# Coordinates are read from lat/lon columns (WGS84) if they exist,
+# otherwise from x/y columns (EPSG:2180, x – northing).
+PRG_CSV_COLUMNS = {
+    'teryt_terc': 'TERYT',  # commune (gmina) id – 7 characters
+    'city_simc': 'SIMC',
+    'city': 'MIEJSCOWOSC',
+    'street': 'ULICA',
+    'housenumber': 'NUMER',
+    'postcode': 'KOD_POCZTOWY',
+    'lat': 'SZEROKOSC',
+    'lon': 'DLUGOSC',
+    'x': 'X',
+    'y': 'Y',
+}
+
+_REQUIRED_FIELDS = [
+    'teryt_terc',
+    'city_simc',
+    'city',
+    'street',
+    'housenumber',
+    'postcode'
+]
+
+# Columns of commune slices in the index
+_SLICE_COLUMNS = [
+    'city_simc',
+    'city',
+    'street',
+    'housenumber',
+    'postcode',
+    'lat',
+    'lon'
+]
+_FLUSH_ROWS = 100_000  # max buffered rows of all communes during ingestion
+_TERYT_TERC_RE = re.compile(r'\d{7}')
+
+
+def _check_header(
+    header: Optional[List[str]],
+    columns: Dict[str, str]
+) -> None:
+    """
+    :raises PrgDataError: if any required column is missing
+    """
+    header = header or []
+    missing = [
+        columns[field] for field in _REQUIRED_FIELDS
+        if columns[field] not in header
+    ]
+    has_wgs84 = columns['lat'] in header and columns['lon'] in header
+    has_puwg1992 = columns['x'] in header and columns['y'] in header
+    if not has_wgs84 and not has_puwg1992:
+        missing.append(
+            f'{columns["lat"]}/{columns["lon"]} or {columns["x"]}/'
+            f'{columns["y"]}'
+        )
+
+    if missing:
+        raise PrgDataError(
+            _('Missing columns in PRG CSV file: {} (header: {})').format(
+                ', '.join(missing),
+                ';'.join(header)
+            )
+        )
+
+
+def _row_point(row: Dict[str, str], columns: Dict[str, str]) -> Point:
+    lat = row.get(columns['lat'])
+    lon = row.get(columns['lon'])
+    if lat and lon:
+        return Point(float(lat), float(lon))
+
+    return puwg1992_to_wgs84(
+        float(row[columns['x']]),
+        float(row[columns['y']])
+    )
+
+
+def prg_slice_filename(index_dir: str, teryt_terc: str) -> str:
+    """
+    :raises PrgDataError: if teryt_terc isn't 7 digits (it's a filename)
+    """
+    if not _TERYT_TERC_RE.fullmatch(teryt_terc):
+        raise PrgDataError(
+            _('Incorrect TERYT of commune: {}').format(teryt_terc)
+        )
+    return path.join(index_dir, f'{teryt_terc}.csv')
+
+
+def _is_index_file(filename: str) -> bool:
+    name, extension = path.splitext(filename)
+    return filename == PRG_INDEX_MANIFEST or (
+        extension == '.csv' and _TERYT_TERC_RE.fullmatch(name) is not None
+    )
+
+
+def _replace_dir(new_dir: str, old_dir: str) -> None:
+    """
+    Replaces old_dir by new_dir using renames (os.replace replaces only an
+    empty directory), so old_dir is always either old or new complete one.
+    """
+    if not path.exists(old_dir):
+        os.replace(new_dir, old_dir)
+        return
+
+    removed_dir = tempfile.mkdtemp(
+        prefix=f'.{path.basename(old_dir)}.',
+        dir=path.dirname(old_dir)
+    )
+    os.replace(old_dir, removed_dir)
+    os.replace(new_dir, old_dir)
+    shutil.rmtree(removed_dir)
+
+
+def _flush_slices(buffers: Dict[str, List[List[str]]], index_dir: str) -> None:
+    for teryt_terc, rows in buffers.items():
+        filename = prg_slice_filename(index_dir, teryt_terc)
+        with open(filename, 'a', encoding='utf-8', newline='') as f:
+            csv.writer(f, delimiter=';').writerows(rows)
+
+    buffers.clear()
+
+
+def _ingest_slices(
+    reader: csv.DictReader,
+    columns: Dict[str, str],
+    index_dir: str
+) -> Dict[str, int]:
+    """
+    :raises PrgDataError: if row contains incorrect TERYT
+    :return: number of addresses per teryt_terc
+    """
+    counts: Dict[str, int] = dict()
+    buffers: Dict[str, List[List[str]]] = dict()
+    buffered_rows = 0
+
+    for row in reader:
+        teryt_terc = row[columns['teryt_terc']].strip()
+        if not _TERYT_TERC_RE.fullmatch(teryt_terc):
+            raise PrgDataError(
+                _('Incorrect TERYT of commune in line {}: {}').format(
+                    reader.line_num,
+                    teryt_terc
+                )
+            )
+        point = _row_point(row, columns)
+        buffers.setdefault(teryt_terc, []).append([
+            row[columns['city_simc']].strip(),
+            row[columns['city']].strip(),
+            (row[columns['street']] or '').strip(),
+            row[columns['housenumber']].strip(),
+            row[columns['postcode']].strip(),
+            repr(point.lat),
+            repr(point.lon)
+        ])
+        counts[teryt_terc] = counts.get(teryt_terc, 0) + 1
+
+        buffered_rows += 1
+        if buffered_rows >= _FLUSH_ROWS:
+            _flush_slices(buffers, index_dir)
+            buffered_rows = 0
+
+    _flush_slices(buffers, index_dir)
+
+    return counts
+
+
+def ingest_prg_csv(
+    input_file: IO[str],
+    index_dir: str,
+    columns: Optional[Dict[str, str]] = None
+) -> Dict[str, int]:
+    """
+    Reads national PRG address points dump once (streaming) and splits it
+    into per commune slices: <index_dir>/<teryt_terc>.csv with index.json
+    manifest, so each commune run reads only its own small slice.
+    The index is written to a temporary directory next to index_dir, which
+    replaces the existing index only after the whole dump is ingested.
+
+    :param input_file: opened CSV file with PRG_CSV_COLUMNS
+    :param index_dir: directory of the index (existing index is replaced)
+    :param columns: names of columns which replace PRG_CSV_COLUMNS
+    :raises PrgDataError: if the CSV file doesn't have required columns,
+        row contains incorrect TERYT or index_dir contains other files
+    :raises ValueError: if row contains incorrect coordinates
+    :return: number of addresses per teryt_terc
+    """
+    columns = {**PRG_CSV_COLUMNS, **(columns or dict())}
+    reader = csv.DictReader(input_file, delimiter=';')
+    _check_header(reader.fieldnames, columns)
+
+    index_dir = path.abspath(index_dir)
+    if path.isdir(index_dir):
+        other_files = [
+            filename for filename in os.listdir(index_dir)
+            if not _is_index_file(filename)
+        ]
+        if other_files:
+            raise PrgDataError(
+                _('Directory {} contains files other than PRG index: {}')
+                .format(index_dir, ', '.join(sorted(other_files)))
+            )
+
+    parent_dir = path.dirname(index_dir)
+    pathlib.Path(parent_dir).mkdir(parents=True, exist_ok=True)
+    new_dir = tempfile.mkdtemp(
+        prefix=f'.{path.basename(index_dir)}.',
+        dir=parent_dir
+    )
+    # permissions of the existing index instead of private temporary ones
+    shutil.copymode(
+        index_dir if path.isdir(index_dir) else parent_dir,
+        new_dir
+    )
+    try:
+        counts = _ingest_slices(reader, columns, new_dir)
+        manifest = {
+            'source': getattr(input_file, 'name', None),
+            'ingested_at': datetime.now(timezone.utc).isoformat(),
+            'columns': _SLICE_COLUMNS,
+            'communes': counts
+        }
+        with open(path.join(new_dir, PRG_INDEX_MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=4)
+
+        _replace_dir(new_dir, index_dir)
+    except BaseException:
+        shutil.rmtree(new_dir, ignore_errors=True)
+        raise
+
+    return counts
+
+
+def iter_prg_addresses(index_dir: str, teryt_terc: str) -> Iterator[Address]:
+    """
+    :param index_dir: directory created by ingest_prg_csv
+    :param teryt_terc: commune (gmina) id – 7 characters
+    :raises PrgDataError: if commune doesn't exist in the PRG index or its
+        slice is incorrect
+    :return: addresses of the commune (streaming, the slice is read lazily)
+    """
+    filename = prg_slice_filename(index_dir, teryt_terc)
+    if not path.isfile(filename):
+        raise PrgDataError(
+            _('Not found commune {} in PRG index: {}').format(
+                teryt_terc,
+                index_dir
+            )
+        )
+
+    try:
+        with open(filename, 'r', encoding='utf-8', newline='') as f:
+            for simc, city, street, housenumber, postcode, lat, lon \
+                    in csv.reader(f, delimiter=';'):
+                yield Address(
+                    city=intern_str(city),
+                    city_simc=intern_str(simc),
+                    street=intern_str(street) if street else None,
+                    housenumber=intern_str(housenumber),
+                    postcode=intern_str(postcode),
+                    point=Point(float(lat), float(lon)),
+                    source=PRG_SOURCE
+                )
+    except (IOError, ValueError) as e:
+        raise PrgDataError(
+            _('Incorrect PRG index slice {}: {}').format(filename, e)
+        ) from e
+
+
+def load_prg_addresses(index_dir: str, teryt_terc: str) -> List[Address]:
+    """
+    :param index_dir: directory created by ingest_prg_csv
+    :param teryt_terc: commune (gmina) id – 7 characters
+    :raises PrgDataError: if commune doesn't exist in the PRG index or its
+        slice is incorrect
+    :return: addresses of the commune
+    """
+    return list(iter_prg_addresses(index_dir, teryt_terc))
+
+
+def _parse_column(value: str) -> Dict[str, str]:
+    """
+    Type of --column argument: field=column e.g. housenumber=NUMER
+    """
+    field, separator, column = value.partition('=')
+    if not separator or field not in PRG_CSV_COLUMNS:
+        raise ArgumentTypeError(
+            _('expected field=column, fields: {}').format(
+                ', '.join(PRG_CSV_COLUMNS.keys())
+            )
+        )
+    return {field: column}
+
+
+if __name__ == '__main__':
+    setup_locale()
+
+    parser = ArgumentParser(
+        description=_('Splits national PRG addresses CSV into communes index.')
+    )
+    parser.add_argument('input', help=_('PRG addresses CSV file.'))
+    parser.add_argument(
+        'index_dir',
+        nargs='?',
+        default=PRG_INDEX_DIR,
+        help=_('output directory of the index (default: {}).').format(
+            PRG_INDEX_DIR
+        )
+    )
+    parser.add_argument(
+        '--column',
+        help=_(
+            'name of CSV column if it is other than default, e.g. '
+            'housenumber=NUMER (default: {}).'
+        ).format(', '.join(f'{k}={v}' for k, v in PRG_CSV_COLUMNS.items())),
+        type=_parse_column,
+        action='append',
+        default=[],
+        dest='columns'
+    )
+    args = parser.parse_args()
+
+    try:
+        with open(args.input, 'r', encoding='utf-8-sig', newline='') as f:
+            communes = ingest_prg_csv(
+                f,
+                args.index_dir,
+                {k: v for column in args.columns for k, v in column.items()}
+            )
+    except (IOError, KeyError, ValueError, PrgDataError) as e:
+        logger.error(_('Error with ingesting PRG data: {}').format(e))
+        sys.exit(1)
+
+    logger.info(
+        _('Ingested {} PRG addresses of {} communes.').format(
+            sum(communes.values()),
+            len(communes)
+        )
+    )
@@ -0,0 +1,539 @@
+"""
+Records responses of remote services (Overpass, punktyadresowe, GitHub)
+and replays them by local HTTP server with injected latency, bandwidth
+limit and errors, e.g. to test performance of many diffs without using
+the public services.
+
+Usage:
+python replay.py record <dir> <teryt_terc> [<teryt_terc> ...]
+python replay.py serve <dir> [--latency 0.5 --error-rate 0.05 ...]
+python replay.py loadtest <server_url> <teryt_terc> [...] --concurrency 8
+"""
+import hashlib
+import json
+import pathlib
+import random
+import requests
+import sys
+
+from argparse import ArgumentParser, ArgumentTypeError
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from tempfile import TemporaryDirectory
+from threading import Lock
+from time import perf_counter, sleep
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from config import gettext as _, logger, setup_locale
+from exceptions import DiffError
+from main import (
+    add_diff_arguments,
+    check_teryt_terc,
+    create_diff_options,
+    run_diff
+)
+from session import DiffOptions
+from utils.transport import (
+    get_backend,
+    HttpBackend,
+    RequestsBackend,
+    set_backend,
+    Timeout
+)
+
+
+# Recorded headers of responses (used e.g. by change detection)
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+# Injected errors by host – only status codes retried by the diff (e.g.
+# 504 of Overpass splits the query into parts which aren't recorded and
+# e-mapa or GitHub requests aren't retried)
+ERROR_CODES = {'overpass-api.de': (429,)}
+BANDWIDTH_CHUNKS_PER_SECOND = 10
+
+
+def _prepared_url(
+    method: str,
+    url: str,
+    params: Optional[Dict[str, Any]]
+) -> str:
+    return requests.Request(method, url, params=params).prepare().url
+
+
+def recording_filename(directory: str, method: str, url: str) -> str:
+    """
+    :param url: full url (with encoded params)
+    :return: path of recording without extension (.json/.body)
+    """
+    key = hashlib.sha256(f'{method.upper()} {url}'.encode('utf-8'))
+    return path.join(directory, key.hexdigest())
+
+
+class RecordingBackend(HttpBackend):
+    """
+    Saves all responses of other backend to directory (last response of
+    the same method and url is kept).
+    """
+    def __init__(self, directory: str, backend: HttpBackend):
+        self.directory = directory
+        self.backend = backend
+        pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: Timeout
+    ) -> requests.Response:
+        response = self.backend.request(method, url, params, timeout)
+
+        full_url = _prepared_url(method, url, params)
+        filename = recording_filename(self.directory, method, full_url)
+        with open(filename + '.body', 'wb') as f:
+            f.write(response.content)
+        with open(filename + '.json', 'w') as f:
+            json.dump(
+                {
+                    'method': method,
+                    'url': full_url,
+                    'status_code': response.status_code,
+                    'headers': {
+                        header: response.headers[header]
+                        for header in RECORDED_HEADERS
+                        if header in response.headers
+                    }
+                },
+                f,
+                indent=2
+            )
+
+        return response
+
+
+class RewriteBackend(HttpBackend):
+    """
+    Sends requests of all services to the replay server:
+    https://host/path?query -> <server_url>/https/host/path?query
+    """
+    def __init__(self, server_url: str, backend: HttpBackend):
+        self.server_url = server_url.rstrip('/')
+        self.backend = backend
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: Timeout
+    ) -> requests.Response:
+        parts = urlsplit(_prepared_url(method, url, params))
+        rewritten_url = f'{self.server_url}/{parts.scheme}/{parts.netloc}'
+        rewritten_url += parts.path
+        if parts.query:
+            rewritten_url += f'?{parts.query}'
+
+        return self.backend.request(method, rewritten_url, None, timeout)
+
+
+class TimingBackend(HttpBackend):
+    """
+    Collects duration of each request (with reading content) per host.
+    """
+    def __init__(self, backend: HttpBackend):
+        self.backend = backend
+        self.durations: Dict[str, List[float]] = dict()
+        self._lock = Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: Timeout
+    ) -> requests.Response:
+        start = perf_counter()
+        try:
+            return self.backend.request(method, url, params, timeout)
+        finally:
+            with self._lock:
+                self.durations.setdefault(urlsplit(url).netloc, []).append(
+                    perf_counter() - start
+                )
+
+
+@dataclass(frozen=True)
+class ReplaySettings:
+    latency: float = 0  # seconds before each response
+    bandwidth: Optional[int] = None  # bytes per second, None – unlimited
+    error_rate: float = 0  # probability (0–1) of error response
+    # status codes of injected errors by host, other hosts without errors
+    error_codes: Dict[str, Tuple[int, ...]] = field(
+        default_factory=lambda: dict(ERROR_CODES)
+    )
+    seed: Optional[int] = None  # of errors injection
+
+
+class ReplayServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        directory: str,
+        settings: ReplaySettings = ReplaySettings()
+    ):
+        super().__init__(address, _ReplayHandler)
+        self.directory = directory
+        self.settings = settings
+        self.random = random.Random(settings.seed)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def do_GET(self):
+        self._replay(send_body=True)
+
+    def do_HEAD(self):
+        self._replay(send_body=False)
+
+    def _send(
+        self,
+        status_code: int,
+        headers: Dict[str, str],
+        body: bytes,
+        send_body: bool
+    ) -> None:
+        self.send_response(status_code)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not send_body:
+            return
+
+        bandwidth = self.server.settings.bandwidth
+        if bandwidth is None:
+            self.wfile.write(body)
+            return
+
+        chunk_size = max(1, bandwidth // BANDWIDTH_CHUNKS_PER_SECOND)
+        for start in range(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write(chunk)
+            sleep(len(chunk) / bandwidth)
+
+    def _replay(self, send_body: bool) -> None:
+        settings = self.server.settings
+        if settings.latency:
+            sleep(settings.latency)
+
+        # /https/host/path?query -> https://host/path?query
+        _empty, scheme, rest = self.path.split('/', 2)
+        url = f'{scheme}://{rest}'
+
+        error_codes = settings.error_codes.get(urlsplit(url).netloc)
+        if error_codes and self.server.random.random() < settings.error_rate:
+            status_code = self.server.random.choice(error_codes)
+            self._send(status_code, dict(), b'', send_body)
+            return
+
+        filename = recording_filename(
+            self.server.directory,
+            self.command,
+            url
+        )
+        try:
+            with open(filename + '.json', 'r') as f:
+                recording = json.load(f)
+            with open(filename + '.body', 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            logger.warning(
+                _('Not recorded request: {} {}').format(self.command, rest)
+            )
+            self._send(404, dict(), b'', send_body)
+            return
+
+        self._send(
+            recording['status_code'],
+            recording['headers'],
+            body,
+            send_body
+        )
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(format % args)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    # nearest-rank
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, round(percent * len(values)) - 1))
+    return values[index]
+
+
+def _format_durations(durations: List[float]) -> str:
+    return _(
+        'p50: {:.2f} s, p95: {:.2f} s, p99: {:.2f} s, max: {:.2f} s'
+    ).format(
+        _percentile(durations, 0.50),
+        _percentile(durations, 0.95),
+        _percentile(durations, 0.99),
+        max(durations)
+    )
+
+
+def run_load_test(
+    communes_options: List[DiffOptions],
+    concurrency: int
+) -> Dict[str, List[float]]:
+    """
+    Runs diffs of communes concurrently (in threads) and logs throughput
+    and durations of diffs and requests.
+
+    :return: durations of successful diffs by teryt_terc
+    """
+    timing_backend = TimingBackend(get_backend())
+    set_backend(timing_backend)
+
+    def run_timed(options: DiffOptions) -> Optional[float]:
+        start = perf_counter()
+        try:
+            run_diff(options)
+        except DiffError as e:
+            logger.error(
+                _('Diff of commune {} failed: {}').format(
+                    options.teryt_terc,
+                    repr(e)
+                )
+            )
+            return None
+        return perf_counter() - start
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        durations = list(executor.map(run_timed, communes_options))
+    total_seconds = perf_counter() - start
+
+    diffs_durations: Dict[str, List[float]] = dict()
+    for options, duration in zip(communes_options, durations):
+        if duration is not None:
+            diffs_durations.setdefault(options.teryt_terc, []).append(
+                duration
+            )
+
+    succeeded = [d for d in durations if d is not None]
+    logger.info(
+        _('Load test: {} diffs ({} failed) in {:.1f} s, {:.2f} diffs/min')
+        .format(
+            len(durations),
+            len(durations) - len(succeeded),
+            total_seconds,
+            len(succeeded) * 60 / total_seconds
+        )
+    )
+    if succeeded:
+        logger.info(_('Diffs: {}').format(_format_durations(succeeded)))
+    for host, host_durations in sorted(timing_backend.durations.items()):
+        logger.info(
+            _('Requests {} ({}): {}').format(
+                host,
+                len(host_durations),
+                _format_durations(host_durations)
+            )
+        )
+
+    return diffs_durations
+
+
+def host_error_codes(value: str) -> Tuple[str, Tuple[int, ...]]:
+    """
+    :param value: host and status codes e.g. overpass-api.de=429,503
+    :raises ArgumentTypeError:
+    """
+    host, separator, codes = value.partition('=')
+    try:
+        if not host or not separator:
+            raise ValueError()
+        return host, tuple(int(code) for code in codes.split(','))
+    except ValueError:
+        raise ArgumentTypeError(
+            _('must be host=codes (e.g. {}): {}').format(
+                'overpass-api.de=429',
+                value
+            )
+        )
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description=_(
+            'Records and replays responses of remote services for offline '
+            'and load tests.'
+        )
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser(
+        'record',
+        help=_('run diffs of communes and save all responses.')
+    )
+    record_parser.add_argument(
+        'directory',
+        help=_('directory of recordings.')
+    )
+    record_parser.add_argument(
+        'teryt_terc',
+        help=_('ids of communes (gmina) – 7 characters.'),
+        nargs='+'
+    )
+    add_diff_arguments(record_parser)
+
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help=_('replay recorded responses by local HTTP server.')
+    )
+    serve_parser.add_argument(
+        'directory',
+        help=_('directory of recordings.')
+    )
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8000)
+    serve_parser.add_argument(
+        '--latency',
+        help=_('seconds before each response.'),
+        type=float,
+        default=0
+    )
+    serve_parser.add_argument(
+        '--bandwidth',
+        help=_('max bytes per second of each response.'),
+        type=int,
+        default=None
+    )
+    serve_parser.add_argument(
+        '--error-rate',
+        help=_('probability (0–1) of error response instead of recorded.'),
+        type=float,
+        default=0,
+        dest='error_rate'
+    )
+    serve_parser.add_argument(
+        '--error-codes',
+        help=_(
+            'host and status codes of its error responses, can be '
+            'repeated. Errors should be retried by the diff, other hosts '
+            'don\'t respond with errors (default: {}).'
+        ).format(' '.join(
+            f'{host}={",".join(map(str, codes))}'
+            for host, codes in ERROR_CODES.items()
+        )),
+        type=host_error_codes,
+        action='append',
+        default=None,
+        dest='error_codes'
+    )
+    serve_parser.add_argument(
+        '--seed',
+        help=_('seed of random errors.'),
+        type=int,
+        default=None
+    )
+
+    load_parser = subparsers.add_parser(
+        'loadtest',
+        help=_(
+            'run diffs of communes concurrently using the replay server '
+            'and report throughput and latency.'
+        )
+    )
+    load_parser.add_argument(
+        'server_url',
+        help=_('url of replay server e.g. http://127.0.0.1:8000')
+    )
+    load_parser.add_argument(
+        'teryt_terc',
+        help=_('ids of communes (gmina), can be repeated.'),
+        nargs='+'
+    )
+    load_parser.add_argument(
+        '--concurrency',
+        help=_('number of concurrent diffs (default: 4).'),
+        type=int,
+        default=4
+    )
+    add_diff_arguments(load_parser)
+
+    return parser
+
+
+if __name__ == '__main__':
+    setup_locale()
+
+    args = create_parser().parse_args()
+
+    if args.command == 'record':
+        if not all(map(check_teryt_terc, args.teryt_terc)):
+            sys.exit(1)
+
+        set_backend(RecordingBackend(args.directory, get_backend()))
+        for teryt_terc in args.teryt_terc:
+            try:
+                run_diff(create_diff_options(args, teryt_terc))
+            except DiffError as e:
+                logger.error(
+                    _('Diff of commune {} failed: {}').format(
+                        teryt_terc,
+                        repr(e)
+                    )
+                )
+
+    elif args.command == 'serve':
+        server = ReplayServer(
+            (args.host, args.port),
+            args.directory,
+            ReplaySettings(
+                latency=args.latency,
+                bandwidth=args.bandwidth,
+                error_rate=args.error_rate,
+                error_codes=(
+                    dict(args.error_codes)
+                    if args.error_codes is not None
+                    else dict(ERROR_CODES)
+                ),
+                seed=args.seed
+            )
+        )
+        logger.info(_('Replay server: {}').format(server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+    elif args.command == 'loadtest':
+        set_backend(RewriteBackend(
+            args.server_url,
+            RequestsBackend(pool_maxsize=args.concurrency * 2)
+        ))
+        with TemporaryDirectory() as output_base:
+            run_load_test(
+                [
+                    # each diff in own directory, communes can be repeated
+                    create_diff_options(
+                        args,
+                        teryt_terc,
+                        path.join(output_base, str(i))
+                    )
+                    for i, teryt_terc in enumerate(args.teryt_terc)
+                ],
+                args.concurrency
+            )
@@ -0,0 +1,349 @@
+import json
+
+from collections import Counter
+from os import path
+from typing import List, Optional, Tuple
+
+from address import Address, OsmAddress
+from analyze import MatchedAddress
+from buildings import BuildingAssignment
+from config import gettext as _, logger
+from session import DiffResult
+from writers.coverage import count_coverage, COVERAGE_FILENAME, save_coverage
+from writers.osm_ids import batch_osm_addresses, write_osm_ids
+from writers.registry import save_addresses
+from writers.tiled import save_tiled_report
+
+
+def report_osm_type(osm_type_distribution: Counter) -> str:
+    osm_type_dist = osm_type_distribution.most_common()
+    return _('OSM object type:') + ' \n{}'.format(
+        '\n'.join(f'{k}: {v}' for k, v in osm_type_dist)
+    )
+
+
+def report_key_value_distribution(
+    osm_tags_distribution: Counter,
+    osm_addresses: List[OsmAddress]
+) -> str:
+    kv_dist: List[Tuple] = osm_tags_distribution.most_common()
+    return _('Key-values distribution:') + '\n{}'.format(
+        '\n'.join(
+            f'{k}: {v} ({v * 100 / len(osm_addresses):.2f}%)'
+            for k, v in kv_dist
+        )
+    )
+
+
+def report_duplicates(
+    duplicated_addresses: List[List[OsmAddress]],
+    osm_address: List[OsmAddress]
+) -> str:
+    return _('Duplicated OSM addresses:') + ' {}/{} ({:.2f}%)'.format(
+        len(duplicated_addresses),
+        len(osm_address),
+        len(duplicated_addresses) * 100 / len(osm_address)
+    )
+
+
+def log_reports(result: DiffResult) -> None:
+    logger.info(
+        f'\n{report_osm_type(result.osm_type_distribution)}\n',
+        extra={'simple_fmt': True}
+    )
+    logger.info(
+        '{}\n'.format(report_key_value_distribution(
+            result.osm_tags_distribution,
+            result.osm_addresses
+        )),
+        extra={'simple_fmt': True}
+    )
+    logger.info(
+        '{}\n'.format(report_duplicates(
+            result.duplicated_osm_addresses,
+            result.osm_addresses
+        )),
+        extra={'simple_fmt': True}
+    )
+    if result.options.duplicates_max_distance is not None:
+        logger.info(
+            _(
+                'Same OSM addresses farther than {} m from each other: {}\n'
+            ).format(
+                result.options.duplicates_max_distance,
+                len(result.distant_osm_addresses)
+            ),
+            extra={'simple_fmt': True}
+        )
+    logger.info(
+        _('Missing OSM addresses which exist in the e-mapa: {}').format(
+            len(result.missing_emapa_addresses)
+        ),
+        extra={'simple_fmt': True}
+    )
+    logger.info(
+        _('Excess OSM addresses which do not exist in the e-mapa: {}').format(
+            len(result.excess_osm_addresses)
+        ),
+        extra={'simple_fmt': True}
+    )
+    logger.info(
+        _('Matched addresses with different tags or position: {}').format(
+            len(result.matched_with_differences)
+        ),
+        extra={'simple_fmt': True}
+    )
+
+
+def _josm_download_object_header() -> List[str]:
+    return [_(
+        'You can load it in the JOSM '
+        'using "Download object" function (CTRL + SHIFT + O).'
+    )]
+
+
+def save_missing_addresses(
+    missing_emapa_addresses: List[Address],
+    output_dir: str,
+    output_format: str
+) -> str:
+    return save_addresses(
+        missing_emapa_addresses,
+        output_dir,
+        'emapa_addresses_missing',
+        output_format
+    )
+
+
+def save_duplicated_addresses(
+    duplicated_osm_addresses: List[List[OsmAddress]],
+    output_dir: str
+) -> str:
+    if (
+        duplicated_osm_addresses
+        and type(duplicated_osm_addresses[0][0]) != OsmAddress
+    ):
+        raise AssertionError
+
+    filename = path.join(output_dir, 'osm_addresses_duplicates.txt')
+    write_osm_ids(
+        duplicated_osm_addresses,
+        filename,
+        _josm_download_object_header() + [_('Each line is for 1 address')]
+    )
+    return filename
+
+
+def save_distant_addresses(
+    distant_osm_addresses: List[List[OsmAddress]],
+    output_dir: str
+) -> str:
+    filename = path.join(output_dir, 'osm_addresses_duplicates_distant.txt')
+    write_osm_ids(
+        distant_osm_addresses,
+        filename,
+        _josm_download_object_header() + [_('Each line is for 1 address')]
+    )
+    return filename
+
+
+def save_excess_addresses(
+    excess_osm_addresses: List[OsmAddress],
+    output_dir: str,
+    ids_batch_size: Optional[int] = None
+) -> str:
+    """
+    :raises TypeError: if excess addresses aren't OSM addresses (without
+        OSM objects ids)
+    """
+    if not all(isinstance(a, OsmAddress) for a in excess_osm_addresses):
+        raise TypeError('Excess addresses must be OSM addresses')
+
+    filename = path.join(output_dir, 'osm_addresses_excess.txt')
+    write_osm_ids(
+        batch_osm_addresses(excess_osm_addresses, ids_batch_size),
+        filename,
+        _josm_download_object_header()
+    )
+    return filename
+
+
+def save_matched_with_differences(
+    matched_with_differences: List[MatchedAddress],
+    output_dir: str
+) -> str:
+    """
+    Saves e-mapa points of matched addresses with e-mapa tags and
+    properties: osm_obj (e.g. n123), differences (comma separated),
+    distance (metres) and osm:<tag> with OSM value of each different tag
+    """
+    geojson = Address.addresses_to_geojson(
+        [matched.emapa_address for matched in matched_with_differences]
+    )
+    for feature, matched in zip(
+        geojson['features'],
+        matched_with_differences
+    ):
+        properties = feature['properties']
+        properties['osm_obj'] = matched.osm_address.shorten_osm_obj
+        properties['differences'] = ','.join(matched.differences)
+        properties['distance'] = round(matched.distance, 1)
+        osm_tags = matched.osm_address.to_osm_tags()
+        for difference in matched.differences:
+            if difference in osm_tags:
+                properties[f'osm:{difference}'] = osm_tags[difference]
+
+    filename = path.join(
+        output_dir,
+        'addresses_matched_with_differences.geojson'
+    )
+    with open(filename, 'w') as f:
+        json.dump(geojson, f, indent=4)
+    return filename
+
+
+def save_building_assignments(
+    building_assignments: List[BuildingAssignment],
+    output_dir: str
+) -> str:
+    """
+    Saves e-mapa points of missing addresses with e-mapa tags and
+    properties: building_obj (e.g. w123, empty if there is no building within
+    max distance), building_position (inside/nearest), distance (metres),
+    conflict (building has other address) and osm:<tag> with address tags
+    of the building
+    """
+    geojson = Address.addresses_to_geojson(
+        [assignment.emapa_address for assignment in building_assignments]
+    )
+    for feature, assignment in zip(
+        geojson['features'],
+        building_assignments
+    ):
+        properties = feature['properties']
+        building = assignment.building
+        if building is None:
+            properties['building_obj'] = ''
+            continue
+
+        properties['building_obj'] = building.shorten_osm_obj
+        properties['building_position'] = (
+            'inside' if assignment.inside else 'nearest'
+        )
+        properties['distance'] = round(assignment.distance, 1)
+        properties['conflict'] = assignment.conflict
+        building_address = building.address()
+        if building_address is not None:
+            for key, value in building_address.to_osm_tags().items():
+                if value is not None:
+                    properties[f'osm:{key}'] = value
+
+    filename = path.join(
+        output_dir,
+        'emapa_addresses_missing_buildings.geojson'
+    )
+    with open(filename, 'w') as f:
+        json.dump(geojson, f, indent=4)
+    return filename
+
+
+def save_all_emapa_addresses(
+    emapa_addresses: List[Address],
+    output_dir: str,
+    output_format: str
+) -> str:
+    return save_addresses(
+        emapa_addresses,
+        output_dir,
+        'emapa_addresses_all',
+        output_format
+    )
+
+
+def save_tiled_addresses(result: DiffResult) -> List[str]:
+    options = result.options
+    filenames = save_tiled_report(
+        options.output_dir,
+        options.tile_zoom,
+        {'emapa_addresses_missing': result.missing_emapa_addresses},
+        {'osm_addresses_excess': result.excess_osm_addresses},
+        {'osm_addresses_duplicates': result.duplicated_osm_addresses},
+        _josm_download_object_header(),
+        options.output_format,
+        options.ids_batch_size
+    )
+    logger.info(
+        _('Saved tiled report with index: {}').format(filenames[-1])
+    )
+    return filenames
+
+
+def save_coverage_rollup(result: DiffResult) -> str:
+    """
+    Saves counts per street, SIMC and commune to the output_dir and, if set,
+    to the options.coverage_db shared by many communes
+
+    :return: path to the coverage file in the output_dir
+    """
+    options = result.options
+    counts = count_coverage(
+        result.emapa_addresses,
+        result.missing_emapa_addresses,
+        result.matched_with_differences,
+        result.osm_addresses,
+        result.excess_osm_addresses,
+        result.duplicated_osm_addresses,
+        options.min_unique
+    )
+    filename = path.join(options.output_dir, COVERAGE_FILENAME)
+    save_coverage(filename, options.teryt_terc, counts)
+    if options.coverage_db is not None:
+        save_coverage(options.coverage_db, options.teryt_terc, counts)
+    return filename
+
+
+def save_report(result: DiffResult) -> List[str]:
+    """
+    Saves all output files of the diff result to the options.output_dir
+
+    :return: paths of saved files in the options.output_dir
+    """
+    options = result.options
+    filenames = [save_duplicated_addresses(
+        result.duplicated_osm_addresses,
+        options.output_dir
+    )]
+    if options.duplicates_max_distance is not None:
+        filenames.append(save_distant_addresses(
+            result.distant_osm_addresses,
+            options.output_dir
+        ))
+    filenames.append(save_missing_addresses(
+        result.missing_emapa_addresses,
+        options.output_dir,
+        options.output_format
+    ))
+    filenames.append(save_excess_addresses(
+        result.excess_osm_addresses,
+        options.output_dir,
+        options.ids_batch_size
+    ))
+    filenames.append(save_matched_with_differences(
+        result.matched_with_differences,
+        options.output_dir
+    ))
+    filenames.append(save_all_emapa_addresses(
+        result.emapa_addresses,
+        options.output_dir,
+        options.output_format
+    ))
+    if result.building_assignments is not None:
+        filenames.append(save_building_assignments(
+            result.building_assignments,
+            options.output_dir
+        ))
+    if options.tile_zoom is not None:
+        filenames.extend(save_tiled_addresses(result))
+    filenames.append(save_coverage_rollup(result))
+
+    return filenames
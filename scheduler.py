@@ -0,0 +1,406 @@
+import hashlib
+import json
+import os
+import pathlib
+import sys
+
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass, replace
+from datetime import datetime
+from os import path
+from typing import Any, Dict, List, Optional
+
+from config import Config, gettext as _, logger, setup_locale
+from exceptions import DiffError
+from checkpoint import Checkpoints
+from main import (
+    add_diff_arguments,
+    check_teryt_terc,
+    create_diff_options,
+    run_diff
+)
+from parsers.prg import prg_slice_filename
+from session import checkpoints_dir, DiffOptions, emapa_gml_filename
+from utils.compression import open_compressed
+from utils.emapa_downloader import (
+    download_emapa_gml,
+    download_emapa_validators,
+    NUMBER_MATCHED_KEY,
+    VALIDATOR_HEADERS
+)
+from utils.overpass import download_osm_data, QUERY_CHANGES
+from utils.street_names_mappings import (
+    load_street_names_dt,
+    update_street_names_mappings
+)
+
+
+STATE_FILENAME = path.join(Config.OUTPUT_BASE, 'fingerprints.json')
+
+# Options which don't change results of the diff
+OPTIONS_NOT_FINGERPRINTED = (
+    'output_dir',
+    'no_street_names_update_check',
+    'memory_budget',
+    'emapa_page_size',
+    'emapa_max_connections',
+    'emapa_gml_filename',
+    'checkpoints',
+    'checkpoints_max_age',
+    'raw_compression',
+    'overpass_split_depth_filename'
+)
+# Overpass 'newer' filter value for communes without previous fingerprint
+OSM_EPOCH = '1970-01-01T00:00:00Z'
+HASH_CHUNK_SIZE = 2 ** 20
+
+
+@dataclass
+class OsmChanges:
+    osm_base: str  # timestamp of the Overpass data
+    counts: List[int]  # number of addresses and streets with alt names
+    changed: int  # number of addresses and streets changed since 'newer'
+    buildings_count: int
+    buildings_changed: int  # number of buildings changed since 'newer'
+
+
+def options_fingerprint(options: DiffOptions) -> str:
+    values = {
+        key: value
+        for key, value in asdict(options).items()
+        if key not in OPTIONS_NOT_FINGERPRINTED
+    }
+    return hashlib.sha256(
+        json.dumps(values, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def file_sha256(filename: str) -> Optional[str]:
+    """
+    :return: hex digest of (decompressed) file content or None if file
+        doesn't exist
+    """
+    if not path.isfile(filename):
+        return None
+
+    digest = hashlib.sha256()
+    with open_compressed(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def download_osm_changes(
+    teryt_terc: str,
+    newer: Optional[str]
+) -> Optional[OsmChanges]:
+    """
+    Counts OSM objects used by the diff instead of downloading them.
+    Deleted objects are detected by different counts, created and
+    modified ones by the 'newer' filter.
+
+    :param newer: osm_base timestamp of the previous check
+    :return: OsmChanges or None if data couldn't be downloaded
+    """
+    osm_data: Optional[Dict[str, Any]] = download_osm_data(
+        teryt_terc,
+        QUERY_CHANGES,
+        {'<newer>': newer or OSM_EPOCH}
+    )
+    if osm_data is None:
+        return None
+
+    try:
+        counts = [
+            int(element['tags']['total'])
+            for element in osm_data['elements']
+            if element['type'] == 'count'
+        ]
+        # pairs of total and changed: addresses, streets, buildings
+        return OsmChanges(
+            osm_base=osm_data['osm3s']['timestamp_osm_base'],
+            counts=counts[0:4:2],
+            changed=sum(counts[1:4:2]),
+            buildings_count=counts[4],
+            buildings_changed=counts[5]
+        )
+    except (KeyError, IndexError, ValueError) as e:
+        logger.error(
+            _('Error with downloading/parsing data: {}').format(e)
+        )
+        return None
+
+
+def _isoformat(dt: Optional[datetime]) -> Optional[str]:
+    return dt.isoformat() if dt is not None else None
+
+
+def _changed(
+    previous: Dict[str, Any],
+    fingerprint: Dict[str, Any],
+    *keys: str
+) -> List[str]:
+    return [key for key in keys if previous.get(key) != fingerprint.get(key)]
+
+
+def schedule_commune(
+    options: DiffOptions,
+    previous: Optional[Dict[str, Any]],
+    force: bool = False
+) -> Optional[Dict[str, Any]]:
+    """
+    Reruns diff of the commune only if any of its sources or options changed
+    since the previous fingerprint. Cheap checks are done first: options
+    and street names mappings (local), OSM objects counts (buildings only
+    if they are assigned), HTTP validators and number of features of
+    e-mapa. The e-mapa GML is downloaded and hashed only if nothing else
+    changed and the service doesn't send validators (number of features
+    doesn't detect modified ones).
+    Downloaded GML is reused by the diff.
+
+    :param previous: fingerprint of the last successful diff
+    :param force: rerun diff regardless of fingerprints
+    :return: new fingerprint or None if checks or diff failed
+    """
+    teryt_terc = options.teryt_terc
+    previous = previous or dict()
+    fingerprint: Dict[str, Any] = {
+        'options': options_fingerprint(options),
+        'street_names_dt': _isoformat(load_street_names_dt()),
+    }
+    changes = ['force'] if force or not previous else _changed(
+        previous,
+        fingerprint,
+        'options',
+        'street_names_dt'
+    )
+
+    osm_changes = download_osm_changes(teryt_terc, previous.get('osm_base'))
+    if osm_changes is None:
+        changes.append('osm')
+        if options.buildings:
+            changes.append('osm_buildings')
+    else:
+        fingerprint['osm_base'] = osm_changes.osm_base
+        fingerprint['osm_counts'] = osm_changes.counts
+        counts_changed = _changed(previous, fingerprint, 'osm_counts')
+        if osm_changes.changed or counts_changed:
+            changes.append('osm')
+        if options.buildings:
+            fingerprint['osm_buildings_count'] = osm_changes.buildings_count
+            if osm_changes.buildings_changed or _changed(
+                previous,
+                fingerprint,
+                'osm_buildings_count'
+            ):
+                changes.append('osm_buildings')
+
+    same_validators = False
+    if options.prg_index_dir is not None:
+        fingerprint['emapa_sha256'] = file_sha256(
+            prg_slice_filename(options.prg_index_dir, teryt_terc)
+        )
+        changes.extend(_changed(previous, fingerprint, 'emapa_sha256'))
+    else:
+        try:
+            validators = download_emapa_validators(teryt_terc[:-1])
+            fingerprint['emapa_validators'] = validators
+            previous_count = previous.get('emapa_validators', dict()).get(
+                NUMBER_MATCHED_KEY
+            )
+            if previous_count is not None and previous_count != validators.get(
+                NUMBER_MATCHED_KEY
+            ):
+                changes.append('emapa_count')
+
+            same_validators = (
+                any(header in validators for header in VALIDATOR_HEADERS)
+                and not _changed(previous, fingerprint, 'emapa_validators')
+            )
+            if not changes and same_validators:
+                fingerprint['emapa_sha256'] = previous.get('emapa_sha256')
+            elif not changes:
+                logger.info(_(
+                    'e-mapa service doesn\'t send HTTP validators, checking '
+                    'its data by hash of downloaded GML.'
+                ))
+                gml_filename = emapa_gml_filename(
+                    options.output_dir,
+                    options.raw_compression
+                )
+                pathlib.Path(options.output_dir).mkdir(
+                    parents=True,
+                    exist_ok=True
+                )
+                download_emapa_gml(
+                    teryt_terc[:-1],
+                    gml_filename,
+                    options.emapa_page_size,
+                    options.emapa_max_connections
+                )
+                fingerprint['emapa_sha256'] = file_sha256(gml_filename)
+                changes.extend(_changed(previous, fingerprint, 'emapa_sha256'))
+                options = replace(options, emapa_gml_filename=gml_filename)
+
+        except (DiffError, IOError) as e:
+            logger.error(
+                _('Error with downloading/saving data: {}').format(e)
+            )
+            return None
+
+    if not changes:
+        logger.info(_('Skipping unchanged commune: {}').format(teryt_terc))
+        return fingerprint
+
+    logger.info(
+        _('Running diff of commune {} (changed: {})').format(
+            teryt_terc,
+            ', '.join(changes)
+        )
+    )
+    if options.checkpoints:
+        # reuse only stages of sources which are known to be unchanged
+        stale_stages = []
+        if 'force' in changes or 'osm' in changes:
+            stale_stages.extend(['osm', 'osm_streets'])
+        if 'force' in changes or 'osm_buildings' in changes:
+            stale_stages.append('osm_buildings')
+        if 'force' in changes or (
+            'emapa_sha256' in changes
+            if options.prg_index_dir is not None
+            else not same_validators
+        ):
+            stale_stages.extend(['emapa_download', 'emapa_parse'])
+        Checkpoints(checkpoints_dir(options.output_dir)).invalidate(
+            *stale_stages
+        )
+
+    try:
+        run_diff(options)
+    except DiffError as e:
+        logger.error(
+            _('Diff of commune {} failed: {}').format(teryt_terc, repr(e))
+        )
+        return None
+
+    if options.prg_index_dir is None and 'emapa_sha256' not in fingerprint:
+        fingerprint['emapa_sha256'] = file_sha256(
+            emapa_gml_filename(options.output_dir, options.raw_compression)
+        )
+
+    return fingerprint
+
+
+def load_state(filename: str) -> Dict[str, Dict[str, Any]]:
+    """
+    :return: fingerprints by teryt_terc, empty if file doesn't exist
+    """
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+def save_state(state: Dict[str, Dict[str, Any]], filename: str) -> None:
+    # write and rename to not lose fingerprints if process is killed
+    pathlib.Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+
+def run_scheduler(
+    communes_options: List[DiffOptions],
+    state_filename: str = STATE_FILENAME,
+    force: bool = False
+) -> int:
+    """
+    Runs diffs of changed communes one by one. Fingerprints are saved
+    after each commune, so interrupted run can be continued.
+
+    :return: number of communes which couldn't be checked or compared
+    """
+    state = load_state(state_filename)
+
+    if any(not o.no_street_names_update_check for o in communes_options):
+        # check once instead of once per commune
+        update_street_names_mappings()
+        communes_options = [
+            replace(options, no_street_names_update_check=True)
+            for options in communes_options
+        ]
+
+    failed = 0
+    for options in communes_options:
+        fingerprint = schedule_commune(
+            options,
+            state.get(options.teryt_terc),
+            force
+        )
+        if fingerprint is None:
+            failed += 1
+            continue
+
+        state[options.teryt_terc] = fingerprint
+        save_state(state, state_filename)
+
+    logger.info(
+        _('Checked {} communes, failed: {}').format(
+            len(communes_options),
+            failed
+        )
+    )
+    return failed
+
+
+def create_parser() -> ArgumentParser:
+    parser = ArgumentParser(
+        description=_(
+            'Runs diff only for communes which sources changed since '
+            'the previous run.'
+        )
+    )
+    parser.add_argument(
+        'teryt_terc',
+        help=_('ids of communes (gmina) – 7 characters.'),
+        nargs='+',
+        type=str
+    )
+    parser.add_argument(
+        '--state-file',
+        help=_('file with fingerprints of sources (default: {}).').format(
+            STATE_FILENAME
+        ),
+        default=STATE_FILENAME,
+        dest='state_filename'
+    )
+    parser.add_argument(
+        '--force',
+        help=_('run diff of all communes and save their fingerprints.'),
+        action='store_true',
+        dest='force'
+    )
+    add_diff_arguments(parser)
+
+    return parser
+
+
+if __name__ == '__main__':
+    setup_locale()
+
+    args = create_parser().parse_args()
+
+    if not all(map(check_teryt_terc, args.teryt_terc)):
+        sys.exit(1)
+
+    failed_communes = run_scheduler(
+        [
+            create_diff_options(args, teryt_terc)
+            for teryt_terc in args.teryt_terc
+        ],
+        args.state_filename,
+        args.force
+    )
+    sys.exit(5 if failed_communes else 0)
@@ -0,0 +1,592 @@
+import os
+import pathlib
+
+from collections import Counter
+from dataclasses import dataclass, replace
+from lxml import etree
+from os import path
+from threading import Event
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    TypeVar
+)
+
+from analyze import analyze_addresses, MatchedAddress, MATCHED_MAX_DISTANCE
+from analyze_partitioned import analyze_addresses_partitioned
+from buildings import (
+    assign_buildings,
+    Building,
+    BuildingAssignment,
+    BUILDINGS_MAX_DISTANCE,
+    parse_buildings
+)
+from address import Address, OsmAddress
+from checkpoint import Checkpoints, CHECKPOINTS_MAX_AGE
+from config import gettext as _, logger
+from exceptions import (
+    DiffCancelled,
+    EmapaDownloadError,
+    OverpassDownloadError
+)
+from parsers.emapa import parse_emapa_file, parse_emapa_url
+from parsers.prg import load_prg_addresses, prg_slice_filename
+from utils.compression import (
+    compressed_filename,
+    DEFAULT_COMPRESSION,
+    NO_COMPRESSION
+)
+from utils.alt_street_names import (
+    parse_streets_names_from_elements,
+    replace_streets_with_osm_alt_names
+)
+from utils.emapa_downloader import (
+    download_emapa_gml,
+    download_punktyadresowe_metadata,
+    MAX_CONNECTIONS as EMAPA_MAX_CONNECTIONS,
+    PAGE_SIZE as EMAPA_PAGE_SIZE
+)
+from utils.overpass import (
+    download_osm_csv,
+    download_osm_data,
+    is_element,
+    QUERY_ADDR,
+    QUERY_ADDR_CSV,
+    QUERY_BUILDINGS,
+    QUERY_STREET,
+    SPLIT_DEPTH_FILENAME
+)
+from utils.normalize import log_cache_stats
+from utils.street_names_mappings import (
+    replace_streets_with_osm_names,
+    street_names_filename,
+    update_street_names_mappings
+)
+from writers.registry import DEFAULT_OUTPUT_FORMAT
+
+
+T = TypeVar('T')
+
+
+def emapa_gml_filename(
+    output_dir: str,
+    compression: str = NO_COMPRESSION
+) -> str:
+    return compressed_filename(
+        path.join(output_dir, 'emapa_addresses_raw.gml'),
+        compression
+    )
+
+
+def checkpoints_dir(output_dir: str) -> str:
+    return path.join(output_dir, 'checkpoints')
+
+
+def file_signature(filename: str) -> Optional[List[int]]:
+    """
+    :return: size and modification time (ns) of the file or None if it
+        doesn't exist – cheap key of stages which read the file
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+@dataclass(frozen=True)
+class DiffOptions:
+    teryt_terc: str  # commune (gmina) id – 7 characters str
+    output_dir: str  # path for all output files (and downloaded raw data)
+
+    duplicates_exclude_poi: bool = False
+    no_street_names_update_check: bool = False
+    no_street_alt_names_replace: bool = False
+    ignore_case_sensitive_housenumber: bool = False
+    ignore_street_features: bool = False
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+    tile_zoom: Optional[int] = None       # None – no tiled report
+    ids_batch_size: Optional[int] = None  # None – all ids in 1 line
+    # metres, None – duplicates regardless of distance between them
+    duplicates_max_distance: Optional[float] = None
+    # download OSM addresses as CSV with addr:* and POI tags only
+    compact_osm_query: bool = False
+    # metres, matched addresses farther than it have 'position' difference
+    matched_max_distance: float = MATCHED_MAX_DISTANCE
+    # MB of partitions analyzed concurrently by worker processes, if set
+    # diff is computed in partitions (datasets stay in memory for report)
+    memory_budget: Optional[int] = None
+    # store 64-bit hashes of matching keys instead of strings
+    compact_keys: bool = False
+    # if set, addresses are read from PRG index instead of e-mapa WFS
+    prg_index_dir: Optional[str] = None
+    emapa_page_size: int = EMAPA_PAGE_SIZE
+    emapa_max_connections: int = EMAPA_MAX_CONNECTIONS
+    # already downloaded e-mapa GML to use instead of downloading it again
+    emapa_gml_filename: Optional[str] = None
+    # store results of stages in output_dir and reuse them in next runs
+    checkpoints: bool = False
+    # hours, older downloaded data in checkpoints is downloaded again
+    checkpoints_max_age: float = CHECKPOINTS_MAX_AGE
+    # of downloaded e-mapa GML and checkpoints, see utils.compression
+    raw_compression: str = DEFAULT_COMPRESSION
+    # SQLite rollup of coverage shared by many communes (batch runs)
+    coverage_db: Optional[str] = None
+    # assign missing addresses to OSM buildings
+    buildings: bool = False
+    # metres, missing addresses farther from all buildings aren't assigned
+    buildings_max_distance: float = BUILDINGS_MAX_DISTANCE
+    # remembered split depths of Overpass queries, see utils.overpass
+    overpass_split_depth_filename: str = SPLIT_DEPTH_FILENAME
+
+    def min_unique(self, address: Address) -> str:
+        """
+        :return: address matching key normalized with these options
+        """
+        return address.match_key(
+            self.ignore_case_sensitive_housenumber,
+            self.ignore_street_features
+        )
+
+
+@dataclass
+class DiffResult:
+    options: DiffOptions
+
+    emapa_addresses: List[Address]
+    osm_addresses: List[OsmAddress]
+
+    osm_type_distribution: Counter
+    osm_tags_distribution: Counter
+    duplicated_osm_addresses: List[List[OsmAddress]]
+    distant_osm_addresses: List[List[OsmAddress]]
+    missing_emapa_addresses: List[Address]
+    excess_osm_addresses: List[OsmAddress]
+    matched_with_differences: List[MatchedAddress]
+    # only with buildings option
+    building_assignments: Optional[List[BuildingAssignment]] = None
+
+
+class DiffSession:
+    """
+    Addresses diff of a single commune. It doesn't use any global state,
+    so many sessions (with different options) can run concurrently.
+    """
+    def __init__(self, options: DiffOptions, cancel: Optional[Event] = None):
+        """
+        :param cancel: if it's set, the session raises DiffCancelled before
+            its next stage
+        """
+        self.options = options
+        self.cancel = cancel
+        self.checkpoints: Optional[Checkpoints] = None
+        if options.checkpoints:
+            self.checkpoints = Checkpoints(
+                checkpoints_dir(options.output_dir),
+                options.raw_compression
+            )
+
+    def stage(
+        self,
+        name: str,
+        inputs: Sequence[Any],
+        compute: Callable[[], T],
+        depends: Iterable[str] = (),
+        download: bool = False,
+        is_valid: Optional[Callable[[T], bool]] = None
+    ) -> T:
+        """
+        Runs stage of the diff. With checkpoints option, result of the stage
+        is stored and reused if inputs and upstream stages didn't change.
+        See Checkpoints.stage
+
+        :param download: stage downloads data, it's reused only for
+            checkpoints_max_age
+        :raises DiffCancelled: if the session was cancelled
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            raise DiffCancelled(name)
+
+        if self.checkpoints is None:
+            return compute()
+
+        max_age = None
+        if download:
+            max_age = self.options.checkpoints_max_age * 3600
+
+        return self.checkpoints.stage(
+            name,
+            inputs,
+            compute,
+            depends,
+            max_age,
+            is_valid
+        )
+
+    def download_emapa_gml(self) -> str:
+        """
+        Downloads e-mapa GML to the output_dir (if not downloaded already).
+
+        :raises ServiceNotFound, EmapaDownloadError:
+        :return: url of the e-mapa local system
+        """
+        teryt = self.options.teryt_terc[:-1]
+        try:
+            metadata = download_punktyadresowe_metadata(teryt)
+            local_system_url = parse_emapa_url(metadata)
+
+            if self.options.emapa_gml_filename is None:
+                download_emapa_gml(
+                    teryt,
+                    emapa_gml_filename(
+                        self.options.output_dir,
+                        self.options.raw_compression
+                    ),
+                    self.options.emapa_page_size,
+                    self.options.emapa_max_connections
+                )
+
+        except IOError as err:
+            raise EmapaDownloadError(err) from err
+
+        return local_system_url
+
+    def _emapa_gml_filename(self) -> str:
+        return self.options.emapa_gml_filename or emapa_gml_filename(
+            self.options.output_dir,
+            self.options.raw_compression
+        )
+
+    def parse_emapa_addresses(self, local_system_url: str) -> List[Address]:
+        """
+        :raises EmapaDownloadError: if downloaded GML can't be read
+        """
+        gml_filename = self._emapa_gml_filename()
+        try:
+            emapa_addresses: List[Address] = parse_emapa_file(
+                gml_filename,
+                local_system_url
+            )
+        except (IOError, etree.XMLSyntaxError) as err:
+            raise EmapaDownloadError(
+                _('Couldn\'t read e-mapa GML {}: {}').format(gml_filename, err)
+            ) from err
+
+        logger.info(
+            _('Parsed {} e-mapa addresses.').format(len(emapa_addresses))
+        )
+        return emapa_addresses
+
+    def download_emapa_addresses(self) -> List[Address]:
+        """
+        :raises ServiceNotFound, EmapaDownloadError:
+        """
+        return self.parse_emapa_addresses(self.download_emapa_gml())
+
+    def read_prg_addresses(self) -> List[Address]:
+        """
+        :raises PrgDataError: if commune doesn't exist in the PRG index
+        """
+        prg_addresses = load_prg_addresses(
+            self.options.prg_index_dir,
+            self.options.teryt_terc
+        )
+        logger.info(_('Loaded {} PRG addresses.').format(len(prg_addresses)))
+        return prg_addresses
+
+    def download_osm_addresses(self) -> List[OsmAddress]:
+        """
+        :raises OverpassDownloadError:
+        """
+        if self.options.compact_osm_query:
+            return self._download_osm_addresses_csv()
+
+        osm_data: Optional[Dict[str, Any]] = download_osm_data(
+            self.options.teryt_terc,
+            QUERY_ADDR,
+            split=True,
+            depth_filename=self.options.overpass_split_depth_filename
+        )
+        if osm_data is None:
+            raise OverpassDownloadError(
+                _('Error with downloading OSM (Overpass) addresses data.')
+            )
+
+        elements: List[Dict[str, Any]] = list(
+            filter(is_element, osm_data['elements'])
+        )
+
+        logger.debug(_('Downloaded {} OSM addresses elements.').format(
+            len(elements))
+        )
+        osm_addresses: List[OsmAddress] = list(
+            map(OsmAddress.parse_from_osm_element, elements)
+        )
+        logger.info(_('Parsed {} OSM addresses.').format(len(osm_addresses)))
+
+        return osm_addresses
+
+    def _download_osm_addresses_csv(self) -> List[OsmAddress]:
+        rows: Optional[List[Dict[str, str]]] = download_osm_csv(
+            self.options.teryt_terc,
+            QUERY_ADDR_CSV,
+            split=True,
+            depth_filename=self.options.overpass_split_depth_filename
+        )
+        if rows is None:
+            raise OverpassDownloadError(
+                _('Error with downloading OSM (Overpass) addresses data.')
+            )
+
+        osm_addresses: List[OsmAddress] = list(
+            map(OsmAddress.parse_from_osm_csv_row, rows)
+        )
+        logger.info(_('Parsed {} OSM addresses.').format(len(osm_addresses)))
+
+        return osm_addresses
+
+    def download_osm_alt_streets_names(self) -> Dict[str, str]:
+        """
+        :raises OverpassDownloadError:
+        """
+        osm_data: Optional[Dict[str, Any]] = download_osm_data(
+            self.options.teryt_terc,
+            QUERY_STREET,
+            split=True,
+            depth_filename=self.options.overpass_split_depth_filename
+        )
+        if osm_data is None:
+            raise OverpassDownloadError(
+                _('Error with downloading OSM (Overpass) street names data.')
+            )
+
+        elements: List[Dict[str, Any]] = osm_data['elements']
+        logger.debug(
+            _('Downloaded {} OSM street elements.').format(len(elements))
+        )
+
+        osm_streets: Dict[str, str] = parse_streets_names_from_elements(
+            elements
+        )
+        unique_street = set(w['tags']['name'] for w in elements)
+        logger.info(
+            _('Parsed {} OSM unique streets with {} alternate names.').format(
+                len(unique_street),
+                len(osm_streets)
+            )
+        )
+
+        return osm_streets
+
+    def download_osm_buildings(self) -> List[Building]:
+        """
+        :raises OverpassDownloadError:
+        """
+        osm_data: Optional[Dict[str, Any]] = download_osm_data(
+            self.options.teryt_terc,
+            QUERY_BUILDINGS,
+            split=True,
+            depth_filename=self.options.overpass_split_depth_filename
+        )
+        if osm_data is None:
+            raise OverpassDownloadError(
+                _('Error with downloading OSM (Overpass) buildings data.')
+            )
+
+        buildings = parse_buildings(osm_data['elements'])
+        logger.info(_('Parsed {} OSM buildings.').format(len(buildings)))
+
+        return buildings
+
+    def assign_buildings(
+        self,
+        missing_emapa_addresses: List[Address],
+        buildings: List[Building]
+    ) -> List[BuildingAssignment]:
+        assignments = assign_buildings(
+            missing_emapa_addresses,
+            buildings,
+            self.options.min_unique,
+            self.options.buildings_max_distance
+        )
+        logger.info(
+            _(
+                'Assigned {} of {} missing addresses to buildings '
+                '({} with conflicting address).'
+            ).format(
+                sum(a.building is not None for a in assignments),
+                len(assignments),
+                sum(a.conflict for a in assignments)
+            )
+        )
+
+        return assignments
+
+    def analyze(
+        self,
+        emapa_addresses: List[Address],
+        osm_addresses: List[OsmAddress]
+    ) -> DiffResult:
+        if self.options.memory_budget is not None:
+            analysis = analyze_addresses_partitioned(
+                emapa_addresses,
+                osm_addresses,
+                self.options.memory_budget * 2 ** 20,
+                self.options.duplicates_exclude_poi,
+                self.options.min_unique,
+                self.options.duplicates_max_distance,
+                self.options.matched_max_distance,
+                spill_dir=self.options.output_dir,
+                compact_keys=self.options.compact_keys
+            )
+        else:
+            analysis = analyze_addresses(
+                emapa_addresses,
+                osm_addresses,
+                self.options.duplicates_exclude_poi,
+                self.options.min_unique,
+                self.options.duplicates_max_distance,
+                self.options.matched_max_distance,
+                self.options.compact_keys
+            )
+        log_cache_stats()
+
+        return DiffResult(
+            options=self.options,
+            emapa_addresses=emapa_addresses,
+            osm_addresses=osm_addresses,
+            osm_type_distribution=analysis.osm_type_distribution,
+            osm_tags_distribution=analysis.osm_tags_distribution,
+            duplicated_osm_addresses=analysis.duplicated_osm_addresses,
+            distant_osm_addresses=analysis.distant_osm_addresses,
+            missing_emapa_addresses=analysis.missing_emapa_addresses,
+            excess_osm_addresses=analysis.excess_osm_addresses,
+            matched_with_differences=analysis.matched_with_differences
+        )
+
+    def run(self) -> DiffResult:
+        """
+        Downloads e-mapa and OSM addresses and streets, matches street names
+        and compares both datasets.
+
+        :raises ServiceNotFound, EmapaDownloadError, OverpassDownloadError,
+            PrgDataError, DiffCancelled:
+        """
+        # Create teryt_terc output directory if not exists
+        pathlib.Path(self.options.output_dir).mkdir(
+            parents=True,
+            exist_ok=True
+        )
+
+        options = self.options
+        if options.prg_index_dir is not None:
+            emapa_addresses: List[Address] = self.stage(
+                'emapa_parse',
+                [
+                    options.teryt_terc,
+                    options.prg_index_dir,
+                    file_signature(prg_slice_filename(
+                        options.prg_index_dir,
+                        options.teryt_terc
+                    ))
+                ],
+                self.read_prg_addresses
+            )
+        else:
+            local_system_url: str = self.stage(
+                'emapa_download',
+                [options.teryt_terc, options.raw_compression],
+                self.download_emapa_gml,
+                download=True,
+                # GML is parsed again if emapa_parse is recomputed
+                is_valid=lambda _url: path.isfile(self._emapa_gml_filename())
+            )
+            emapa_addresses: List[Address] = self.stage(
+                'emapa_parse',
+                [options.teryt_terc],
+                lambda: self.parse_emapa_addresses(local_system_url),
+                ['emapa_download']
+            )
+
+        osm_addresses: List[OsmAddress] = self.stage(
+            'osm',
+            [options.teryt_terc, options.compact_osm_query],
+            self.download_osm_addresses,
+            download=True
+        )
+
+        streets_depends = ['emapa_parse']
+        if not options.no_street_alt_names_replace:
+            osm_alt_streets_names = self.stage(
+                'osm_streets',
+                [options.teryt_terc],
+                self.download_osm_alt_streets_names,
+                download=True
+            )
+            streets_depends.append('osm_streets')
+
+        def replace_streets_names() -> List[Address]:
+            replace_streets_with_osm_names(emapa_addresses, False)
+            if not options.no_street_alt_names_replace:
+                replace_streets_with_osm_alt_names(
+                    emapa_addresses,
+                    osm_alt_streets_names
+                )
+            return emapa_addresses
+
+        if not options.no_street_names_update_check:
+            # before the key of the stage, which must be of the mappings
+            # used by the stage
+            update_street_names_mappings()
+        emapa_addresses = self.stage(
+            'streets',
+            [
+                options.no_street_alt_names_replace,
+                file_signature(street_names_filename())
+            ],
+            replace_streets_names,
+            streets_depends
+        )
+
+        result: DiffResult = self.stage(
+            'diff',
+            [
+                options.duplicates_exclude_poi,
+                options.ignore_case_sensitive_housenumber,
+                options.ignore_street_features,
+                options.duplicates_max_distance,
+                options.matched_max_distance
+            ],
+            lambda: self.analyze(emapa_addresses, osm_addresses),
+            ['streets', 'osm']
+        )
+        building_assignments = None
+        if options.buildings:
+            buildings: List[Building] = self.stage(
+                'osm_buildings',
+                [options.teryt_terc],
+                self.download_osm_buildings,
+                download=True
+            )
+            building_assignments = self.stage(
+                'buildings',
+                [options.buildings_max_distance],
+                lambda: self.assign_buildings(
+                    result.missing_emapa_addresses,
+                    buildings
+                ),
+                ['diff', 'osm_buildings']
+            )
+
+        # stored result could be computed with different report options
+        return replace(
+            result,
+            options=options,
+            building_assignments=building_assignments
+        )
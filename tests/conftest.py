@@ -0,0 +1,171 @@
+import random
+import sys
+
+from dataclasses import replace
+from os import path
+from typing import Any, Callable, Dict, List, Tuple
+
+import pytest
+
+
+# modules of the repository are imported from its root directory
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from address import Address, OsmAddress  # noqa: E402
+from equivalence import (  # noqa: E402
+    analysis_summary,
+    Dataset,
+    EMAPA_SOURCE,
+    generate_dataset,
+    load_recorded_dataset,
+    random_addresses,
+    read_files,
+    reference_analysis,
+    reference_min_unique,
+    reference_parse_emapa_file,
+    reference_parse_osm_element,
+    reference_replace_streets,
+    reference_write_report,
+    REPORT_FILES
+)
+from session import DiffOptions  # noqa: E402
+from utils.alt_street_names import (  # noqa: E402
+    parse_streets_names_from_elements
+)
+
+
+# analysis summary and contents of REPORT_FILES
+ReferenceResults = Tuple[Dict[str, Any], List[bytes]]
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('equivalence', 'tests of optimized paths')
+    group.addoption(
+        '--equivalence-seed',
+        help='seed of generated data (default: %(default)s).',
+        type=int,
+        default=0
+    )
+    group.addoption(
+        '--equivalence-count',
+        help='number of generated addresses (default: %(default)s).',
+        type=int,
+        default=200
+    )
+    group.addoption(
+        '--equivalence-recorded',
+        help='directory with responses recorded by replay.py.',
+        action='append',
+        default=[]
+    )
+
+
+def pytest_generate_tests(metafunc):
+    # generated and each recorded dataset
+    if 'dataset' in metafunc.fixturenames:
+        recorded = metafunc.config.getoption('equivalence_recorded')
+        metafunc.parametrize(
+            'dataset',
+            [None] + recorded,
+            indirect=True,
+            ids=['generated'] + [f'recorded-{d}' for d in recorded],
+            scope='session'
+        )
+
+
+@pytest.fixture(scope='session')
+def dataset(request) -> Dataset:
+    """
+    :return: generated dataset or recorded one from --equivalence-recorded
+    """
+    if request.param is None:
+        return generate_dataset(
+            request.config.getoption('equivalence_seed'),
+            request.config.getoption('equivalence_count')
+        )
+
+    return load_recorded_dataset(request.param)
+
+
+@pytest.fixture(scope='session')
+def reference_addresses(
+    dataset: Dataset,
+    tmp_path_factory
+) -> Tuple[List[Address], List[OsmAddress]]:
+    """
+    :return: e-mapa and OSM addresses of the dataset parsed by the reference
+    """
+    tmp_dir = tmp_path_factory.mktemp('gml')
+    emapa_addresses = []
+    for page_number, content in enumerate(dataset.gml_pages):
+        filename = tmp_dir / f'page{page_number}.gml'
+        filename.write_bytes(content)
+        emapa_addresses.extend(
+            reference_parse_emapa_file(str(filename), EMAPA_SOURCE)
+        )
+
+    osm_addresses = [
+        reference_parse_osm_element(e) for e in dataset.osm_elements
+    ]
+    return emapa_addresses, osm_addresses
+
+
+@pytest.fixture(scope='session')
+def generated_addresses(request) -> List[Address]:
+    """
+    :return: addresses with random names (see random_addresses)
+    """
+    return random_addresses(
+        random.Random(request.config.getoption('equivalence_seed')),
+        request.config.getoption('equivalence_count') * 5
+    )
+
+
+@pytest.fixture(scope='session')
+def reference_results(
+    dataset: Dataset,
+    reference_addresses: Tuple[List[Address], List[OsmAddress]],
+    tmp_path_factory
+) -> Callable[[DiffOptions], ReferenceResults]:
+    """
+    :return: function which returns reference results for matching
+        options, computed once for each combination of options
+    """
+    emapa_addresses, osm_addresses = reference_addresses
+    osm_streets = parse_streets_names_from_elements(dataset.street_elements)
+    results: Dict[Tuple[Any, ...], ReferenceResults] = dict()
+
+    def compute(options: DiffOptions) -> ReferenceResults:
+        icsh = options.ignore_case_sensitive_housenumber
+        isf = options.ignore_street_features
+        key = (
+            icsh,
+            isf,
+            options.duplicates_exclude_poi,
+            options.no_street_alt_names_replace,
+            options.duplicates_max_distance
+        )
+        if key in results:
+            return results[key]
+
+        reference_emapa = [replace(addr) for addr in emapa_addresses]
+        if not options.no_street_alt_names_replace:
+            reference_replace_streets(reference_emapa, osm_streets)
+
+        analysis = reference_analysis(
+            reference_emapa,
+            osm_addresses,
+            options.duplicates_exclude_poi,
+            lambda addr: reference_min_unique(addr, icsh, isf),
+            options.duplicates_max_distance,
+            options.matched_max_distance
+        )
+        output_dir = tmp_path_factory.mktemp('reference')
+        reference_write_report(analysis, str(output_dir))
+        results[key] = (
+            analysis_summary(analysis),
+            read_files(str(output_dir), REPORT_FILES)
+        )
+        return results[key]
+
+    return compute
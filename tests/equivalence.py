@@ -0,0 +1,736 @@
+"""
+Reference implementations of the original pipeline (GML/OSM parsing,
+matching keys, street names replacement, analysis, report writing) and
+datasets for tests of the optimized paths (test_equivalence.py): generated
+ones with tricky Polish street names and housenumbers or responses
+recorded by replay.py.
+"""
+import json
+import random
+
+from collections import Counter
+from dataclasses import dataclass, field
+from lxml import etree
+from operator import itemgetter
+from os import listdir, path
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape
+
+from address import Address, OsmAddress, OsmType, Point
+from analyze import (
+    AddressesAnalysis,
+    analyze_addresses,
+    KeyFunc,
+    MatchedAddress
+)
+from analyze_partitioned import analyze_addresses_partitioned
+from config import gettext as _
+from parsers.emapa import ADDRESS_XML_TAG
+from utils.geo import distance
+from utils.normalize import ULIC_FEATURES
+from utils.poi_tags import POI_KEYS
+
+
+EMAPA_SOURCE = 'equivalence.e-mapa.net'
+PARTITIONS = 8
+PARTITIONED_MEMORY_BUDGET = 2 ** 30  # bytes
+# metres, 0 – only the same points, None – without the option
+DUPLICATES_MAX_DISTANCES = [None, 0, 50, 5000]
+
+CITIES = [
+    ('Łódź', '0958656'),
+    ('Zielona Góra', '0981842'),
+    ('Żółkiewka', '0884519'),
+    ('Gród', '0123456'),
+    ('Sępólno Krajeńskie', '0867484'),
+    ('Nowa Wieś', '0200010'),
+    ('Nowa Wieś', '0200027'),  # same name, other SIMC
+]
+STREETS = [
+    None,
+    'Józefa Piłsudskiego',
+    'ul. Józefa Piłsudskiego',
+    'Aleja Wojska Polskiego',
+    'al. Wojska Polskiego',
+    'aleja Wojska Polskiego',
+    'Plac Wolności',
+    'pl. Wolności',
+    'Rynek',
+    'Rynek Główny',
+    'Parkowa',         # contains feature "park"
+    'Wyspiańskiego',   # contains feature "wyspa" (after lower case)
+    'Ogródkowa',       # contains feature "ogród"
+    'Osiedle Tysiąclecia',
+    'os. Tysiąclecia',
+    'Droga Krzyżowa',
+    'Szosa Chełmińska',
+    'Wybrzeże Kościuszkowskie',
+    'wyb. Kościuszkowskie',
+    'Bulwar Filadelfijski',
+    'Skwer im. ks. Jana Twardowskiego',
+    'Inne',
+    'ULICA ŚWIĘTEGO ŁUKASZA',
+    '3 Maja',
+    '11 Listopada',
+    'Świętej Trójcy',
+    'Rondo',
+]
+# OSM name: e-mapa name used as an alternate name of the street
+ALT_STREETS = {
+    'Marszałka Józefa Piłsudskiego': (
+        'official_name',
+        'Józefa Piłsudskiego'
+    ),
+    'Świętego Jana': ('alt_name', 'Św. Jana'),
+    'Kardynała Stefana Wyszyńskiego': ('short_name', 'Kard. Wyszyńskiego'),
+    'Ignacego Łukasiewicza': ('loc_name', 'ŁUKASIEWICZA'),
+}
+HOUSENUMBER_SUFFIXES = [
+    '', '', '', 'a', 'A', 'b', 'B', 'ą', 'Ą', 'ł', 'Ł',
+    '/1', '/2', 'a/3', 'A/3', ' a', '-4', 'bis',
+]
+POLISH_LETTERS = 'aąbcćdeęfghijklłmnńoóprsśtuwyzźż'
+RANDOM_ALPHABET = (
+    POLISH_LETTERS + POLISH_LETTERS.upper() + '0123456789 ./-'
+)
+
+
+@dataclass
+class Dataset:
+    name: str
+    gml_pages: List[bytes] = field(default_factory=list)
+    osm_elements: List[Dict[str, Any]] = field(default_factory=list)
+    street_elements: List[Dict[str, Any]] = field(default_factory=list)
+
+
+# Reference implementations – straightforward versions of the original
+# pipeline. Don't optimize them, they define expected results.
+
+def reference_min_unique(
+    addr: Address,
+    ignore_case_sensitive_housenumber: bool,
+    ignore_street_features: bool
+) -> str:
+    street = addr.street if addr.street else ''
+
+    housenumber = addr.housenumber
+    if ignore_case_sensitive_housenumber:
+        housenumber = housenumber.lower()
+
+    if ignore_street_features:
+        street = street.lower()
+        for feature in ULIC_FEATURES:
+            street = street.replace(feature, '')
+        street = street.strip()
+
+    return f'{addr.city}{street}{housenumber}'
+
+
+def reference_parse_emapa_file(
+    input_filename: str,
+    source: str
+) -> List[Address]:
+    addresses = []
+    root = etree.parse(input_filename).getroot()
+    ns = root.nsmap
+    for elem in root.xpath('wfs:member/ms:punkty_adresowe', namespaces=ns):
+        def text(tag: str) -> str:
+            return elem.find(f'ms:{tag}', namespaces=ns).text.strip()
+
+        raw_street = elem.findtext('ms:NAZWA_ULICY', namespaces=ns)
+        lat, lon = list(map(float, elem.find(
+            'ms:msGeometry/gml:Point/gml:pos', namespaces=ns
+        ).text.strip().split()))
+
+        addresses.append(Address(
+            city=text('NAZWA_MIEJSCOWOSCI'),
+            city_simc=text('ID_MIEJSCOWOSCI'),
+            street=raw_street.strip() if raw_street else None,
+            housenumber=text('NUMER_PORZADKOWY'),
+            postcode=text('KOD_POCZTOWY'),
+            point=Point(lat, lon),
+            source=source
+        ))
+
+    return addresses
+
+
+def reference_parse_osm_element(element: Dict[str, Any]) -> OsmAddress:
+    osm_type = OsmType(element['type'])
+    if osm_type == OsmType.NODE:
+        point = Point(element['lat'], element['lon'])
+    else:
+        point = Point(element['center']['lat'], element['center']['lon'])
+
+    tags = element['tags']
+    if 'addr:street' in tags:
+        city = tags.get('addr:city', None)
+    else:
+        city = tags.get('addr:place', None)
+
+    return OsmAddress(
+        osm_id=element['id'],
+        osm_type=osm_type,
+        point=point,
+        city=city,
+        city_simc=tags.get('addr:city:simc', None),
+        street=tags.get('addr:street', None),
+        housenumber=tags.get('addr:housenumber', None),
+        postcode=tags.get('addr:postcode', None),
+        source=tags.get('source:addr', None),
+        all_obj_tags=tags
+    )
+
+
+def reference_replace_streets(
+    emapa_addresses: List[Address],
+    osm_alt_streets_names: Dict[str, str]
+) -> None:
+    for addr in emapa_addresses:
+        if addr.street and addr.street.lower() in osm_alt_streets_names:
+            addr.street = osm_alt_streets_names[addr.street.lower()]
+
+
+def _reference_is_excluded_poi(osm_addr: OsmAddress) -> bool:
+    tags = osm_addr.all_obj_tags.keys()
+    return any(k in POI_KEYS for k in tags) and 'building' not in tags
+
+
+def reference_cluster_points(
+    points: List[Point],
+    max_distance: float
+) -> List[List[int]]:
+    """
+    Compares all pairs of points (without grid index).
+    """
+    clusters: List[List[int]] = []
+    clustered: Set[int] = set()
+    for first in range(len(points)):
+        if first in clustered:
+            continue
+
+        cluster = [first]
+        clustered.add(first)
+        for i in cluster:  # extended while iterating
+            for j in range(len(points)):
+                if j not in clustered and distance(
+                    points[i],
+                    points[j]
+                ) <= max_distance:
+                    cluster.append(j)
+                    clustered.add(j)
+
+        clusters.append(sorted(cluster))
+
+    return clusters
+
+
+def reference_analysis(
+    emapa_addresses: List[Address],
+    osm_addresses: List[OsmAddress],
+    duplicates_exclude_poi: bool,
+    key: KeyFunc,
+    duplicates_max_distance: Optional[float],
+    matched_max_distance: float
+) -> AddressesAnalysis:
+    osm_type = Counter(addr.osm_type for addr in osm_addresses)
+    tags = Counter(
+        tag_key
+        for addr in osm_addresses
+        for tag_key in addr.all_obj_tags.keys()
+        if tag_key.startswith('addr:') or tag_key == 'source:addr'
+    )
+
+    duplicated: Dict[str, List[OsmAddress]] = dict()
+    for osm_addr in osm_addresses:
+        if duplicates_exclude_poi and _reference_is_excluded_poi(osm_addr):
+            continue
+        duplicated.setdefault(key(osm_addr), []).append(osm_addr)
+
+    osm_by_key: Dict[str, List[OsmAddress]] = dict()
+    for osm_addr in osm_addresses:
+        osm_by_key.setdefault(key(osm_addr), []).append(osm_addr)
+    emapa_keys: Set[str] = {key(addr) for addr in emapa_addresses}
+
+    missing = []
+    matched_with_differences = []
+    for emapa_addr in emapa_addresses:
+        candidates = osm_by_key.get(key(emapa_addr), [])
+        if not candidates:
+            missing.append(emapa_addr)
+            continue
+
+        osm_addr, addr_distance = min(
+            [(c, distance(emapa_addr.point, c.point)) for c in candidates],
+            key=itemgetter(1)
+        )
+        differences = []
+        if emapa_addr.postcode != osm_addr.postcode:
+            differences.append('addr:postcode')
+        if emapa_addr.city_simc != osm_addr.city_simc:
+            differences.append('addr:city:simc')
+        if addr_distance > matched_max_distance:
+            differences.append('position')
+        if differences:
+            matched_with_differences.append(MatchedAddress(
+                emapa_address=emapa_addr,
+                osm_address=osm_addr,
+                differences=differences,
+                distance=addr_distance
+            ))
+
+    duplicated_blocks = [
+        block for block in duplicated.values() if len(block) > 1
+    ]
+    distant = []
+    if duplicates_max_distance is not None:
+        duplicated_blocks, blocks = [], duplicated_blocks
+        for block in blocks:
+            clusters = reference_cluster_points(
+                [addr.point for addr in block],
+                duplicates_max_distance
+            )
+            duplicated_blocks.extend(
+                [block[i] for i in cluster]
+                for cluster in clusters
+                if len(cluster) > 1
+            )
+            if len(clusters) > 1:
+                distant.append(block)
+
+    return AddressesAnalysis(
+        osm_type_distribution=osm_type,
+        osm_tags_distribution=tags,
+        duplicated_osm_addresses=duplicated_blocks,
+        distant_osm_addresses=distant,
+        missing_emapa_addresses=missing,
+        excess_osm_addresses=[
+            addr for addr in osm_addresses if key(addr) not in emapa_keys
+        ],
+        matched_with_differences=matched_with_differences
+    )
+
+
+# files written by reference_write_report
+REPORT_FILES = [
+    'emapa_addresses_missing.geojson',
+    'osm_addresses_duplicates.txt',
+    'osm_addresses_duplicates_distant.txt',
+    'osm_addresses_excess.txt',
+]
+
+
+def reference_write_report(
+    analysis: AddressesAnalysis,
+    output_dir: str
+) -> None:
+    """
+    Writes missing, excess and duplicated addresses files the same way
+    as the original main.py (and distant duplicates in the same format)
+    """
+    header = '# ' + _(
+        'You can load it in the JOSM '
+        'using "Download object" function (CTRL + SHIFT + O).'
+    )
+    filename = path.join(output_dir, 'emapa_addresses_missing.geojson')
+    with open(filename, 'w') as f:
+        json.dump(
+            Address.addresses_to_geojson(analysis.missing_emapa_addresses),
+            f,
+            indent=4
+        )
+
+    filename = path.join(output_dir, 'osm_addresses_duplicates.txt')
+    with open(filename, 'w') as f:
+        f.write(header)
+        f.write('\n# ' + _('Each line is for 1 address'))
+        for block in analysis.duplicated_osm_addresses:
+            f.write('\n' + ','.join([a.shorten_osm_obj for a in block]))
+
+    filename = path.join(output_dir, 'osm_addresses_duplicates_distant.txt')
+    with open(filename, 'w') as f:
+        f.write(header)
+        f.write('\n# ' + _('Each line is for 1 address'))
+        for block in analysis.distant_osm_addresses:
+            f.write('\n' + ','.join([a.shorten_osm_obj for a in block]))
+
+    filename = path.join(output_dir, 'osm_addresses_excess.txt')
+    with open(filename, 'w') as f:
+        f.write(header)
+        # the original crashed on empty list, now header only is written
+        if analysis.excess_osm_addresses:
+            f.write('\n' + ','.join([
+                a.shorten_osm_obj for a in analysis.excess_osm_addresses
+            ]))
+
+
+# Datasets
+
+def _gml_page(rows: List[Tuple[str, ...]]) -> bytes:
+    """
+    :param rows: (city, simc, street, housenumber, postcode, lat, lon)
+        values as they are written in the GML (street can be empty)
+    """
+    members = []
+    for i, (city, simc, street, housenumber, postcode, lat, lon) in (
+        enumerate(rows)
+    ):
+        members.append(
+            f'<wfs:member><ms:punkty_adresowe gml:id="p.{i}">'
+            f'<ms:msGeometry><gml:Point gml:id="g{i}" '
+            f'srsName="urn:ogc:def:crs:EPSG::4326">'
+            f'<gml:pos>{lat} {lon}</gml:pos></gml:Point></ms:msGeometry>'
+            f'<ms:NAZWA_MIEJSCOWOSCI>{escape(city)}</ms:NAZWA_MIEJSCOWOSCI>'
+            f'<ms:ID_MIEJSCOWOSCI>{simc}</ms:ID_MIEJSCOWOSCI>'
+            f'<ms:NAZWA_ULICY>{escape(street)}</ms:NAZWA_ULICY>'
+            f'<ms:NUMER_PORZADKOWY>{escape(housenumber)}'
+            f'</ms:NUMER_PORZADKOWY>'
+            f'<ms:KOD_POCZTOWY>{postcode}</ms:KOD_POCZTOWY>'
+            f'</ms:punkty_adresowe></wfs:member>'
+        )
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<wfs:FeatureCollection '
+        'xmlns:ms="http://mapserver.gis.umn.edu/mapserver" '
+        'xmlns:gml="http://www.opengis.net/gml/3.2" '
+        'xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+        f'numberMatched="{len(rows)}" numberReturned="{len(rows)}">'
+        + ''.join(members)
+        + '</wfs:FeatureCollection>\n'
+    ).encode('utf-8')
+
+
+def _osm_element(
+    rng: random.Random,
+    osm_id: int,
+    lat: float,
+    lon: float,
+    tags: Dict[str, str]
+) -> Dict[str, Any]:
+    osm_type = rng.choice(['node', 'node', 'way', 'relation'])
+    element = {'type': osm_type, 'id': osm_id, 'tags': tags}
+    if osm_type == 'node':
+        element.update(lat=lat, lon=lon)
+    else:
+        element['center'] = {'lat': lat, 'lon': lon}
+
+    # building, POI on building or POI only (excluded from duplicates)
+    extra = rng.choice([
+        {'building': 'yes'},
+        {'building': 'house'},
+        {'building': 'yes', 'shop': 'bakery'},
+        {'amenity': 'school'},
+        {'office': 'government'},
+        {},
+    ])
+    tags.update(extra)
+
+    return element
+
+
+def _variant_street(rng: random.Random, street: Optional[str]) -> str:
+    """
+    :return: street as it can be written in the OSM (matched only with
+        some options)
+    """
+    if not street:
+        return street
+
+    return rng.choice([
+        street,
+        street,
+        street.upper(),
+        'ul. ' + street,
+        street.replace('ul. ', ''),
+        street.replace('al. ', 'Aleja '),
+        street.lower(),
+    ])
+
+
+def _variant_housenumber(rng: random.Random, housenumber: str) -> str:
+    return rng.choice([
+        housenumber,
+        housenumber,
+        housenumber.upper(),
+        housenumber.lower(),
+    ])
+
+
+def generate_dataset(seed: int, count: int) -> Dataset:
+    """
+    :param count: number of e-mapa addresses (OSM ones are similar count)
+    :return: e-mapa page and OSM elements with random differences
+        (missing/excess/duplicated addresses, case of housenumber, street
+        features, alternate street names, postcode, position, SIMC)
+    """
+    rng = random.Random(seed)
+    dataset = Dataset(f'generated (seed {seed})')
+    rows = []
+    osm_id = 1
+
+    for osm_name, (alt_key, alt_value) in ALT_STREETS.items():
+        dataset.street_elements.append({
+            'type': 'way',
+            'id': osm_id,
+            'tags': {'name': osm_name, alt_key: alt_value}
+        })
+        osm_id += 1
+
+    for _i in range(count):
+        city, simc = rng.choice(CITIES)
+        if rng.random() < 0.1:
+            osm_street, (_k, street) = rng.choice(list(ALT_STREETS.items()))
+            # case of alternate names doesn't matter
+            street = rng.choice([street, street.lower(), street.upper()])
+        else:
+            street = rng.choice(STREETS)
+            osm_street = _variant_street(rng, street)
+        housenumber = str(rng.randint(1, 60)) + rng.choice(
+            HOUSENUMBER_SUFFIXES
+        )
+        postcode = f'{rng.randint(0, 99):02d}-{rng.randint(0, 999):03d}'
+        lat = round(50 + rng.random(), 7)
+        lon = round(19 + rng.random(), 7)
+        rows.append((
+            rng.choice([city, f' {city} ']),
+            simc,
+            rng.choice(['', ' ']) if street is None else rng.choice([
+                street, f' {street}  '
+            ]),
+            rng.choice([housenumber, f'{housenumber} ']),
+            postcode,
+            lat,
+            lon
+        ))
+
+        if rng.random() < 0.15:
+            continue  # missing in the OSM
+
+        for _duplicate in range(1 if rng.random() < 0.85 else 2):
+            tags = {
+                'addr:housenumber': _variant_housenumber(rng, housenumber),
+                'addr:city:simc': simc if rng.random() < 0.9 else '0000000',
+                'addr:postcode': (
+                    postcode if rng.random() < 0.9 else '00-000'
+                ),
+            }
+            if osm_street:
+                tags['addr:city'] = city
+                tags['addr:street'] = osm_street
+            else:
+                tags['addr:place'] = city
+            if rng.random() < 0.3:
+                tags['source:addr'] = 'gugik.gov.pl'
+
+            # the same point, ~10 m or ~1 km from the e-mapa address
+            offset_random = rng.random()
+            offset = 0.0 if offset_random < 0.2 else (
+                0.0001 if offset_random < 0.9 else 0.01
+            )
+            dataset.osm_elements.append(_osm_element(
+                rng,
+                osm_id,
+                round(lat + rng.uniform(-offset, offset), 7),
+                round(lon + rng.uniform(-offset, offset), 7),
+                tags
+            ))
+            osm_id += 1
+
+    for _i in range(count // 10):
+        city, simc = rng.choice(CITIES)
+        street = rng.choice(STREETS)
+        tags = {
+            'addr:housenumber': str(rng.randint(61, 99)),
+            'addr:city:simc': simc,
+        }
+        if street:
+            tags.update({'addr:city': city, 'addr:street': street})
+        else:
+            tags['addr:place'] = city
+        dataset.osm_elements.append(_osm_element(
+            rng,
+            osm_id,
+            round(50 + rng.random(), 7),
+            round(19 + rng.random(), 7),
+            tags
+        ))
+        osm_id += 1
+
+    rng.shuffle(dataset.osm_elements)
+    dataset.gml_pages.append(_gml_page(rows))
+
+    return dataset
+
+
+def _is_emapa_page(content: bytes) -> bool:
+    if not content.lstrip().startswith(b'<'):
+        return False
+
+    try:
+        root = etree.fromstring(content)
+    except etree.XMLSyntaxError:
+        return False
+
+    return next(root.iterfind('.//' + ADDRESS_XML_TAG), None) is not None
+
+
+def load_recorded_dataset(directory: str) -> Dataset:
+    """
+    :param directory: responses recorded by replay.py
+    :return: e-mapa pages, OSM addresses (with addr:housenumber) and
+        streets (with name) of all recorded communes
+    """
+    dataset = Dataset(f'recorded ({directory})')
+    for name in sorted(listdir(directory)):
+        if not name.endswith('.body'):
+            continue
+
+        with open(path.join(directory, name), 'rb') as f:
+            content = f.read()
+
+        if _is_emapa_page(content):
+            dataset.gml_pages.append(content)
+            continue
+
+        try:
+            elements = json.loads(content).get('elements', [])
+        except (ValueError, AttributeError):
+            continue
+
+        for element in elements:
+            tags = element.get('tags', {})
+            if 'addr:housenumber' in tags:
+                dataset.osm_elements.append(element)
+            elif 'name' in tags:
+                dataset.street_elements.append(element)
+
+    return dataset
+
+
+def random_addresses(rng: random.Random, count: int) -> List[Address]:
+    """
+    :return: addresses with random Polish-like names mixed with street
+        features (property-based cases for matching keys)
+    """
+    def random_text() -> str:
+        words = []
+        for _i in range(rng.randint(0, 4)):
+            if rng.random() < 0.4:
+                feature = rng.choice(ULIC_FEATURES)
+                words.append(rng.choice([
+                    feature,
+                    feature.upper(),
+                    feature.capitalize()
+                ]))
+            else:
+                words.append(''.join(
+                    rng.choice(RANDOM_ALPHABET)
+                    for _j in range(rng.randint(1, 8))
+                ))
+        return rng.choice([' ', '', '  ']).join(words)
+
+    return [
+        Address(
+            point=Point(0, 0),
+            city_simc='0000000',
+            housenumber=random_text() or '1',
+            postcode='00-000',
+            city=random_text(),
+            street=rng.choice([None, '', random_text()]),
+            source=''
+        )
+        for _i in range(count)
+    ]
+
+
+# Optimized paths
+
+def analysis_summary(analysis: AddressesAnalysis) -> Dict[str, Any]:
+    """
+    :return: results with OSM addresses replaced by their identifiers
+        (shorter descriptions of mismatches)
+    """
+    return {
+        'osm_type_distribution': analysis.osm_type_distribution,
+        'osm_tags_distribution': analysis.osm_tags_distribution,
+        'duplicated_osm_addresses': [
+            [addr.shorten_osm_obj for addr in block]
+            for block in analysis.duplicated_osm_addresses
+        ],
+        'distant_osm_addresses': [
+            [addr.shorten_osm_obj for addr in block]
+            for block in analysis.distant_osm_addresses
+        ],
+        'missing_emapa_addresses': analysis.missing_emapa_addresses,
+        'excess_osm_addresses': [
+            addr.shorten_osm_obj for addr in analysis.excess_osm_addresses
+        ],
+        'matched_with_differences': [
+            (
+                match.emapa_address,
+                match.osm_address.shorten_osm_obj,
+                match.differences,
+                match.distance
+            )
+            for match in analysis.matched_with_differences
+        ],
+    }
+
+
+def _analyze_partitioned(compact_keys: bool) -> Callable[..., Any]:
+    def analyze(
+        emapa_addresses: List[Address],
+        osm_addresses: List[OsmAddress],
+        duplicates_exclude_poi: bool,
+        key: KeyFunc,
+        duplicates_max_distance: Optional[float]
+    ) -> AddressesAnalysis:
+        # datasets streamed as with generators of parsers
+        return analyze_addresses_partitioned(
+            iter(emapa_addresses),
+            iter(osm_addresses),
+            PARTITIONED_MEMORY_BUDGET,
+            duplicates_exclude_poi,
+            key,
+            duplicates_max_distance,
+            partitions=PARTITIONS,
+            compact_keys=compact_keys
+        )
+
+    return analyze
+
+
+def _analyze_compact(
+    emapa_addresses: List[Address],
+    osm_addresses: List[OsmAddress],
+    duplicates_exclude_poi: bool,
+    key: KeyFunc,
+    duplicates_max_distance: Optional[float]
+) -> AddressesAnalysis:
+    return analyze_addresses(
+        emapa_addresses,
+        osm_addresses,
+        duplicates_exclude_poi,
+        key,
+        duplicates_max_distance,
+        compact_keys=True
+    )
+
+
+# name: function(emapa, osm, duplicates_exclude_poi, key,
+#   duplicates_max_distance)
+ANALYSIS_PATHS: Dict[str, Callable[..., AddressesAnalysis]] = {
+    'in-memory': analyze_addresses,
+    'compact-keys': _analyze_compact,
+    'partitioned': _analyze_partitioned(compact_keys=False),
+    'partitioned-compact-keys': _analyze_partitioned(compact_keys=True),
+}
+
+
+def read_files(directory: str, filenames: List[str]) -> List[bytes]:
+    contents = []
+    for filename in filenames:
+        with open(path.join(directory, filename), 'rb') as f:
+            contents.append(f.read())
+
+    return contents
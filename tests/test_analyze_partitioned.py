@@ -0,0 +1,144 @@
+from itertools import product
+from os import path
+from operator import attrgetter
+from typing import List, Tuple
+
+import pytest
+
+from address import Address, OsmAddress
+from analyze import AddressesAnalysis, analyze_addresses
+from analyze_partitioned import (
+    PARTITIONS as PARTITIONS_UNKNOWN_SIZE,
+    _create_partitions,
+    _estimate_partitions,
+    _spill,
+    _split_partition,
+    analyze_addresses_partitioned
+)
+from equivalence import EMAPA_SOURCE, generate_dataset
+from parsers.emapa import parse_emapa_file
+from session import DiffOptions
+
+
+MEMORY_BUDGET = 2 ** 30  # bytes
+PARTITIONS = 4
+SMALL_MEMORY_BUDGET = 2 ** 17  # bytes
+
+
+@pytest.fixture(scope='module')
+def addresses(tmp_path_factory) -> Tuple[List[Address], List[OsmAddress]]:
+    dataset = generate_dataset(seed=1, count=500)
+    gml_filename = path.join(tmp_path_factory.mktemp('emapa'), 'emapa.gml')
+    with open(gml_filename, 'wb') as f:
+        f.write(dataset.gml_pages[0])
+
+    return (
+        parse_emapa_file(gml_filename, EMAPA_SOURCE),
+        [
+            OsmAddress.parse_from_osm_element(element)
+            for element in dataset.osm_elements
+        ]
+    )
+
+
+@pytest.mark.parametrize(
+    'icsh, isf, exclude_poi, duplicates_max_distance, compact_keys',
+    [
+        (icsh, isf, exclude_poi, max_distance, False)
+        for icsh, isf, exclude_poi, max_distance in product(
+            [False, True],
+            [False, True],
+            [False, True],
+            [None, 50.0]
+        )
+    ] + [(True, True, True, 50.0, True)]
+)
+def test_partitioned_same_as_in_memory(
+    addresses,
+    tmp_path,
+    icsh,
+    isf,
+    exclude_poi,
+    duplicates_max_distance,
+    compact_keys
+):
+    emapa_addresses, osm_addresses = addresses
+    key = DiffOptions(
+        '',
+        '',
+        ignore_case_sensitive_housenumber=icsh,
+        ignore_street_features=isf
+    ).min_unique
+
+    expected = analyze_addresses(
+        emapa_addresses,
+        osm_addresses,
+        exclude_poi,
+        key,
+        duplicates_max_distance
+    )
+    actual = analyze_addresses_partitioned(
+        emapa_addresses,
+        osm_addresses,
+        MEMORY_BUDGET,
+        exclude_poi,
+        key,
+        duplicates_max_distance,
+        spill_dir=str(tmp_path),
+        partitions=PARTITIONS,
+        compact_keys=compact_keys
+    )
+
+    assert expected.missing_emapa_addresses
+    assert expected.excess_osm_addresses
+    assert expected.duplicated_osm_addresses
+    if duplicates_max_distance is not None:
+        assert expected.distant_osm_addresses
+    assert actual == expected
+
+
+def test_streamed_datasets_split_to_memory_budget(addresses, tmp_path):
+    emapa_addresses, osm_addresses = addresses
+    expected = analyze_addresses(emapa_addresses, osm_addresses)
+    actual = analyze_addresses_partitioned(
+        iter(emapa_addresses),
+        iter(osm_addresses),
+        SMALL_MEMORY_BUDGET,
+        spill_dir=str(tmp_path),
+        partitions=1
+    )
+
+    assert actual == expected
+
+
+def test_partitions_estimated_from_memory_budget(addresses):
+    emapa_addresses, osm_addresses = addresses
+    assert _estimate_partitions(
+        emapa_addresses,
+        osm_addresses,
+        SMALL_MEMORY_BUDGET
+    ) > _estimate_partitions(emapa_addresses, osm_addresses, MEMORY_BUDGET)
+    assert _estimate_partitions(
+        iter(emapa_addresses),
+        iter(osm_addresses),
+        SMALL_MEMORY_BUDGET
+    ) == PARTITIONS_UNKNOWN_SIZE
+
+
+def test_partition_over_memory_budget_split(addresses, tmp_path):
+    emapa_addresses, osm_addresses = addresses
+    key = attrgetter('min_unique')
+    partition = _create_partitions(str(tmp_path), '', 1, 1)[0]
+    _spill(enumerate(emapa_addresses), [partition], 'emapa', key, 1)
+    _spill(enumerate(osm_addresses), [partition], 'osm', key, 1)
+    assert partition.memory() > SMALL_MEMORY_BUDGET
+
+    partitions = _split_partition(partition, SMALL_MEMORY_BUDGET, key)
+    assert len(partitions) > 1
+    assert all(p.memory() <= SMALL_MEMORY_BUDGET for p in partitions)
+    # only files of the split partitions are left
+    assert set(tmp_path.iterdir()) == {
+        tmp_path / path.basename(p.filename(dataset))
+        for p in partitions
+        for dataset in ('emapa', 'osm')
+    }
@@ -0,0 +1,88 @@
+import time
+
+from argparse import ArgumentParser
+
+from checkpoint import Checkpoints
+from main import add_diff_arguments, create_diff_options
+from session import emapa_gml_filename, file_signature
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self) -> int:
+        self.calls += 1
+        return self.calls
+
+
+def test_stage_reused_until_inputs_change(tmp_path):
+    compute = Counter()
+    checkpoints = Checkpoints(str(tmp_path))
+
+    assert checkpoints.stage('a', [1], compute) == 1
+    assert Checkpoints(str(tmp_path)).stage('a', [1], compute) == 1
+    assert Checkpoints(str(tmp_path)).stage('a', [2], compute) == 2
+
+
+def test_downstream_stage_recomputed(tmp_path):
+    upstream = Counter()
+    downstream = Counter()
+    checkpoints = Checkpoints(str(tmp_path))
+    checkpoints.stage('up', [1], upstream)
+    checkpoints.stage('down', [], downstream, ['up'])
+
+    checkpoints.stage('up', [2], upstream)
+    assert checkpoints.stage('down', [], downstream, ['up']) == 2
+
+
+def test_max_age(tmp_path, monkeypatch):
+    compute = Counter()
+    checkpoints = Checkpoints(str(tmp_path))
+    checkpoints.stage('download', [], compute, max_age=3600)
+    assert checkpoints.stage('download', [], compute, max_age=3600) == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 7200)
+    assert checkpoints.stage('download', [], compute, max_age=3600) == 2
+
+
+def test_is_valid(tmp_path):
+    compute = Counter()
+    checkpoints = Checkpoints(str(tmp_path))
+    checkpoints.stage('report', [], compute)
+
+    assert checkpoints.stage(
+        'report',
+        [],
+        compute,
+        is_valid=lambda result: result == 1
+    ) == 1
+    assert checkpoints.stage(
+        'report',
+        [],
+        compute,
+        is_valid=lambda result: False
+    ) == 2
+
+
+def test_file_signature(tmp_path):
+    filename = tmp_path / 'slice.csv'
+    assert file_signature(str(filename)) is None
+
+    filename.write_text('a')
+    signature = file_signature(str(filename))
+    filename.write_text('ab')
+    assert file_signature(str(filename)) != signature
+
+
+def test_raw_data_uncompressed_by_default(tmp_path):
+    parser = ArgumentParser()
+    add_diff_arguments(parser)
+    options = create_diff_options(parser.parse_args([]), '1465011', tmp_path)
+
+    # file names don't depend on installed compression packages
+    assert emapa_gml_filename(
+        options.output_dir,
+        options.raw_compression
+    ) == str(tmp_path / '1465011' / 'emapa_addresses_raw.gml')
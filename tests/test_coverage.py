@@ -0,0 +1,54 @@
+from address import Address, OsmAddress, OsmType, Point
+from writers.coverage import count_coverage
+
+
+def _address(housenumber: str, city_simc: str, street: str) -> Address:
+    return Address(
+        point=Point(50.0, 19.0),
+        city_simc=city_simc,
+        housenumber=housenumber,
+        postcode='00-000',
+        city='Kraków',
+        street=street,
+        source=''
+    )
+
+
+def _osm_address(
+    osm_id: int,
+    housenumber: str,
+    city_simc: str,
+    street: str
+) -> OsmAddress:
+    return OsmAddress(
+        **vars(_address(housenumber, city_simc, street)),
+        osm_id=osm_id,
+        osm_type=OsmType.NODE,
+        all_obj_tags=dict()
+    )
+
+
+def test_osm_addresses_counted_with_matched_emapa_address():
+    emapa_addresses = [_address('1', '0950463', 'Długa')]
+    # matched with other SIMC tag, duplicated, excess
+    osm_addresses = [
+        _osm_address(1, '1', '0000000', 'Długa'),
+        _osm_address(2, '1', '0950463', 'Długa'),
+        _osm_address(3, '2', '0000000', 'Długa'),
+    ]
+    counts = count_coverage(
+        emapa_addresses,
+        [],
+        [],
+        osm_addresses,
+        [osm_addresses[2]],
+        [osm_addresses[:2]]
+    )
+
+    assert counts[('0950463', 'Długa')] == {
+        'emapa': 1,
+        'matched': 1,
+        'osm': 2,
+        'duplicated': 2,
+    }
+    assert counts[('0000000', 'Długa')] == {'osm': 1, 'excess': 1}
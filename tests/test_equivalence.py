@@ -0,0 +1,202 @@
+"""
+Optimized paths of the diff compared with reference implementations of the
+original pipeline (see equivalence.py), for each combination of matching
+options. Larger or recorded data can be checked by:
+python -m pytest tests/test_equivalence.py --equivalence-count 2000
+--equivalence-recorded <dir>
+"""
+from dataclasses import replace
+from typing import List, Optional, Tuple
+
+import pytest
+
+from address import Address, OsmAddress
+from equivalence import (
+    analysis_summary,
+    ANALYSIS_PATHS,
+    Dataset,
+    DUPLICATES_MAX_DISTANCES,
+    EMAPA_SOURCE,
+    read_files,
+    reference_min_unique,
+    reference_parse_emapa_file,
+    reference_replace_streets,
+    REPORT_FILES
+)
+from parsers.emapa import parse_emapa_file
+from report import (
+    save_distant_addresses,
+    save_duplicated_addresses,
+    save_excess_addresses,
+    save_missing_addresses
+)
+from session import DiffOptions
+from utils.alt_street_names import (
+    parse_streets_names_from_elements,
+    replace_streets_with_osm_alt_names
+)
+from utils.compression import (
+    compressed_filename,
+    COMPRESSIONS,
+    open_compressed
+)
+
+
+@pytest.mark.parametrize('compression', sorted(COMPRESSIONS))
+def test_parse_emapa_file(dataset: Dataset, compression: str, tmp_path):
+    for page_number, content in enumerate(dataset.gml_pages):
+        filename = tmp_path / f'page{page_number}.gml'
+        filename.write_bytes(content)
+        compressed = compressed_filename(
+            str(tmp_path / f'compressed{page_number}.gml'),
+            compression
+        )
+        with open_compressed(compressed, 'wb') as f:
+            f.write(content)
+
+        assert parse_emapa_file(compressed, EMAPA_SOURCE) == (
+            reference_parse_emapa_file(str(filename), EMAPA_SOURCE)
+        )
+
+
+def test_parse_osm_element(
+    dataset: Dataset,
+    reference_addresses: Tuple[List[Address], List[OsmAddress]]
+):
+    _emapa_addresses, osm_addresses = reference_addresses
+
+    assert [
+        OsmAddress.parse_from_osm_element(e) for e in dataset.osm_elements
+    ] == osm_addresses
+
+
+def test_parse_osm_csv_row(
+    dataset: Dataset,
+    reference_addresses: Tuple[List[Address], List[OsmAddress]]
+):
+    _emapa_addresses, osm_addresses = reference_addresses
+    columns = sorted({k for e in dataset.osm_elements for k in e['tags']})
+    rows = []
+    for element in dataset.osm_elements:
+        point = element['center'] if 'center' in element else element
+        row = {column: element['tags'].get(column, '') for column in columns}
+        row.update({
+            '@type': element['type'],
+            '@id': str(element['id']),
+            '@lat': repr(point['lat']),
+            '@lon': repr(point['lon'])
+        })
+        rows.append(row)
+
+    assert [
+        OsmAddress.parse_from_osm_csv_row(row) for row in rows
+    ] == osm_addresses
+
+
+@pytest.mark.parametrize('isf', [False, True])
+@pytest.mark.parametrize('icsh', [False, True])
+def test_match_key(
+    generated_addresses: List[Address],
+    reference_addresses: Tuple[List[Address], List[OsmAddress]],
+    icsh: bool,
+    isf: bool
+):
+    emapa_addresses, osm_addresses = reference_addresses
+    addresses = generated_addresses + emapa_addresses + osm_addresses
+    options = DiffOptions(
+        '',
+        '',
+        ignore_case_sensitive_housenumber=icsh,
+        ignore_street_features=isf
+    )
+    reference = [reference_min_unique(a, icsh, isf) for a in addresses]
+
+    assert [options.min_unique(addr) for addr in addresses] == reference
+    # second call uses memoized normalizations
+    assert [options.min_unique(addr) for addr in addresses] == reference
+
+
+def test_min_unique(
+    generated_addresses: List[Address],
+    reference_addresses: Tuple[List[Address], List[OsmAddress]]
+):
+    emapa_addresses, osm_addresses = reference_addresses
+    addresses = generated_addresses + emapa_addresses + osm_addresses
+
+    assert [addr.min_unique for addr in addresses] == [
+        reference_min_unique(addr, False, False) for addr in addresses
+    ]
+
+
+def test_replace_streets_with_osm_alt_names(
+    dataset: Dataset,
+    reference_addresses: Tuple[List[Address], List[OsmAddress]]
+):
+    emapa_addresses, _osm_addresses = reference_addresses
+    osm_streets = parse_streets_names_from_elements(dataset.street_elements)
+    reference = [replace(addr) for addr in emapa_addresses]
+    optimized = [replace(addr) for addr in emapa_addresses]
+    reference_replace_streets(reference, osm_streets)
+    replace_streets_with_osm_alt_names(optimized, osm_streets)
+
+    assert optimized == reference
+
+
+@pytest.mark.parametrize('path_name', list(ANALYSIS_PATHS.keys()))
+@pytest.mark.parametrize('max_distance', DUPLICATES_MAX_DISTANCES)
+@pytest.mark.parametrize('no_alt_names', [False, True])
+@pytest.mark.parametrize('exclude_poi', [False, True])
+@pytest.mark.parametrize('isf', [False, True])
+@pytest.mark.parametrize('icsh', [False, True])
+def test_analysis(
+    dataset: Dataset,
+    reference_addresses: Tuple[List[Address], List[OsmAddress]],
+    reference_results,
+    tmp_path,
+    icsh: bool,
+    isf: bool,
+    exclude_poi: bool,
+    no_alt_names: bool,
+    max_distance: Optional[float],
+    path_name: str
+):
+    options = DiffOptions(
+        '',
+        str(tmp_path),
+        ignore_case_sensitive_housenumber=icsh,
+        ignore_street_features=isf,
+        duplicates_exclude_poi=exclude_poi,
+        no_street_alt_names_replace=no_alt_names,
+        duplicates_max_distance=max_distance
+    )
+    reference_summary, reference_files = reference_results(options)
+    emapa_addresses, osm_addresses = reference_addresses
+    emapa_addresses = [replace(addr) for addr in emapa_addresses]
+    if not no_alt_names:
+        replace_streets_with_osm_alt_names(
+            emapa_addresses,
+            parse_streets_names_from_elements(dataset.street_elements)
+        )
+
+    analysis = ANALYSIS_PATHS[path_name](
+        emapa_addresses,
+        osm_addresses,
+        exclude_poi,
+        options.min_unique,
+        max_distance
+    )
+    save_missing_addresses(
+        analysis.missing_emapa_addresses,
+        str(tmp_path),
+        options.output_format
+    )
+    save_duplicated_addresses(analysis.duplicated_osm_addresses, str(tmp_path))
+    save_distant_addresses(analysis.distant_osm_addresses, str(tmp_path))
+    save_excess_addresses(
+        analysis.excess_osm_addresses,
+        str(tmp_path),
+        options.ids_batch_size
+    )
+
+    assert analysis_summary(analysis) == reference_summary
+    assert read_files(str(tmp_path), REPORT_FILES) == reference_files
@@ -0,0 +1,177 @@
+import multiprocessing
+import time
+
+from threading import Event
+
+import pytest
+
+import job_queue
+
+from exceptions import DiffCancelled
+from job_queue import create_parser, DONE, FAILED, JobQueue, LEASED, PENDING
+from session import DiffOptions, DiffSession
+
+
+LEASE_DURATION = 0.5  # seconds
+
+
+def _lease_and_wait(queue_dir: str, leased) -> None:
+    leased.put(JobQueue(queue_dir, LEASE_DURATION).lease('killed'))
+    time.sleep(60)
+
+
+def _lease_in_killed_process(queue_dir: str) -> str:
+    leased = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=_lease_and_wait,
+        args=(queue_dir, leased)
+    )
+    process.start()
+    try:
+        return leased.get(timeout=30)
+    finally:
+        process.kill()
+        process.join()
+
+
+def test_lease_of_killed_worker_expires(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    queue = JobQueue(queue_dir, LEASE_DURATION)
+    queue.add(['1465011'])
+
+    assert _lease_in_killed_process(queue_dir) == '1465011'
+    assert queue.lease('other') is None
+    assert queue.has_active_leases()
+
+    time.sleep(LEASE_DURATION)
+    assert not queue.has_active_leases()
+    assert queue.lease('other') == '1465011'
+
+    # result of the killed worker isn't accepted anymore
+    assert not queue.heartbeat('1465011', 'killed')
+    queue.complete('1465011', 'killed')
+    assert queue.status() == {LEASED: 1}
+
+    queue.complete('1465011', 'other')
+    assert queue.status() == {DONE: 1}
+
+
+def test_expired_lease_failed_after_max_attempts(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    queue = JobQueue(queue_dir, LEASE_DURATION)
+    queue.add(['1465011'])
+
+    assert _lease_in_killed_process(queue_dir) == '1465011'
+    time.sleep(LEASE_DURATION)
+    assert queue.lease('other', max_attempts=1) is None
+    assert queue.status() == {FAILED: 1}
+    assert queue.failed() == [('1465011', 'lease expired')]
+
+
+def test_heartbeat_sets_lost_lease(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, 'HEARTBEAT_INTERVAL', 0.05)
+    queue_dir = str(tmp_path / 'queue')
+    queue = JobQueue(queue_dir, LEASE_DURATION)
+    queue.add(['1465011'])
+
+    assert _lease_in_killed_process(queue_dir) == '1465011'
+    time.sleep(LEASE_DURATION)
+    assert queue.lease('other') == '1465011'
+
+    lost = Event()
+    job_queue._heartbeat(queue, '1465011', 'killed', Event(), lost)
+    assert lost.is_set()
+
+
+def test_cancelled_session_doesnt_run_stage(tmp_path):
+    cancel = Event()
+    session = DiffSession(DiffOptions('1465011', str(tmp_path)), cancel)
+    assert session.stage('a', [], lambda: 1) == 1
+
+    cancel.set()
+    with pytest.raises(DiffCancelled):
+        session.stage('b', [], lambda: 2)
+
+
+def _lease_all(queue_dir: str, worker: str, leased) -> None:
+    queue = JobQueue(queue_dir, LEASE_DURATION)
+    while True:
+        teryt_terc = queue.lease(worker)
+        if teryt_terc is None:
+            return
+        leased.put(teryt_terc)
+
+
+def test_job_leased_by_one_of_concurrent_workers(tmp_path):
+    queue_dir = str(tmp_path / 'queue')
+    queue = JobQueue(queue_dir, LEASE_DURATION)
+    teryt_tercs = [f'{i:07}' for i in range(200)]
+    queue.add(teryt_tercs)
+
+    leased = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_lease_all,
+            args=(queue_dir, f'worker{i}', leased)
+        )
+        for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    leased_tercs = [leased.get(timeout=30) for _i in teryt_tercs]
+    for process in processes:
+        process.join()
+
+    assert sorted(leased_tercs) == teryt_tercs
+    assert leased.empty()
+    assert queue.status() == {LEASED: len(teryt_tercs)}
+
+
+def test_failed_job_retried_until_max_attempts(tmp_path):
+    queue = JobQueue(str(tmp_path / 'queue'), LEASE_DURATION)
+    queue.add(['1465011'])
+
+    assert queue.lease('worker', max_attempts=2) == '1465011'
+    queue.complete('1465011', 'worker', 'error 1', max_attempts=2)
+    assert queue.status() == {PENDING: 1}
+
+    assert queue.lease('worker', max_attempts=2) == '1465011'
+    queue.complete('1465011', 'worker', 'error 2', max_attempts=2)
+    assert queue.failed() == [('1465011', 'error 2')]
+
+    queue.add(['1465011'])
+    assert queue.status() == {PENDING: 1}
+
+
+def test_overpass_slots_limited(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, 'POLL_INTERVAL', 0.01)
+    queue = JobQueue(str(tmp_path / 'queue'), LEASE_DURATION)
+
+    with queue.overpass_slot('a', 2), queue.overpass_slot('b', 2):
+        assert not queue._acquire_slot('0', 'c')
+        assert not queue._acquire_slot('1', 'c')
+    with queue.overpass_slot('c', 2):
+        assert queue._acquire_slot('1', 'd')
+
+
+def test_overpass_slot_of_killed_worker_released(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_queue, 'OVERPASS_SLOT_LEASE', 0.1)
+    queue = JobQueue(str(tmp_path / 'queue'), LEASE_DURATION)
+
+    assert queue._acquire_slot('0', 'killed')
+    assert not queue._acquire_slot('0', 'other')
+    time.sleep(0.2)
+    assert queue._acquire_slot('0', 'other')
+
+    # slot taken over by other worker isn't released by the killed one
+    queue._release_slot('0', 'killed')
+    assert not queue._acquire_slot('0', 'next')
+
+
+@pytest.mark.parametrize(
+    'option',
+    ['--processes', '--overpass-slots', '--max-attempts']
+)
+def test_worker_options_must_be_positive(option, capsys):
+    with pytest.raises(SystemExit):
+        create_parser().parse_args(['worker', option, '0'])
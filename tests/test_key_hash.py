@@ -0,0 +1,84 @@
+import subprocess
+import sys
+
+from operator import attrgetter
+from os import path
+
+import pytest
+
+from address import Address, Point
+from utils import key_hash
+from utils.key_hash import KeyHashIndex
+
+
+ROOT_DIR = path.dirname(path.dirname(path.abspath(__file__)))
+
+
+def _address(housenumber: str) -> Address:
+    return Address(
+        point=Point(50.0, 19.0),
+        city_simc='0000000',
+        housenumber=housenumber,
+        postcode='00-000',
+        city='Kraków',
+        street='Długa',
+        source=''
+    )
+
+
+def test_analyze_doesnt_import_numpy():
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-c',
+            'import sys, analyze; print("numpy" in sys.modules)'
+        ],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    assert result.stdout.strip() == 'False'
+
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_index_with_and_without_numpy(monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(key_hash, '_numpy', lambda: None)
+
+    addresses = [_address(n) for n in ['1', '2', '1', '3', '2', '1']]
+    index = KeyHashIndex(addresses, lambda addr: addr.min_unique)
+
+    assert index.positions(_address('1').min_unique) == [0, 2, 5]
+    assert index.get(_address('4').min_unique) is None
+    assert index.contains_many(
+        _address(n).min_unique for n in ['3', '4', '2']
+    ) == [True, False, True]
+    assert index.duplicated_positions() == [[0, 2, 5], [1, 4]]
+
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_positions_many_with_collisions(monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(key_hash, '_numpy', lambda: None)
+    # housenumbers 1 and 2 collide in the index, 3 and 4 only with query
+    colliding = {'1': 1, '2': 1, '3': 3, '4': 3, '5': 5}
+    monkeypatch.setattr(
+        key_hash,
+        'key_hash',
+        lambda addr_key: colliding[addr_key]
+    )
+
+    addresses = [_address(n) for n in ['1', '2', '3', '1', '3']]
+    index = KeyHashIndex(addresses, attrgetter('housenumber'))
+
+    assert index.positions_many(['1', '2', '3', '4', '5']) == [
+        [0, 3],
+        [1],
+        [2, 4],
+        [],
+        []
+    ]
+    assert index.positions('4') == []
+    assert index.contains_many(['2', '4']) == [True, False]
+    assert index.duplicated_positions() == [[0, 3], [2, 4]]
@@ -0,0 +1,26 @@
+from lxml import etree
+
+from address import Address, Point
+from writers.osm_xml import write_osm_xml
+
+
+def test_tags_without_values_skipped(tmp_path):
+    address = Address(
+        point=Point(50.0, 19.0),
+        city_simc='0950463',
+        housenumber='1',
+        postcode=None,
+        city='Kraków',
+        street=None,
+        source=''
+    )
+    filename = str(tmp_path / 'addresses.osm')
+    write_osm_xml([address], filename)
+
+    tags = {
+        tag.get('k'): tag.get('v')
+        for tag in etree.parse(filename).iterfind('node/tag')
+    }
+    assert 'addr:postcode' not in tags
+    assert tags['addr:place'] == 'Kraków'
+    assert tags['addr:housenumber'] == '1'
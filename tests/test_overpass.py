@@ -0,0 +1,79 @@
+import requests
+
+from argparse import ArgumentParser
+
+from main import add_diff_arguments, create_diff_options
+from utils import overpass
+
+
+def test_split_depth_file_in_output_base(tmp_path):
+    parser = ArgumentParser()
+    add_diff_arguments(parser)
+    options = create_diff_options(parser.parse_args([]), '1465011', tmp_path)
+
+    assert options.overpass_split_depth_filename == str(
+        tmp_path / 'overpass_split_depth.json'
+    )
+
+
+def test_split_depth_remembered_in_given_file(tmp_path, monkeypatch):
+    queries = []
+
+    def download_query(query, _parse):
+        queries.append(query)
+        if len(queries) == 1:
+            raise overpass._QueryTooLarge()
+        return {'elements': [{'type': 'node', 'id': len(queries)}]}
+
+    monkeypatch.setattr(overpass, '_download_query', download_query)
+    monkeypatch.setattr(overpass, '_download_bbox', lambda _t: (0, 0, 1, 1))
+    depth_filename = str(tmp_path / 'overpass_split_depth.json')
+
+    osm_data = overpass.download_osm_data(
+        '1465011',
+        overpass.QUERY_ADDR,
+        split=True,
+        depth_filename=depth_filename
+    )
+    assert len(osm_data['elements']) == 4
+    assert overpass._load_split_depths(depth_filename) == {
+        '1465011:query_addr.overpassql': 1
+    }
+
+    # next download starts from remembered depth
+    first_queries = len(queries)
+    overpass.download_osm_data(
+        '1465011',
+        overpass.QUERY_ADDR,
+        split=True,
+        depth_filename=depth_filename
+    )
+    assert len(queries) - first_queries == 4
+
+
+def test_failed_status_retried_after_delay(monkeypatch):
+    responses = []
+    for status_code, headers in (
+        (429, {'Retry-After': '7'}),
+        (503, {}),
+        (429, {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}),
+        (200, {})
+    ):
+        response = requests.Response()
+        response.status_code = status_code
+        response.headers.update(headers)
+        response._content = b'{"elements": []}'
+        responses.append(response)
+    delays = []
+    monkeypatch.setattr(
+        overpass.transport,
+        'get',
+        lambda *_args, **_kwargs: responses.pop(0)
+    )
+    monkeypatch.setattr(overpass, 'sleep', delays.append)
+
+    osm_data = overpass._download_query('query', requests.Response.json)
+
+    assert osm_data == {'elements': []}
+    # Retry-After of server, backoff, date in the past
+    assert delays == [7, overpass.TIMEOUT * 2, 0]
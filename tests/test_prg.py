@@ -0,0 +1,125 @@
+import io
+import json
+import os
+
+from os import path
+from typing import List
+
+import pytest
+
+from exceptions import PrgDataError
+from parsers.prg import (
+    ingest_prg_csv,
+    load_prg_addresses,
+    PRG_INDEX_MANIFEST,
+    PRG_SOURCE
+)
+
+
+PRG_FIXTURE = path.join(
+    path.dirname(path.abspath(__file__)),
+    'data',
+    'prg_addresses.csv'
+)
+
+
+@pytest.fixture
+def index_dir(tmp_path) -> str:
+    with open(PRG_FIXTURE, 'r', encoding='utf-8-sig', newline='') as f:
+        counts = ingest_prg_csv(f, str(tmp_path / 'prg'))
+
+    assert counts == {'1465011': 3, '0201011': 1}
+    return str(tmp_path / 'prg')
+
+
+def _ingest_rows(index_dir: str, rows: List[str]) -> None:
+    with open(PRG_FIXTURE, 'r', encoding='utf-8-sig', newline='') as f:
+        header = f.readline()
+    ingest_prg_csv(io.StringIO(header + '\n'.join(rows)), index_dir)
+
+
+def test_ingest_and_load(index_dir):
+    with open(path.join(index_dir, PRG_INDEX_MANIFEST)) as f:
+        assert json.load(f)['communes'] == {'1465011': 3, '0201011': 1}
+
+    addresses = load_prg_addresses(index_dir, '1465011')
+    assert [
+        (a.city_simc, a.city, a.street, a.housenumber, a.postcode)
+        for a in addresses
+    ] == [
+        ('0918123', 'Warszawa', 'Plac Defilad', '1', '00-901'),
+        ('0918123', 'Warszawa', 'Marszałkowska', '104/122', '00-017'),
+        ('0918123', 'Warszawa', None, '55a', '00-583'),
+    ]
+    assert all(a.source == PRG_SOURCE for a in addresses)
+
+    # EPSG:2180 (X/Y) converted to WGS84
+    assert addresses[0].point.lat == pytest.approx(52.2318, abs=1e-3)
+    assert addresses[0].point.lon == pytest.approx(21.0061, abs=1e-3)
+    assert (addresses[1].point.lat, addresses[1].point.lon) == (
+        52.2335,
+        21.0085
+    )
+
+    assert len(load_prg_addresses(index_dir, '0201011')) == 1
+
+
+def test_missing_commune(index_dir):
+    with pytest.raises(PrgDataError):
+        load_prg_addresses(index_dir, '1234567')
+
+
+def test_missing_columns(tmp_path):
+    with open(PRG_FIXTURE, 'r', encoding='utf-8-sig', newline='') as f:
+        with pytest.raises(PrgDataError, match='NUMER_PORZADKOWY'):
+            ingest_prg_csv(
+                f,
+                str(tmp_path),
+                {'housenumber': 'NUMER_PORZADKOWY'}
+            )
+
+
+def test_failed_ingest_keeps_index(index_dir):
+    with pytest.raises(ValueError):
+        _ingest_rows(index_dir, [
+            '1465011;0918123;Warszawa;Foksal;1;00-001;52.1;21.0;;',
+            '1465011;0918123;Warszawa;Foksal;2;00-001;;;;',
+        ])
+
+    assert len(load_prg_addresses(index_dir, '1465011')) == 3
+    # no temporary directory is left
+    assert os.listdir(path.dirname(index_dir)) == ['prg']
+
+
+@pytest.mark.parametrize('teryt_terc', ['../1465011', '146501', '146501a'])
+def test_incorrect_teryt_terc(index_dir, teryt_terc):
+    with pytest.raises(PrgDataError, match='line 2'):
+        _ingest_rows(index_dir, [
+            f'{teryt_terc};0918123;Warszawa;Foksal;1;00-001;52.1;21.0;;'
+        ])
+    with pytest.raises(PrgDataError):
+        load_prg_addresses(index_dir, teryt_terc)
+
+    assert sorted(os.listdir(path.dirname(index_dir))) == ['prg']
+
+
+def test_other_files_not_replaced(index_dir):
+    source_filename = path.join(index_dir, 'prg_addresses.csv')
+    with open(source_filename, 'w') as f:
+        f.write('source')
+
+    with pytest.raises(PrgDataError, match='prg_addresses.csv'):
+        _ingest_rows(index_dir, [])
+
+    assert path.isfile(source_filename)
+    assert len(load_prg_addresses(index_dir, '1465011')) == 3
+
+
+def test_ingest_replaces_index(index_dir):
+    _ingest_rows(index_dir, [
+        '1465011;0918123;Warszawa;Foksal;1;00-001;52.1;21.0;;'
+    ])
+
+    assert len(load_prg_addresses(index_dir, '1465011')) == 1
+    with pytest.raises(PrgDataError):
+        load_prg_addresses(index_dir, '0201011')
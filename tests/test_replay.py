@@ -0,0 +1,50 @@
+import json
+
+from threading import Thread
+
+import requests
+
+from replay import recording_filename, ReplayServer, ReplaySettings
+
+
+def _record(directory: str, url: str, body: bytes) -> None:
+    filename = recording_filename(directory, 'GET', url)
+    with open(filename + '.json', 'w') as f:
+        json.dump(
+            {
+                'method': 'GET',
+                'url': url,
+                'status_code': 200,
+                'headers': dict()
+            },
+            f
+        )
+    with open(filename + '.body', 'wb') as f:
+        f.write(body)
+
+
+def test_errors_injected_only_to_given_hosts(tmp_path):
+    overpass_url = 'https://overpass-api.de/api/interpreter?data=q'
+    emapa_url = 'https://www.punktyadresowe.pl/cgi-bin/emuia/146501'
+    _record(str(tmp_path), overpass_url, b'osm')
+    _record(str(tmp_path), emapa_url, b'emapa')
+
+    server = ReplayServer(
+        ('127.0.0.1', 0),
+        str(tmp_path),
+        ReplaySettings(error_rate=1, seed=0)
+    )
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        def get(url: str) -> requests.Response:
+            return requests.get(
+                server.url + '/' + url.replace('://', '/', 1)
+            )
+
+        assert get(overpass_url).status_code == 429
+        response = get(emapa_url)
+        assert response.status_code == 200
+        assert response.content == b'emapa'
+    finally:
+        server.shutdown()
+        server.server_close()
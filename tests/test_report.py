@@ -0,0 +1,83 @@
+import os
+
+from address import Address, OsmAddress, Point
+from analyze import analyze_addresses
+from report import save_report
+from session import DiffOptions, DiffResult
+
+
+def _osm_element(osm_id: int, housenumber: str, lat: float) -> dict:
+    return {
+        'type': 'node',
+        'id': osm_id,
+        'lat': lat,
+        'lon': 21.0,
+        'tags': {
+            'addr:city': 'Warszawa',
+            'addr:city:simc': '0918123',
+            'addr:street': 'Foksal',
+            'addr:housenumber': housenumber,
+            'addr:postcode': '00-001'
+        }
+    }
+
+
+def _diff_result(output_dir: str) -> DiffResult:
+    emapa_addresses = [
+        Address(
+            point=Point(52.2, 21.0),
+            city_simc='0918123',
+            housenumber=housenumber,
+            postcode='00-001',
+            city='Warszawa',
+            street='Foksal',
+            source='emapa'
+        )
+        for housenumber in ('1', '2')
+    ]
+    osm_addresses = [
+        OsmAddress.parse_from_osm_element(element)
+        for element in (
+            _osm_element(1, '1', 52.2),
+            _osm_element(2, '3', 52.2),
+            _osm_element(3, '3', 52.3)
+        )
+    ]
+    options = DiffOptions(
+        '1465011',
+        output_dir,
+        tile_zoom=10,
+        duplicates_max_distance=50.0
+    )
+    analysis = analyze_addresses(
+        emapa_addresses,
+        osm_addresses,
+        duplicates_max_distance=options.duplicates_max_distance
+    )
+    return DiffResult(
+        options=options,
+        emapa_addresses=emapa_addresses,
+        osm_addresses=osm_addresses,
+        osm_type_distribution=analysis.osm_type_distribution,
+        osm_tags_distribution=analysis.osm_tags_distribution,
+        duplicated_osm_addresses=analysis.duplicated_osm_addresses,
+        distant_osm_addresses=analysis.distant_osm_addresses,
+        missing_emapa_addresses=analysis.missing_emapa_addresses,
+        excess_osm_addresses=analysis.excess_osm_addresses,
+        matched_with_differences=analysis.matched_with_differences
+    )
+
+
+def test_saved_files_returned(tmp_path):
+    (tmp_path / 'osm_addresses.json').write_text('{}')  # downloaded data
+
+    filenames = save_report(_diff_result(str(tmp_path)))
+
+    saved = {
+        os.path.join(dirpath, filename)
+        for dirpath, _dirnames, files in os.walk(tmp_path)
+        for filename in files
+    } - {str(tmp_path / 'osm_addresses.json')}
+    assert len(filenames) == len(set(filenames))
+    assert set(filenames) == saved
+    assert str(tmp_path / 'tiles' / 'index.json') in filenames
@@ -0,0 +1,74 @@
+from typing import List
+
+import pytest
+
+import scheduler
+
+from session import DiffOptions
+
+
+def _osm_data(counts: List[int]) -> dict:
+    return {
+        'osm3s': {'timestamp_osm_base': '2026-01-01T00:00:00Z'},
+        'elements': [
+            {'type': 'count', 'tags': {'total': str(count)}}
+            for count in counts
+        ]
+    }
+
+
+@pytest.fixture
+def invalidated(monkeypatch) -> List[str]:
+    stages = []
+    monkeypatch.setattr(
+        scheduler.Checkpoints,
+        'invalidate',
+        lambda _self, *names: stages.extend(names)
+    )
+    monkeypatch.setattr(scheduler, 'run_diff', lambda _options: None)
+    monkeypatch.setattr(scheduler, 'load_street_names_dt', lambda: None)
+    return stages
+
+
+def _schedule(tmp_path, monkeypatch, counts: List[int], previous=None):
+    monkeypatch.setattr(
+        scheduler,
+        'download_osm_data',
+        lambda *_args: _osm_data(counts)
+    )
+    options = DiffOptions(
+        '1465011',
+        str(tmp_path),
+        buildings=True,
+        checkpoints=True,
+        prg_index_dir=str(tmp_path)
+    )
+    return scheduler.schedule_commune(options, previous)
+
+
+def test_changed_buildings_invalidated(tmp_path, monkeypatch, invalidated):
+    previous = _schedule(tmp_path, monkeypatch, [10, 0, 2, 0, 5, 0])
+    assert previous['osm_buildings_count'] == 5
+    invalidated.clear()
+
+    # building modified since the previous check
+    _schedule(tmp_path, monkeypatch, [10, 0, 2, 0, 5, 1], previous)
+    assert invalidated == ['osm_buildings']
+    invalidated.clear()
+
+    # building deleted
+    _schedule(tmp_path, monkeypatch, [10, 0, 2, 0, 4, 0], previous)
+    assert invalidated == ['osm_buildings']
+    invalidated.clear()
+
+    # address added
+    _schedule(tmp_path, monkeypatch, [11, 1, 2, 0, 5, 0], previous)
+    assert invalidated == ['osm', 'osm_streets']
+
+
+def test_unchanged_commune_skipped(tmp_path, monkeypatch, invalidated):
+    previous = _schedule(tmp_path, monkeypatch, [10, 0, 2, 0, 5, 0])
+    invalidated.clear()
+
+    _schedule(tmp_path, monkeypatch, [10, 0, 2, 0, 5, 0], previous)
+    assert not invalidated
@@ -0,0 +1,34 @@
+import pytest
+import requests
+
+from utils import transport
+from utils.transport import collect_http_stats, HttpBackend
+
+
+class FakeBackend(HttpBackend):
+    def request(self, method, url, params, timeout) -> requests.Response:
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'content'
+        return response
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        HttpBackend()
+
+
+def test_stats_collected_per_context(monkeypatch):
+    monkeypatch.setattr(transport, '_backend', FakeBackend())
+    with collect_http_stats() as first:
+        transport.get('http://a.test/1')
+        transport.get('http://a.test/2')
+    with collect_http_stats() as second:
+        transport.get('http://a.test/3')
+    transport.get('http://b.test/')
+
+    assert first.hosts()['a.test'].requests == 2
+    assert first.hosts()['a.test'].received_bytes == 14
+    assert second.hosts()['a.test'].requests == 1
+    assert 'b.test' not in second.hosts()
+    assert transport.http_stats()['b.test'].requests == 1
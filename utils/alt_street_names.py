@@ -1,6 +1,7 @@
 from typing import Any, Dict, List
 
 from address import Address
+from utils.normalize import lower
 from config import gettext as _, logger
 
 
@@ -56,10 +57,10 @@ def replace_streets_with_osm_alt_names(
         if not addr.street:
             continue
 
-        if addr.street.lower() not in osm_alt_streets_names:
+        if lower(addr.street) not in osm_alt_streets_names:
             continue
 
-        new_street_name = osm_alt_streets_names[addr.street.lower()]
+        new_street_name = osm_alt_streets_names[lower(addr.street)]
         addr.street = new_street_name
         matched_streets.add(new_street_name)
 
@@ -0,0 +1,138 @@
+"""
+Compressed storage of raw data (downloaded GML, checkpoints) with
+streaming (de)compression. Files are uncompressed by default, gzip or
+zstd (if the zstandard package is installed) is opt in.
+
+Benchmark of codecs (size vs time) for a file:
+python -m utils.compression <file>
+"""
+import gzip
+import os
+import shutil
+import sys
+
+from time import perf_counter
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # optional – faster and better compression than gzip
+    zstandard = None
+
+
+NO_COMPRESSION = 'none'
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+GZIP_SUFFIX = '.gz'
+ZSTD_SUFFIX = '.zst'
+
+# available compression: filename suffix
+COMPRESSIONS: Dict[str, str] = {NO_COMPRESSION: '', GZIP: GZIP_SUFFIX}
+if zstandard is not None:
+    COMPRESSIONS[ZSTD] = ZSTD_SUFFIX
+
+# the same filenames regardless of installed packages
+DEFAULT_COMPRESSION = NO_COMPRESSION
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BENCHMARK_LEVELS: Dict[str, List[int]] = {
+    GZIP: [1, GZIP_LEVEL, 9],
+    ZSTD: [1, ZSTD_LEVEL, 9, 19],
+}
+CHUNK_SIZE = 2 ** 20
+
+
+def compressed_filename(filename: str, compression: str) -> str:
+    return filename + COMPRESSIONS[compression]
+
+
+def open_compressed(
+    filename: str,
+    mode: str = 'rb',
+    level: Optional[int] = None
+) -> BinaryIO:
+    """
+    Opens binary file with streaming (de)compression chosen by filename
+    suffix (see COMPRESSIONS).
+
+    :param mode: 'rb' or 'wb'
+    :param level: compression level (default: GZIP_LEVEL/ZSTD_LEVEL)
+    """
+    if filename.endswith(GZIP_SUFFIX):
+        # mtime=0 – the same content gives the same file (e.g. for hashes)
+        return gzip.GzipFile(
+            filename,
+            mode,
+            compresslevel=level or GZIP_LEVEL,
+            mtime=0
+        )
+
+    if filename.endswith(ZSTD_SUFFIX):
+        if zstandard is None:
+            raise IOError(f'zstandard package is needed to open: {filename}')
+
+        return zstandard.open(
+            filename,
+            mode,
+            cctx=zstandard.ZstdCompressor(level=level or ZSTD_LEVEL)
+        )
+
+    return open(filename, mode)
+
+
+def benchmark(filename: str) -> List[Tuple[str, int, int, float, float]]:
+    """
+    Compresses and decompresses file with all available codecs and levels.
+
+    :return: (compression, level, size in bytes, compression seconds,
+        decompression seconds) of each codec and level
+    """
+    results = []
+    for compression, levels in BENCHMARK_LEVELS.items():
+        if compression not in COMPRESSIONS:
+            continue
+
+        output_filename = compressed_filename(
+            filename + '.benchmark',
+            compression
+        )
+        for level in levels:
+            start = perf_counter()
+            with open(filename, 'rb') as src, \
+                    open_compressed(output_filename, 'wb', level) as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            compress_seconds = perf_counter() - start
+
+            start = perf_counter()
+            with open_compressed(output_filename, 'rb') as src:
+                while src.read(CHUNK_SIZE):
+                    pass
+            decompress_seconds = perf_counter() - start
+
+            results.append((
+                compression,
+                level,
+                os.path.getsize(output_filename),
+                compress_seconds,
+                decompress_seconds
+            ))
+            os.remove(output_filename)
+
+    return results
+
+
+if __name__ == '__main__':
+    input_filename = sys.argv[1]
+    input_size = os.path.getsize(input_filename)
+    print(f'{NO_COMPRESSION}: {input_size / 2 ** 20:.2f} MB')
+    for compression, level, size, compress_s, decompress_s in benchmark(
+        input_filename
+    ):
+        print(
+            f'{compression} (level {level}): {size / 2 ** 20:.2f} MB '
+            f'({size / input_size:.1%}), '
+            f'compression: {input_size / 2 ** 20 / compress_s:.1f} MB/s, '
+            f'decompression: {input_size / 2 ** 20 / decompress_s:.1f} MB/s'
+        )
@@ -1,8 +1,12 @@
-import requests
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+from time import sleep
+from typing import Any, Dict, Iterator, Optional
 
 from config import gettext as _, logger
 from exceptions import ServiceNotFound
-from typing import Optional
+from utils import transport
+from utils.compression import open_compressed
 
 
 PUNKTYADRESOWE_URL = 'https://www.punktyadresowe.pl/' \
@@ -16,24 +20,168 @@ PUNKTYADRESOWE_URL = 'https://www.punktyadresowe.pl/' \
 PUNKTYADRESOWE_SOURCE_EMAPA_URL = 'https://www.punktyadresowe.pl/' \
                                   'cgi-bin/emuia/<teryt>'
 
+PAGE_SIZE = 10000  # features per one GetFeature request
+MAX_CONNECTIONS = 4
+PAGE_RETRIES = 3
+PAGE_RETRY_TIMEOUT = 10  # seconds
 
-def download_emapa_gml(teryt: str, gml_filename: str) -> None:
+# pages are requested in stable order, without it the service can return
+# features in different order for each startIndex (WFS 2.0 sortBy)
+PAGE_SORT_BY = 'ID_MIEJSCOWOSCI,NAZWA_ULICY,NUMER_PORZADKOWY'
+
+WFS_NAMESPACE = 'http://www.opengis.net/wfs/2.0'
+GML_ID_ATTRIBUTE = '{http://www.opengis.net/gml/3.2}id'
+# HTTP headers which change together with content of the e-mapa data
+VALIDATOR_HEADERS = ('ETag', 'Last-Modified')
+NUMBER_MATCHED_KEY = 'numberMatched'
+
+
+def _download_number_matched(url: str) -> Optional[int]:
+    """
+    :param url: GetFeature url
+    :raises ServiceNotFound, IOError:
+    :return: number of features from resultType=hits or None if unknown
+    """
+    response = transport.get(url + '&resultType=hits')
+    if response.status_code != 200:
+        raise ServiceNotFound()
+
+    try:
+        root = etree.fromstring(response.content)
+        return int(root.get('numberMatched'))
+    except (etree.XMLSyntaxError, TypeError, ValueError):
+        return None
+
+
+def _download_page(url: str, start_index: int, count: int) -> bytes:
+    """
+    :raises IOError: if page couldn't be downloaded after PAGE_RETRIES
+    :return: GML content of the page
+    """
+    page_url = f'{url}&sortBy={PAGE_SORT_BY}' \
+        f'&count={count}&startIndex={start_index}'
+    for retry in range(PAGE_RETRIES):
+        try:
+            response = transport.get(page_url)
+            if response.status_code == 200:
+                return response.content
+
+            logger.warning(
+                _('Incorrect status code: {}').format(response.status_code)
+            )
+        except IOError as e:
+            logger.warning(
+                _('Error with downloading e-mapa page {}: {}').format(
+                    start_index,
+                    e
+                )
+            )
+
+        if retry < PAGE_RETRIES - 1:
+            sleep(PAGE_RETRY_TIMEOUT)
+
+    raise IOError(
+        _('Couldn\'t download e-mapa page (startIndex={})').format(start_index)
+    )
+
+
+def _save_merged_pages(pages: Iterator[bytes], gml_filename: str) -> int:
+    """
+    Saves features (wfs:member) of all pages (in order) as one
+    FeatureCollection with namespaces of the first page. Each page is
+    written as soon as it and all previous pages are downloaded.
+    Features repeated in next pages (same gml:id) are skipped.
+
+    :return: number of saved features
+    """
+    root = etree.fromstring(next(pages))
+    members_count = 0
+    features_ids = set()
+
+    with open_compressed(gml_filename, 'wb') as f, \
+            etree.xmlfile(f, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(root.tag, nsmap=root.nsmap):
+            while root is not None:
+                for member in root.iterchildren(f'{{{WFS_NAMESPACE}}}member'):
+                    feature_id = next(
+                        (child.get(GML_ID_ATTRIBUTE) for child in member),
+                        None
+                    )
+                    if feature_id is not None:
+                        if feature_id in features_ids:
+                            continue
+                        features_ids.add(feature_id)
+
+                    xf.write(member)
+                    members_count += 1
+
+                page = next(pages, None)
+                root = etree.fromstring(page) if page is not None else None
+
+    logger.debug(
+        _('Merged e-mapa pages with {} features.').format(members_count)
+    )
+    return members_count
+
+
+def download_emapa_gml(
+    teryt: str,
+    gml_filename: str,
+    page_size: int = PAGE_SIZE,
+    max_connections: int = MAX_CONNECTIONS
+) -> None:
     """
     :param teryt: commune (gmina) id number (6 characters)
-    :param gml_filename: filepath to save gml file
+    :param gml_filename: filepath to save gml file, compressed if it has
+        suffix of compression (see utils.compression)
+    :param page_size: max features per request, if service contains more
+        features, pages are downloaded concurrently (WFS count/startIndex)
+    :param max_connections: max concurrent requests of pages
     :raises ServiceNotFound, IOError
+    :raises ValueError: if page_size isn't positive
 
     Download e-mapa gml file with addresses from GUGiK site
     """
+    if page_size <= 0:
+        raise ValueError(f'Incorrect e-mapa page size: {page_size}')
+
     logger.info(_('Downloading emapa gml data...'))
     url = PUNKTYADRESOWE_URL.replace('<teryt>', teryt)
-    response = requests.get(url)
 
-    if response.status_code != 200:
-        raise ServiceNotFound()
+    number_matched = _download_number_matched(url)
+    if number_matched is None or number_matched <= page_size:
+        response = transport.get(url)
+
+        if response.status_code != 200:
+            raise ServiceNotFound()
+
+        with open_compressed(gml_filename, 'wb') as f:
+            f.write(response.content)
+        return
 
-    with open(gml_filename, 'wb') as f:
-        f.write(response.content)
+    start_indexes = list(range(0, number_matched, page_size))
+    logger.info(
+        _('Downloading {} e-mapa features in {} pages...').format(
+            number_matched,
+            len(start_indexes)
+        )
+    )
+    with ThreadPoolExecutor(max_workers=max_connections) as executor:
+        pages = executor.map(
+            lambda start_index: _download_page(url, start_index, page_size),
+            start_indexes
+        )
+        members_count = _save_merged_pages(pages, gml_filename)
+
+    # e.g. data changed between requests of pages
+    if members_count != number_matched:
+        raise IOError(
+            _('Downloaded {} of {} e-mapa features').format(
+                members_count,
+                number_matched
+            )
+        )
 
 
 def download_punktyadresowe_metadata(teryt: str) -> Optional[str]:
@@ -45,9 +193,42 @@ def download_punktyadresowe_metadata(teryt: str) -> Optional[str]:
 
     logger.info(_('Downloading punktyadresowe metadata...'))
     url = PUNKTYADRESOWE_SOURCE_EMAPA_URL.replace('<teryt>', teryt)
-    response = requests.get(url)
+    response = transport.get(url)
 
     if response.status_code != 200:
         raise ServiceNotFound
 
     return response.text
+
+
+def download_emapa_validators(teryt: str) -> Dict[str, Any]:
+    """
+    Cheap check of e-mapa data changes without downloading the GML.
+    Not all services send HTTP validators, so number of features
+    (resultType=hits) is added – it detects added and removed features,
+    but not modified ones.
+
+    :param teryt: commune (gmina) id number (6 characters)
+    :raises IOError:
+    :return: HTTP validators (ETag, Last-Modified) of the GetFeature
+        response (empty if the service doesn't send them) and
+        NUMBER_MATCHED_KEY with number of features (if known)
+    """
+    url = PUNKTYADRESOWE_URL.replace('<teryt>', teryt)
+    validators: Dict[str, Any] = dict()
+    response = transport.head(url)
+    if response.status_code == 200:
+        validators.update({
+            header: response.headers[header]
+            for header in VALIDATOR_HEADERS
+            if header in response.headers
+        })
+
+    try:
+        number_matched = _download_number_matched(url)
+    except ServiceNotFound:
+        number_matched = None
+    if number_matched is not None:
+        validators[NUMBER_MATCHED_KEY] = number_matched
+
+    return validators
@@ -0,0 +1,135 @@
+import math
+
+from typing import Dict, List, Tuple
+
+from address import Point
+
+
+EARTH_RADIUS = 6_371_008.8  # metres
+METRES_PER_DEGREE = 111_320.0  # approx. for latitude
+
+
+def distance(p1: Point, p2: Point) -> float:
+    """
+    :return: haversine distance between points in metres
+    """
+    lat1, lat2 = math.radians(p1.lat), math.radians(p2.lat)
+    d_lat = lat2 - lat1
+    d_lon = math.radians(p2.lon - p1.lon)
+
+    a = math.sin(d_lat / 2) ** 2 \
+        + math.cos(lat1) * math.cos(lat2) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def cluster_points(
+    points: List[Point],
+    max_distance: float
+) -> List[List[int]]:
+    """
+    Groups points which are (transitively) within max_distance to each other.
+    It uses grid index with cells of max_distance size, so only points
+    from the same and neighbouring cells are compared.
+
+    :param points: points to cluster
+    :param max_distance: max distance in metres between neighbours in cluster
+    :return: clusters as lists of points indexes (ordered by first index)
+    :raises ValueError: if max_distance is negative
+    """
+    if max_distance < 0:
+        raise ValueError(f'Negative max distance: {max_distance}')
+
+    if not points:
+        return []
+
+    if max_distance == 0:
+        # only the same points, grid cells would have 0 size
+        same_points: Dict[Tuple[float, float], List[int]] = dict()
+        for i, point in enumerate(points):
+            same_points.setdefault((point.lat, point.lon), []).append(i)
+
+        return sorted(same_points.values(), key=lambda cluster: cluster[0])
+
+    cell_lat = max_distance / METRES_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(points[0].lat)), 0.01)
+    cell_lon = cell_lat / cos_lat
+
+    grid: Dict[Tuple[int, int], List[int]] = dict()
+    parents = list(range(len(points)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, point in enumerate(points):
+        cell_x = math.floor(point.lon / cell_lon)
+        cell_y = math.floor(point.lat / cell_lat)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for j in grid.get((cell_x + dx, cell_y + dy), []):
+                    if distance(point, points[j]) <= max_distance:
+                        parents[find(i)] = find(j)
+
+        grid.setdefault((cell_x, cell_y), []).append(i)
+
+    clusters: Dict[int, List[int]] = dict()
+    for i in range(len(points)):
+        clusters.setdefault(find(i), []).append(i)
+
+    return sorted(clusters.values(), key=lambda cluster: cluster[0])
+
+
+# EPSG:2180 (PUWG 1992) – transverse Mercator on GRS80
+_PUWG1992_A = 6_378_137.0
+_PUWG1992_F = 1 / 298.257222101
+_PUWG1992_K0 = 0.9993
+_PUWG1992_LON0 = math.radians(19.0)
+_PUWG1992_FALSE_EASTING = 500_000.0
+_PUWG1992_FALSE_NORTHING = -5_300_000.0
+
+
+def puwg1992_to_wgs84(x: float, y: float) -> Point:
+    """
+    Inverse transverse Mercator (Snyder) for EPSG:2180 coordinates.
+
+    :param x: northing (x in Polish geodetic convention, as in PRG)
+    :param y: easting
+    :return: WGS84 point (accuracy below 1 m for area of Poland)
+    """
+    a = _PUWG1992_A
+    e2 = _PUWG1992_F * (2 - _PUWG1992_F)
+    ep2 = e2 / (1 - e2)
+    e1 = (1 - math.sqrt(1 - e2)) / (1 + math.sqrt(1 - e2))
+
+    m = (x - _PUWG1992_FALSE_NORTHING) / _PUWG1992_K0
+    mu = m / (a * (1 - e2 / 4 - 3 * e2 ** 2 / 64 - 5 * e2 ** 3 / 256))
+    phi1 = mu \
+        + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * math.sin(2 * mu) \
+        + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * math.sin(4 * mu) \
+        + (151 * e1 ** 3 / 96) * math.sin(6 * mu) \
+        + (1097 * e1 ** 4 / 512) * math.sin(8 * mu)
+
+    sin_phi1 = math.sin(phi1)
+    cos_phi1 = math.cos(phi1)
+    c1 = ep2 * cos_phi1 ** 2
+    t1 = math.tan(phi1) ** 2
+    n1 = a / math.sqrt(1 - e2 * sin_phi1 ** 2)
+    r1 = a * (1 - e2) / (1 - e2 * sin_phi1 ** 2) ** 1.5
+    d = (y - _PUWG1992_FALSE_EASTING) / (n1 * _PUWG1992_K0)
+
+    lat = phi1 - (n1 * math.tan(phi1) / r1) * (
+        d ** 2 / 2
+        - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * ep2) * d ** 4 / 24
+        + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * ep2 - 3 * c1 ** 2)
+        * d ** 6 / 720
+    )
+    lon = _PUWG1992_LON0 + (
+        d
+        - (1 + 2 * t1 + c1) * d ** 3 / 6
+        + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * ep2 + 24 * t1 ** 2)
+        * d ** 5 / 120
+    ) / cos_phi1
+
+    return Point(math.degrees(lat), math.degrees(lon))
@@ -4,6 +4,7 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 from config import gettext as _, logger
+from utils import transport
 
 
 _API_URL = 'https://api.github.com/repos/<user>/<repo>/commits?path=<path>'
@@ -24,7 +25,7 @@ def get_file_commits(user: str, repo: str, path: str) -> List[Dict[Any, Any]]:
             .replace('<user>', user) \
             .replace('<repo>', repo) \
             .replace('<path>', path)
-        return requests.get(url).json()
+        return transport.get(url).json()
 
     except (IOError, requests.JSONDecodeError):
         logger.exception(_('Error with downloading data from GitHub API!'))
@@ -61,7 +62,7 @@ def download_file(user: str, repo: str, path: str) -> Optional[str]:
             .replace('<repo>', repo) \
             .replace('<path>', path)
 
-        response = requests.get(url)
+        response = transport.get(url)
         if response.status_code != 200:
             logger.exception(_(
                 'Incorrect status code at downloading github file: {}'
@@ -0,0 +1,73 @@
+"""
+Measures import time of the package modules using `python -X importtime`
+(in a fresh interpreter for each module) and checks them against budgets.
+
+Usage: python -m utils.import_budget
+Exit code is 1 if any module exceeds its budget.
+"""
+import subprocess
+import sys
+
+from typing import Dict, Optional
+
+from config import Config
+
+
+# module: max cumulative import time in microseconds
+IMPORT_TIME_BUDGET_US: Dict[str, int] = {
+    'config': 50_000,
+    'address': 80_000,
+    'analyze': 80_000,
+    'utils.key_hash': 50_000,
+    'parsers.emapa': 80_000,
+    'writers.registry': 100_000,
+    'main': 400_000,
+}
+
+
+def measure_import_time(module: str) -> Optional[int]:
+    """
+    :param module: module name to import e.g. parsers.emapa
+    :return: cumulative import time in microseconds or None if not measured
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=Config.ROOT_DIR,
+        capture_output=True,
+        text=True
+    )
+    # import time: self [us] | cumulative | imported package
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        _self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative_us)
+
+    return None
+
+
+def check_import_budget() -> bool:
+    """
+    :return: True if all modules are within the budget
+    """
+    within_budget = True
+    for module, budget_us in IMPORT_TIME_BUDGET_US.items():
+        import_time_us = measure_import_time(module)
+        if import_time_us is None or import_time_us > budget_us:
+            within_budget = False
+            status = 'FAIL'
+        else:
+            status = 'OK'
+
+        print(
+            f'{status} {module}: {import_time_us} us '
+            f'(budget: {budget_us} us)'
+        )
+
+    return within_budget
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_import_budget() else 1)
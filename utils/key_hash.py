@@ -0,0 +1,207 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from hashlib import blake2b
+from types import ModuleType
+from typing import Callable, Iterable, List, Optional, Sequence, Set
+
+from address import Address
+
+
+@lru_cache(maxsize=None)
+def _numpy() -> Optional[ModuleType]:
+    """
+    numpy is optional (vectorized lookups) and imported on first use, its
+    import takes longer than import of the whole analyze module.
+
+    :return: numpy module or None if it isn't installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def key_hash(addr_key: str) -> int:
+    """
+    :return: 64-bit hash of address matching key (stable between processes)
+    """
+    return int.from_bytes(
+        blake2b(addr_key.encode('utf-8'), digest_size=8).digest(),
+        'little'
+    )
+
+
+class KeyHashIndex:
+    """
+    Memory compact replacement of Dict[str, List[Address]] index by key.
+    It stores only sorted 64-bit hashes of keys and positions of addresses
+    (16 bytes per address). Each hash match is verified by comparing key of
+    the original address, so hash collisions don't change results – all
+    addresses of a hash are compared only if their keys differ (collision
+    inside the index), otherwise only the first one.
+    """
+    def __init__(
+        self,
+        addresses: Sequence[Address],
+        key: Callable[[Address], str]
+    ):
+        self._addresses = addresses
+        self._key = key
+
+        hashes = array('Q', (key_hash(key(addr)) for addr in addresses))
+        numpy = _numpy()
+        if numpy is not None:
+            np_hashes = numpy.frombuffer(hashes, dtype=numpy.uint64)
+            order = numpy.argsort(np_hashes, kind='stable')
+            self._hashes = array('Q', np_hashes[order].tobytes())
+            self._positions = array('Q', order.astype(numpy.uint64).tobytes())
+        else:
+            order = sorted(range(len(hashes)), key=hashes.__getitem__)
+            self._hashes = array('Q', (hashes[i] for i in order))
+            self._positions = array('Q', order)
+
+        # hashes of different keys of indexed addresses
+        self._collisions: Set[int] = {
+            self._hashes[i]
+            for i in self._equal_neighbours()
+            if self._key_at(i) != self._key_at(i + 1)
+        }
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _key_at(self, i: int) -> str:
+        return self._key(self._addresses[self._positions[i]])
+
+    def _equal_neighbours(self) -> Iterable[int]:
+        """
+        :return: indexes i of sorted hashes equal to hash at i + 1
+        """
+        numpy = _numpy()
+        if numpy is None:
+            return (
+                i for i in range(len(self._hashes) - 1)
+                if self._hashes[i] == self._hashes[i + 1]
+            )
+
+        hashes = numpy.frombuffer(self._hashes, dtype=numpy.uint64)
+        return numpy.flatnonzero(hashes[1:] == hashes[:-1]).tolist()
+
+    def _verified_positions(
+        self,
+        addr_key: str,
+        addr_hash: int,
+        start: int,
+        end: int
+    ) -> List[int]:
+        """
+        :param start: first index in sorted hashes equal to key hash
+        :param end: index after the last one equal to key hash
+        :return: sorted positions of addresses with given key
+        """
+        if start == end:
+            return []
+        if addr_hash in self._collisions:
+            return [
+                position for position in self._positions[start:end]
+                if self._key(self._addresses[position]) == addr_key
+            ]
+        if self._key_at(start) != addr_key:
+            return []  # other key with the same hash
+
+        return self._positions[start:end].tolist()
+
+    def positions(self, addr_key: str) -> List[int]:
+        """
+        :return: positions (in addresses sequence) of addresses with given key
+        """
+        addr_hash = key_hash(addr_key)
+        return self._verified_positions(
+            addr_key,
+            addr_hash,
+            bisect_left(self._hashes, addr_hash),
+            bisect_right(self._hashes, addr_hash)
+        )
+
+    def positions_many(self, addr_keys: Sequence[str]) -> List[List[int]]:
+        """
+        :return: positions of addresses with each key (all keys are hashed
+            and searched at once with numpy)
+        """
+        numpy = _numpy()
+        if numpy is None:
+            return [self.positions(addr_key) for addr_key in addr_keys]
+
+        query = numpy.fromiter(
+            (key_hash(addr_key) for addr_key in addr_keys),
+            dtype=numpy.uint64,
+            count=len(addr_keys)
+        )
+        hashes = numpy.frombuffer(self._hashes, dtype=numpy.uint64)
+        starts = numpy.searchsorted(hashes, query, side='left')
+        ends = numpy.searchsorted(hashes, query, side='right')
+
+        return [
+            self._verified_positions(addr_key, addr_hash, start, end)
+            for addr_key, addr_hash, start, end in zip(
+                addr_keys,
+                query.tolist(),
+                starts.tolist(),
+                ends.tolist()
+            )
+        ]
+
+    def get(self, addr_key: str) -> Optional[List[Address]]:
+        """
+        :return: addresses with given key or None (same as dict.get)
+        """
+        positions = self.positions(addr_key)
+        if not positions:
+            return None
+
+        return self.addresses_at(positions)
+
+    def addresses_at(self, positions: Iterable[int]) -> List[Address]:
+        """
+        :return: addresses at given positions (in addresses sequence)
+        """
+        return [self._addresses[position] for position in positions]
+
+    def __contains__(self, addr_key: str) -> bool:
+        return bool(self.positions(addr_key))
+
+    def contains_many(self, addr_keys: Iterable[str]) -> List[bool]:
+        """
+        :return: membership of each key (vectorized search with numpy)
+        """
+        return [
+            bool(positions)
+            for positions in self.positions_many(list(addr_keys))
+        ]
+
+    def duplicated_positions(self) -> List[List[int]]:
+        """
+        :return: positions of addresses with the same key (groups with more
+            than 1 address) ordered by first position, same as grouping
+            by key in dict
+        """
+        groups = []
+        i = 0
+        while i < len(self._hashes):
+            j = i + 1
+            while j < len(self._hashes) and self._hashes[j] == self._hashes[i]:
+                j += 1
+
+            if j - i > 1:
+                # split run of equal hashes by keys (in case of collisions)
+                by_key = dict()
+                for position in self._positions[i:j]:
+                    addr_key = self._key(self._addresses[position])
+                    by_key.setdefault(addr_key, []).append(position)
+                groups.extend(g for g in by_key.values() if len(g) > 1)
+            i = j
+
+        return sorted(groups, key=lambda group: group[0])
@@ -0,0 +1,101 @@
+from functools import lru_cache
+from sys import intern
+from typing import Dict, Optional
+
+from config import logger
+
+
+# Max unique strings memoized by each normalization function
+CACHE_SIZE = 2 ** 16
+
+ULIC_FEATURES = [
+    'ul.', 'ulica',
+    'al.', 'aleja',
+    'pl.', 'plac',
+    'skwer',
+    'bulw.', 'bulwar',
+    'rondo',
+    'park',
+    'rynek',
+    'szosa',
+    'droga',
+    'os.', 'osiedle',
+    'ogród',
+    'wyspa',
+    'wyb.', 'wybrzeże',
+    'inne'
+]
+
+
+def intern_str(value: Optional[str]) -> Optional[str]:
+    """
+    :return: interned string (same object for equal strings), so repeated
+        city/street names share memory and later compare/hash faster
+    """
+    return intern(value) if value else value
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lower(value: str) -> str:
+    return intern(value.lower())
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _strip_street_features(street: str) -> str:
+    street = street.lower()
+    for feature in ULIC_FEATURES:
+        street = street.replace(feature, '')
+
+    return intern(street.strip())
+
+
+def normalize_street(
+    street: Optional[str],
+    ignore_street_features: bool = False
+) -> str:
+    """
+    :param street: street name or None/empty str if address without street
+    :param ignore_street_features: remove ULIC_FEATURES (and lower case)
+    :return: street used in the address matching key
+    """
+    if not street:
+        return ''
+
+    if ignore_street_features:
+        return _strip_street_features(street)
+
+    return street
+
+
+def normalize_housenumber(
+    housenumber: str,
+    ignore_case_sensitive_housenumber: bool = False
+) -> str:
+    """
+    :return: housenumber used in the address matching key
+    """
+    if ignore_case_sensitive_housenumber:
+        return lower(housenumber)
+
+    return housenumber
+
+
+def cache_hit_rates() -> Dict[str, float]:
+    """
+    :return: hit rate (0–1) of memoized normalizations since process start
+    """
+    hit_rates = dict()
+    for name, func in (
+        ('lower', lower),
+        ('street_features', _strip_street_features)
+    ):
+        info = func.cache_info()
+        calls = info.hits + info.misses
+        hit_rates[name] = info.hits / calls if calls else 0.0
+
+    return hit_rates
+
+
+def log_cache_stats() -> None:
+    for name, hit_rate in cache_hit_rates().items():
+        logger.debug(f'Normalization cache {name} hit rate: {hit_rate:.2%}')
@@ -1,59 +1,421 @@
+import csv
+import json
+import os
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from os import path
+from threading import Lock
 from time import sleep
-from typing import Any, Dict, Optional
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union
+)
 
 from config import Config, gettext as _, logger
+from utils import transport
 
 
 OVERPASS_API_URL = 'https://overpass-api.de/api/interpreter'
 QUERY_ADDR = path.join(Config.ROOT_DIR, 'utils', 'query_addr.overpassql')
 QUERY_STREET = path.join(Config.ROOT_DIR, 'utils', 'query_street.overpassql')
+# Returns only addr:* and POI/building tags (as tab separated values)
+QUERY_ADDR_CSV = path.join(
+    Config.ROOT_DIR,
+    'utils',
+    'query_addr_csv.overpassql'
+)
+# Building ways and multipolygons with geometry
+QUERY_BUILDINGS = path.join(
+    Config.ROOT_DIR,
+    'utils',
+    'query_buildings.overpassql'
+)
+# Bounding box of commune boundary
+QUERY_BBOX = path.join(Config.ROOT_DIR, 'utils', 'query_bbox.overpassql')
+# Counts of all and changed (since '<newer>') addresses and streets
+QUERY_CHANGES = path.join(
+    Config.ROOT_DIR,
+    'utils',
+    'query_changes.overpassql'
+)
 
-TIMEOUT = 30  # seconds
+TIMEOUT = 30  # seconds, doubled after each failed retry
+MAX_RETRY_DELAY = 600  # seconds, also for longer Retry-After of server
 RETRIES = 5
+# longer than [timeout:900] of queries to get Overpass timeout error
+READ_TIMEOUT = 960  # seconds
+
+# Queries which time out or run out of memory are split into bbox quadrants
+SPLIT_MAX_DEPTH = 4  # max 4^4 parts
+SPLIT_MAX_CONNECTIONS = 2  # default rate limit of overpass-api.de
+
+
+def split_depth_filename(output_base: str) -> str:
+    return path.join(output_base, 'overpass_split_depth.json')
+
+
+SPLIT_DEPTH_FILENAME = split_depth_filename(Config.OUTPUT_BASE)
+# Overpass remarks (HTTP 200) of queries which need splitting
+SPLIT_REMARKS = ('Query timed out', 'out of memory')
+SPLIT_STATUS_CODES = (504,)  # Gateway Timeout
+# Split depths file can be updated by many threads
+_split_depths_lock = Lock()
+
+# bbox: south, west, north, east
+BBox = Tuple[float, float, float, float]
+
+T = TypeVar('T')
+
+# Context manager around each Overpass request (e.g. a shared limit of
+# concurrent requests of many processes), see set_request_slot
+_request_slot: Callable[[], ContextManager] = nullcontext
+
+
+def set_request_slot(request_slot: Callable[[], ContextManager]) -> None:
+    """
+    :param request_slot: function which returns context manager entered
+        for the time of each Overpass request
+    """
+    global _request_slot
+    _request_slot = request_slot
 
 
 def download_osm_data(
     teryt_terc: str,
-    query_filename: str
+    query_filename: str,
+    replacements: Optional[Dict[str, str]] = None,
+    split: bool = False,
+    depth_filename: str = SPLIT_DEPTH_FILENAME
 ) -> Optional[Dict[Any, Any]]:
     """
     :param teryt_terc: commune (gmina) id
     all query will use administrative boundary from given value
     :param query_filename: path to query which contain '<teryt_terc>' to replace
+    :param replacements: other placeholders of query (e.g. '<newer>')
+        with their values
+    :param split: split query into parts of area if it's too large
+        (see _download_split), not for queries with aggregated output
+    :param depth_filename: file with remembered split depths of queries
     :return: Raw OSM Overpass data JSON (as dict) or None
     """
-    with open(query_filename, 'r') as f:
-        query = f.read().strip().replace('<teryt_terc>', teryt_terc)
+    return _download(
+        teryt_terc,
+        query_filename,
+        requests.Response.json,
+        replacements,
+        _merge_osm_data if split else None,
+        depth_filename
+    )
 
-    logger.info(
-        _('Loaded Overpass query from file: {}').format(
-            path.split(query_filename)[-1]
-        )
+
+def download_osm_csv(
+    teryt_terc: str,
+    query_filename: str,
+    split: bool = False,
+    depth_filename: str = SPLIT_DEPTH_FILENAME
+) -> Optional[List[Dict[str, str]]]:
+    """
+    :param teryt_terc: commune (gmina) id
+    all query will use administrative boundary from given value
+    :param query_filename: path to [out:csv] query (with header and tab
+        separator) which contain '<teryt_terc>' to replace
+    :param split: see download_osm_data, query must have @type and @id
+    :param depth_filename: see download_osm_data
+    :return: rows of OSM Overpass CSV data with header columns names as keys
+        or None
+    """
+    def parse_csv(response: requests.Response) -> List[Dict[str, str]]:
+        return list(csv.DictReader(
+            response.text.splitlines(),
+            delimiter='\t',
+            quoting=csv.QUOTE_NONE
+        ))
+
+    return _download(
+        teryt_terc,
+        query_filename,
+        parse_csv,
+        merge=_merge_osm_csv if split else None,
+        depth_filename=depth_filename
     )
-    logger.info(
-        _('Downloading Overpass data for {} area...').format(teryt_terc)
+
+
+class _QueryTooLarge(Exception):
+    """
+    Raises when Overpass query timed out or ran out of memory
+    """
+    pass
+
+
+def _merge_osm_data(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # objects crossing the border of parts are in many of them
+    unique_elements = dict()
+    for part in parts:
+        for element in part['elements']:
+            unique_elements[(element['type'], element['id'])] = element
+
+    osm_data = dict(parts[0])
+    osm_data['elements'] = list(unique_elements.values())
+    return osm_data
+
+
+def _merge_osm_csv(parts: List[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    unique_rows = dict()
+    for rows in parts:
+        for row in rows:
+            unique_rows[(row['@type'], row['@id'])] = row
+
+    return list(unique_rows.values())
+
+
+def _load_split_depths(filename: str) -> Dict[str, int]:
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return dict()
+
+
+def _save_split_depth(filename: str, key: str, depth: int) -> None:
+    with _split_depths_lock:
+        split_depths = _load_split_depths(filename)
+        if split_depths.get(key, 0) == depth:
+            return
+
+        split_depths[key] = depth
+        os.makedirs(path.dirname(filename), exist_ok=True)
+        tmp_filename = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp_filename, 'w') as f:
+            json.dump(split_depths, f, indent=2, sort_keys=True)
+        os.replace(tmp_filename, filename)
+
+
+def _quadrants(bbox: BBox) -> List[BBox]:
+    south, west, north, east = bbox
+    lat = (south + north) / 2
+    lon = (west + east) / 2
+    return [
+        (south, west, lat, lon),
+        (south, lon, lat, east),
+        (lat, west, north, lon),
+        (lat, lon, north, east)
+    ]
+
+
+def _download_bbox(teryt_terc: str) -> Optional[BBox]:
+    osm_data = _download(teryt_terc, QUERY_BBOX, requests.Response.json)
+    if osm_data is None or not osm_data['elements']:
+        return None
+
+    bounds = osm_data['elements'][0]['bounds']
+    return (
+        bounds['minlat'],
+        bounds['minlon'],
+        bounds['maxlat'],
+        bounds['maxlon']
+    )
+
+
+def _with_bbox(query: str, bbox: BBox) -> str:
+    # area filter is clipped to bbox, so each part is still inside the area
+    return query.replace(
+        '(area.searchArea)',
+        '(area.searchArea)({},{},{},{})'.format(*bbox)
     )
 
-    for _retry in range(RETRIES):
+
+def _download_split(
+    teryt_terc: str,
+    query_filename: str,
+    query: str,
+    parse: Callable[[requests.Response], T],
+    merge: Callable[[List[T]], T],
+    depth_filename: str
+) -> Optional[T]:
+    """
+    Downloads whole area at once or, if query is too large, parts of the
+    area bbox (quadrants split recursively, concurrently). Depth of split
+    is remembered (in depth_filename) per commune and query to skip too
+    large queries next time.
+    """
+    depth_key = f'{teryt_terc}:{path.basename(query_filename)}'
+    depth = _load_split_depths(depth_filename).get(depth_key, 0)
+    if depth == 0:
         try:
-            response = requests.get(OVERPASS_API_URL, params={'data': query})
+            return _download_query(query, parse)
+        except _QueryTooLarge:
+            depth = 1
+
+    bbox = _download_bbox(teryt_terc)
+    if bbox is None:
+        return None
+
+    parts = [bbox]
+    for _depth in range(depth):
+        parts = [quadrant for part in parts for quadrant in _quadrants(part)]
+
+    def download_part(part: BBox) -> Union[T, None, _QueryTooLarge]:
+        try:
+            return _download_query(_with_bbox(query, part), parse)
+        except _QueryTooLarge as e:
+            return e
+
+    results = []
+    while parts:
+        logger.info(
+            _('Downloading Overpass data in {} parts (split depth: {})...')
+            .format(len(parts), depth)
+        )
+        with ThreadPoolExecutor(max_workers=SPLIT_MAX_CONNECTIONS) as executor:
+            parts_results = list(executor.map(download_part, parts))
+
+        too_large_parts = []
+        for part, result in zip(parts, parts_results):
+            if result is None:
+                return None
+            if isinstance(result, _QueryTooLarge):
+                too_large_parts.append(part)
+            else:
+                results.append(result)
+
+        if too_large_parts and depth >= SPLIT_MAX_DEPTH:
+            logger.error(
+                _('Overpass query is too large even after split.')
+            )
+            return None
+
+        if too_large_parts:
+            depth += 1
+        parts = [
+            quadrant
+            for part in too_large_parts
+            for quadrant in _quadrants(part)
+        ]
+
+    _save_split_depth(depth_filename, depth_key, depth)
+    return merge(results)
+
+
+def _download_query(
+    query: str,
+    parse: Callable[[requests.Response], T]
+) -> Optional[T]:
+    """
+    :raises _QueryTooLarge:
+    """
+    for retry in range(RETRIES):
+        response = None
+        try:
+            with _request_slot():
+                response = transport.get(
+                    OVERPASS_API_URL,
+                    params={'data': query},
+                    timeout=(transport.CONNECT_TIMEOUT, READ_TIMEOUT)
+                )
+            if response.status_code in SPLIT_STATUS_CODES or (
+                response.status_code == 200
+                and any(r in response.text[-1000:] for r in SPLIT_REMARKS)
+            ):
+                raise _QueryTooLarge()
+
             if response.status_code != 200:
                 logger.warning(
                     _('Incorrect status code: {}').format(response.status_code)
                 )
-                continue
+            else:
+                return parse(response)
 
-            return response.json()
+        except _QueryTooLarge:
+            logger.warning(_('Overpass query timed out or is too large.'))
+            raise
 
         except Exception as e:
             logger.error(
                 _('Error with downloading/parsing data: {}').format(e)
             )
 
-        sleep(TIMEOUT)
+        if retry < RETRIES - 1:
+            sleep(_retry_delay(response, retry))
+
+
+def _retry_delay(response: Optional[requests.Response], retry: int) -> float:
+    """
+    :param response: failed response or None if there is no response
+    :param retry: number of the failed retry (from 0)
+    :return: seconds from Retry-After header of the response (as seconds or
+        HTTP date) or exponential backoff, at most MAX_RETRY_DELAY
+    """
+    delay = TIMEOUT * 2 ** retry
+    retry_after = (
+        response.headers.get('Retry-After') if response is not None else None
+    )
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = (
+                    parsedate_to_datetime(retry_after)
+                    - datetime.now(timezone.utc)
+                ).total_seconds()
+            except (TypeError, ValueError):
+                pass
+
+    return min(max(delay, 0), MAX_RETRY_DELAY)
+
+
+def _download(
+    teryt_terc: str,
+    query_filename: str,
+    parse: Callable[[requests.Response], T],
+    replacements: Optional[Dict[str, str]] = None,
+    merge: Optional[Callable[[List[T]], T]] = None,
+    depth_filename: str = SPLIT_DEPTH_FILENAME
+) -> Optional[T]:
+    """
+    :param merge: function to merge results of parts of split query,
+        if None query isn't split
+    :param depth_filename: see _download_split
+    """
+    with open(query_filename, 'r') as f:
+        query = f.read().strip().replace('<teryt_terc>', teryt_terc)
+    for placeholder, value in (replacements or {}).items():
+        query = query.replace(placeholder, value)
+
+    logger.info(
+        _('Loaded Overpass query from file: {}').format(
+            path.split(query_filename)[-1]
+        )
+    )
+    logger.info(
+        _('Downloading Overpass data for {} area...').format(teryt_terc)
+    )
+
+    if merge is not None:
+        return _download_split(
+            teryt_terc,
+            query_filename,
+            query,
+            parse,
+            merge,
+            depth_filename
+        )
+
+    try:
+        return _download_query(query, parse)
+    except _QueryTooLarge:
+        return None
 
 
 def is_element(element) -> bool:
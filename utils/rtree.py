@@ -0,0 +1,177 @@
+import heapq
+import math
+
+from typing import (
+    Callable,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union
+)
+
+
+T = TypeVar('T')
+
+# min x, min y, max x, max y
+BBox = Tuple[float, float, float, float]
+# (bbox, child nodes) or, in leaves, (bbox, index of value)
+_Node = Tuple[BBox, Union[list, int]]
+
+NODE_CAPACITY = 16
+
+
+def _union(nodes: List[_Node]) -> BBox:
+    return (
+        min(node[0][0] for node in nodes),
+        min(node[0][1] for node in nodes),
+        max(node[0][2] for node in nodes),
+        max(node[0][3] for node in nodes)
+    )
+
+
+def _pack(nodes: List[_Node], capacity: int) -> List[_Node]:
+    """
+    Sort-Tile-Recursive: nodes are sorted by x center into vertical slices,
+    each slice by y center and grouped by capacity into parent nodes.
+    """
+    parents_count = math.ceil(len(nodes) / capacity)
+    slice_size = math.ceil(math.sqrt(parents_count)) * capacity
+
+    nodes = sorted(nodes, key=lambda node: node[0][0] + node[0][2])
+    parents = []
+    for i in range(0, len(nodes), slice_size):
+        tile = sorted(
+            nodes[i:i + slice_size],
+            key=lambda node: node[0][1] + node[0][3]
+        )
+        for j in range(0, len(tile), capacity):
+            children = tile[j:j + capacity]
+            parents.append((_union(children), children))
+
+    return parents
+
+
+def bbox_distance(bbox: BBox, x: float, y: float) -> float:
+    """
+    :return: distance from point to bbox (0 if point is inside)
+    """
+    dx = max(bbox[0] - x, 0.0, x - bbox[2])
+    dy = max(bbox[1] - y, 0.0, y - bbox[3])
+    return math.hypot(dx, dy)
+
+
+class RTree(Generic[T]):
+    """
+    Static R-tree packed by Sort-Tile-Recursive algorithm (built once in
+    O(n log n), nodes with small overlap). Planar coordinates – use
+    projected ones (e.g. metres) for distances.
+    """
+    def __init__(
+        self,
+        entries: Sequence[Tuple[BBox, T]],
+        node_capacity: int = NODE_CAPACITY
+    ):
+        self._values: List[T] = [value for _bbox, value in entries]
+        self._root: Optional[_Node] = None
+        if not entries:
+            return
+
+        nodes: List[_Node] = [
+            (bbox, index) for index, (bbox, _value) in enumerate(entries)
+        ]
+        while True:
+            nodes = _pack(nodes, node_capacity)
+            if len(nodes) == 1:
+                break
+        self._root = nodes[0]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def search_point(self, x: float, y: float) -> Iterator[T]:
+        """
+        :return: values with bbox containing the point
+        """
+        if self._root is None:
+            return
+
+        stack = [self._root]
+        while stack:
+            for bbox, child in stack.pop()[1]:
+                if bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]:
+                    if isinstance(child, int):
+                        yield self._values[child]
+                    else:
+                        stack.append((bbox, child))
+
+    def nearest(
+        self,
+        x: float,
+        y: float,
+        distance: Callable[[T, float, float], float],
+        max_distance: float = math.inf
+    ) -> Optional[Tuple[T, float]]:
+        """
+        Best-first search – nodes are visited by distance to their bbox.
+
+        :param distance: exact distance from value to the point, not less
+            than distance to the value bbox
+        :return: nearest value within max_distance and its distance
+        """
+        if self._root is None:
+            return None
+
+        # (distance, tie breaker, node or value index, is exact distance)
+        queue = [(bbox_distance(self._root[0], x, y), 0, self._root, False)]
+        counter = 1
+        while queue:
+            node_distance, _order, node, exact = heapq.heappop(queue)
+            if node_distance > max_distance:
+                return None
+
+            if exact:
+                return self._values[node], node_distance
+
+            child = node[1]
+            if isinstance(child, int):
+                heapq.heappush(queue, (
+                    distance(self._values[child], x, y),
+                    counter,
+                    child,
+                    True
+                ))
+                counter += 1
+                continue
+
+            for child_node in child:
+                # inlined bbox_distance, nodes farther than max_distance
+                # are skipped
+                min_x, min_y, max_x, max_y = child_node[0]
+                if x < min_x:
+                    dx = min_x - x
+                elif x > max_x:
+                    dx = x - max_x
+                else:
+                    dx = 0.0
+                if y < min_y:
+                    dy = min_y - y
+                elif y > max_y:
+                    dy = y - max_y
+                else:
+                    dy = 0.0
+                if dx > max_distance or dy > max_distance:
+                    continue
+
+                child_distance = math.hypot(dx, dy)
+                if child_distance <= max_distance:
+                    heapq.heappush(
+                        queue,
+                        (child_distance, counter, child_node, False)
+                    )
+                    counter += 1
+
+        return None
@@ -1,9 +1,11 @@
 from datetime import datetime
 from csv import DictReader
 from os import path
+from threading import Lock
 from typing import Dict, List, Optional
 
 from address import Address
+from utils.normalize import lower
 from config import Config, gettext as _, logger
 from utils.github import (
     download_file,
@@ -15,6 +17,9 @@ from utils.github import (
 STREET_NAMES_DT_FILENAME = 'street_names_dt.txt'
 STREET_NAMES_FILENAME = 'street_names_mappings.csv'
 
+# Mappings files can be updated during a diff run in another thread
+_mappings_lock = Lock()
+
 
 def _get_remote_file_dt() -> datetime:
     commits_data = get_file_commits(
@@ -47,8 +52,7 @@ def _load_mappings_data() -> Dict[str, Dict[str, str]]:
     """
     street_names: Dict[str, Dict[str, str]] = dict()
 
-    filename = path.join(Config.DATA_DIR, STREET_NAMES_FILENAME)
-    with open(filename, 'r') as csv_file:
+    with open(street_names_filename(), 'r') as csv_file:
         reader = DictReader(csv_file, delimiter=',')
         for row in reader:
             simc = row['teryt_simc_code']
@@ -114,7 +118,46 @@ def _street_names_autoupdate():
     _update_street_names_data(remote_dt)
 
 
-def replace_streets_with_osm_names(emapa_addresses: List[Address]) -> None:
+def _safe_street_names_autoupdate() -> None:
+    try:
+        _street_names_autoupdate()
+    except ValueError:
+        logger.exception(
+            'Couldn\'t autoupdate street names mappigns!'
+        )
+
+
+def update_street_names_mappings() -> Optional[datetime]:
+    """
+    Checks and downloads update of mappings from GitHub (once for many
+    diffs which then can skip the check).
+
+    :return: datetime of the local mappings data after update
+    """
+    with _mappings_lock:
+        _safe_street_names_autoupdate()
+        return _load_current_file_dt()
+
+
+def street_names_filename() -> str:
+    """
+    :return: path to the local mappings data
+    """
+    return path.join(Config.DATA_DIR, STREET_NAMES_FILENAME)
+
+
+def load_street_names_dt() -> Optional[datetime]:
+    """
+    :return: datetime of the local mappings data or None if unknown
+    """
+    with _mappings_lock:
+        return _load_current_file_dt()
+
+
+def replace_streets_with_osm_names(
+    emapa_addresses: List[Address],
+    update_check: bool = True
+) -> None:
     """
     Use street_names community file to find and replace names which contains
     e.g. shortcuts to match them to OSM data.
@@ -125,14 +168,13 @@ def replace_streets_with_osm_names(emapa_addresses: List[Address]) -> None:
 
     :param emapa_addresses: address to find and optionally match and replace
     street_names
+    :param update_check: check and download update of mappings from GitHub
     """
-    if not Config.NO_STREET_NAMES_UPDATE_CHECK:
-        try:
-            _street_names_autoupdate()
-        except ValueError:
-            logger.exception('Couldn\'t autoupdate street names mappigns!')
+    with _mappings_lock:
+        if update_check:
+            _safe_street_names_autoupdate()
 
-    street_names: Dict[str, Dict[str, str]] = _load_mappings_data()
+        street_names: Dict[str, Dict[str, str]] = _load_mappings_data()
     matched_streets = set()
 
     for addr in emapa_addresses:
@@ -142,10 +184,10 @@ def replace_streets_with_osm_names(emapa_addresses: List[Address]) -> None:
         if addr.city_simc not in street_names:
             continue
 
-        if addr.street.lower() not in street_names[addr.city_simc]:
+        if lower(addr.street) not in street_names[addr.city_simc]:
             continue
 
-        new_street_name = street_names[addr.city_simc][addr.street.lower()]
+        new_street_name = street_names[addr.city_simc][lower(addr.street)]
         addr.street = new_street_name
         matched_streets.add(new_street_name)
 
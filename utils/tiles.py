@@ -0,0 +1,39 @@
+import math
+
+from typing import Tuple
+
+
+Tile = Tuple[int, int, int]  # z, x, y
+
+# tiles at deeper zoom are smaller than 10 m
+MAX_ZOOM = 22
+
+
+def lonlat_to_tile(lon: float, lat: float, zoom: int) -> Tile:
+    """
+    https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+    :return: slippy map tile (z, x, y) which contains given point
+    """
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n)
+
+    return zoom, min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bbox(tile: Tile) -> Tuple[float, float, float, float]:
+    """
+    :return: tile bounding box as (west, south, east, north)
+    """
+    zoom, x, y = tile
+    n = 2 ** zoom
+
+    def lon(tile_x: int) -> float:
+        return tile_x / n * 360.0 - 180.0
+
+    def lat(tile_y: int) -> float:
+        lat_rad = math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n)))
+        return math.degrees(lat_rad)
+
+    return lon(x), lat(y + 1), lon(x + 1), lat(y)
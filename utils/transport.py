@@ -0,0 +1,254 @@
+import requests
+
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from config import gettext as _, logger
+
+
+CONNECT_TIMEOUT = 10  # seconds
+READ_TIMEOUT = 120  # seconds without any received byte
+POOL_MAXSIZE = 8  # connections per host (concurrent pages, Overpass parts)
+HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'User-Agent': 'osm-emapa-addresses-diff',
+}
+
+# seconds (connect, read) or one value for both
+Timeout = Union[float, Tuple[float, float]]
+
+
+@dataclass
+class HostStats:
+    requests: int = 0
+    errors: int = 0  # requests without response (e.g. timeout)
+    received_bytes: int = 0  # content (after decompression)
+    transferred_bytes: int = 0  # Content-Length (compressed) if known
+    seconds: float = 0  # total time of requests with reading content
+    max_seconds: float = 0
+
+
+class HttpStats:
+    """
+    Stats of requests per host, shared by threads.
+    """
+    def __init__(self):
+        self._hosts: Dict[str, HostStats] = dict()
+        self._lock = Lock()
+
+    def count(
+        self,
+        host: str,
+        received_bytes: int,
+        transferred_bytes: int,
+        seconds: float,
+        error: bool
+    ) -> None:
+        with self._lock:
+            stats = self._hosts.setdefault(host, HostStats())
+            stats.requests += 1
+            stats.errors += error
+            stats.received_bytes += received_bytes
+            stats.transferred_bytes += transferred_bytes
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+
+    def hosts(self) -> Dict[str, HostStats]:
+        """
+        :return: copy of stats per host
+        """
+        with self._lock:
+            return {
+                host: HostStats(**vars(stats))
+                for host, stats in self._hosts.items()
+            }
+
+
+class HttpBackend(ABC):
+    """
+    Sends requests of the transport. Other backend (e.g. async client
+    running in own event loop) can be used by set_backend if it returns
+    requests.Response compatible objects and raises IOError on errors.
+    """
+    @abstractmethod
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: Timeout
+    ) -> requests.Response:
+        pass
+
+
+class RequestsBackend(HttpBackend):
+    """
+    Reuses connections (and TLS sessions) using one requests.Session
+    per host. Sessions are shared by threads.
+    """
+    def __init__(self, pool_maxsize: int = POOL_MAXSIZE):
+        self.pool_maxsize = pool_maxsize
+        self._sessions: Dict[str, requests.Session] = dict()
+        self._sessions_lock = Lock()
+
+    def _session(self, host: str) -> requests.Session:
+        with self._sessions_lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[host] = session
+
+            return self._sessions[host]
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        timeout: Timeout
+    ) -> requests.Response:
+        return self._session(urlsplit(url).netloc).request(
+            method,
+            url,
+            params=params,
+            timeout=timeout
+        )
+
+
+_backend: HttpBackend = RequestsBackend()
+_stats = HttpStats()  # since process start
+# stats of active collect_http_stats contexts
+_collectors: List[HttpStats] = []
+_collectors_lock = Lock()
+
+
+def get_backend() -> HttpBackend:
+    return _backend
+
+
+def set_backend(backend: HttpBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+def request(
+    method: str,
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+) -> requests.Response:
+    """
+    Sends request using the backend and counts its stats per host.
+
+    :raises IOError: if there is no response (e.g. timeout)
+    """
+    start = perf_counter()
+    response = None
+    try:
+        response = _backend.request(method, url, params, timeout)
+        return response
+    finally:
+        _count(urlsplit(url).netloc, response, perf_counter() - start)
+
+
+def get(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+) -> requests.Response:
+    """
+    See request
+    """
+    return request('GET', url, params, timeout)
+
+
+def head(
+    url: str,
+    params: Optional[Dict[str, Any]] = None,
+    timeout: Timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+) -> requests.Response:
+    """
+    See request
+    """
+    return request('HEAD', url, params, timeout)
+
+
+def _count(
+    host: str,
+    response: Optional[requests.Response],
+    seconds: float
+) -> None:
+    received_bytes = len(response.content) if response is not None else 0
+    transferred_bytes = received_bytes
+    if response is not None and 'Content-Length' in response.headers:
+        try:
+            transferred_bytes = int(response.headers['Content-Length'])
+        except ValueError:
+            pass
+
+    with _collectors_lock:
+        collectors = [_stats] + _collectors
+
+    for stats in collectors:
+        stats.count(
+            host,
+            received_bytes,
+            transferred_bytes,
+            seconds,
+            response is None
+        )
+
+
+@contextmanager
+def collect_http_stats() -> Iterator[HttpStats]:
+    """
+    Collects stats of requests sent until exit of the context (e.g. by one
+    diff). Requests of all threads are counted, so stats of concurrent
+    contexts contain requests of each other.
+    """
+    stats = HttpStats()
+    with _collectors_lock:
+        _collectors.append(stats)
+    try:
+        yield stats
+    finally:
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+def http_stats() -> Dict[str, HostStats]:
+    """
+    :return: copy of stats of requests per host since process start
+    """
+    return _stats.hosts()
+
+
+def log_http_stats(stats: Optional[HttpStats] = None) -> None:
+    """
+    :param stats: stats to log, default: stats since process start
+    """
+    hosts = stats.hosts() if stats is not None else http_stats()
+    for host, host_stats in sorted(hosts.items()):
+        logger.info(
+            _(
+                'HTTP {}: {} requests ({} errors), {:.2f} MB '
+                '({:.2f} MB transferred), {:.1f} s (max {:.1f} s)'
+            ).format(
+                host,
+                host_stats.requests,
+                host_stats.errors,
+                host_stats.received_bytes / 2 ** 20,
+                host_stats.transferred_bytes / 2 ** 20,
+                host_stats.seconds,
+                host_stats.max_seconds
+            )
+        )
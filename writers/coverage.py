@@ -0,0 +1,273 @@
+"""
+Coverage rollups of the diff: counts of addresses per street, SIMC and
+commune stored in SQLite, so dashboards can query coverage of many
+communes without reading their full reports.
+
+Merging rollups of many communes (e.g. saved by separate runs):
+python -m writers.coverage <merged.sqlite> <coverage.sqlite> [...]
+"""
+import sqlite3
+import sys
+
+from collections import Counter
+from contextlib import closing
+from datetime import datetime, timezone
+from operator import attrgetter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from address import Address, OsmAddress
+from analyze import KeyFunc, MatchedAddress
+from config import gettext as _, logger
+
+
+COVERAGE_FILENAME = 'coverage.sqlite'
+DATABASE_TIMEOUT = 60  # seconds of waiting for the database lock
+
+# e-mapa addresses: all, matched (found in OSM), matched with differences
+# and missing in OSM; OSM addresses: all, excess and duplicated (in
+# duplicates blocks)
+COUNT_COLUMNS = [
+    'emapa',
+    'matched',
+    'different',
+    'missing',
+    'osm',
+    'excess',
+    'duplicated',
+]
+
+# (city_simc, street) – empty strings if there is no value
+StreetKey = Tuple[str, str]
+
+_COUNTS_SCHEMA = ',\n'.join(
+    f'    {column} INTEGER NOT NULL' for column in COUNT_COLUMNS
+)
+_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS street_coverage (
+    teryt_terc TEXT NOT NULL,
+    city_simc TEXT NOT NULL,
+    street TEXT NOT NULL,
+{_COUNTS_SCHEMA},
+    PRIMARY KEY (teryt_terc, city_simc, street)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS simc_coverage (
+    teryt_terc TEXT NOT NULL,
+    city_simc TEXT NOT NULL,
+{_COUNTS_SCHEMA},
+    PRIMARY KEY (teryt_terc, city_simc)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS simc_coverage_city_simc
+    ON simc_coverage (city_simc);
+CREATE TABLE IF NOT EXISTS commune_coverage (
+    teryt_terc TEXT PRIMARY KEY,
+{_COUNTS_SCHEMA},
+    updated TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+_SUMS = ', '.join(
+    f'coalesce(sum({column}), 0)' for column in COUNT_COLUMNS
+)
+
+
+def _street_key(addr: Address) -> StreetKey:
+    return addr.city_simc or '', addr.street or ''
+
+
+def count_coverage(
+    emapa_addresses: List[Address],
+    missing_emapa_addresses: List[Address],
+    matched_with_differences: List[MatchedAddress],
+    osm_addresses: List[OsmAddress],
+    excess_osm_addresses: List[OsmAddress],
+    duplicated_osm_addresses: List[List[OsmAddress]],
+    key: KeyFunc = attrgetter('min_unique')
+) -> Dict[StreetKey, Counter]:
+    """
+    :param key: function which returns address matching key (the same as
+        used by the analysis)
+    :return: counts (COUNT_COLUMNS) per street, e-mapa addresses are
+        grouped by e-mapa SIMC and street. OSM addresses with key of an
+        e-mapa address (matched or duplicated) are grouped with it, so
+        they are in the same row even if e.g. their SIMC tag is different.
+        Excess ones are grouped by their tags.
+    """
+    emapa_street_keys: Dict[str, StreetKey] = dict()
+    for emapa_addr in emapa_addresses:
+        emapa_street_keys.setdefault(key(emapa_addr), _street_key(emapa_addr))
+
+    def osm_street_key(osm_addr: Address) -> StreetKey:
+        street_key = emapa_street_keys.get(key(osm_addr))
+        return street_key if street_key is not None else _street_key(osm_addr)
+
+    counts: Dict[StreetKey, Counter] = dict()
+
+    def add(
+        addresses: Iterable[Address],
+        column: str,
+        value: int = 1,
+        street_key: Callable[[Address], StreetKey] = _street_key
+    ):
+        for addr in addresses:
+            counts.setdefault(street_key(addr), Counter())[column] += value
+
+    add(emapa_addresses, 'emapa')
+    add(emapa_addresses, 'matched')
+    add(missing_emapa_addresses, 'matched', -1)
+    add(missing_emapa_addresses, 'missing')
+    add(
+        (match.emapa_address for match in matched_with_differences),
+        'different'
+    )
+    add(osm_addresses, 'osm', street_key=osm_street_key)
+    add(excess_osm_addresses, 'excess', street_key=osm_street_key)
+    add(
+        (addr for block in duplicated_osm_addresses for addr in block),
+        'duplicated',
+        street_key=osm_street_key
+    )
+
+    return counts
+
+
+def _connect(filename: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        filename,
+        timeout=DATABASE_TIMEOUT,
+        isolation_level=None
+    )
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _replace_commune(
+    db: sqlite3.Connection,
+    teryt_terc: str,
+    counts: Dict[StreetKey, Counter],
+    updated: str
+) -> None:
+    """
+    Replaces rollups of the commune in transaction started by the caller.
+    SIMC and commune rollups are aggregated from street rollups.
+    """
+    for table in ('street_coverage', 'simc_coverage', 'commune_coverage'):
+        db.execute(
+            f'DELETE FROM {table} WHERE teryt_terc = ?',
+            (teryt_terc,)
+        )
+
+    columns = ', '.join(COUNT_COLUMNS)
+    placeholders = ', '.join('?' for _column in COUNT_COLUMNS)
+    db.executemany(
+        f'''
+        INSERT INTO street_coverage (teryt_terc, city_simc, street, {columns})
+        VALUES (?, ?, ?, {placeholders})
+        ''',
+        [
+            (teryt_terc, city_simc, street)
+            + tuple(street_counts[column] for column in COUNT_COLUMNS)
+            for (city_simc, street), street_counts in sorted(counts.items())
+        ]
+    )
+    db.execute(
+        f'''
+        INSERT INTO simc_coverage (teryt_terc, city_simc, {columns})
+        SELECT teryt_terc, city_simc, {_SUMS} FROM street_coverage
+        WHERE teryt_terc = ?
+        GROUP BY city_simc
+        ''',
+        (teryt_terc,)
+    )
+    db.execute(
+        f'''
+        INSERT INTO commune_coverage (teryt_terc, {columns}, updated)
+        SELECT ?, {_SUMS}, ?
+        FROM street_coverage WHERE teryt_terc = ?
+        ''',
+        (teryt_terc, updated, teryt_terc)
+    )
+
+
+def save_coverage(
+    filename: str,
+    teryt_terc: str,
+    counts: Dict[StreetKey, Counter],
+    updated: Optional[str] = None
+) -> None:
+    """
+    Saves (replaces) rollups of the commune. The database can be shared by
+    many communes and processes (e.g. merged rollup of batch runs).
+
+    :param counts: see count_coverage
+    :param updated: ISO time of the diff (default: now)
+    """
+    if updated is None:
+        updated = datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+    with closing(_connect(filename)) as db:
+        # IMMEDIATE – other processes don't see partially replaced commune
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            _replace_commune(db, teryt_terc, counts, updated)
+            db.execute('COMMIT')
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+
+def load_coverage(
+    filename: str
+) -> Dict[str, Tuple[Dict[StreetKey, Counter], str]]:
+    """
+    :return: street counts and update time of each commune in the database
+    """
+    communes: Dict[str, Tuple[Dict[StreetKey, Counter], str]] = dict()
+    with closing(_connect(filename)) as db:
+        for teryt_terc, updated in db.execute(
+            'SELECT teryt_terc, updated FROM commune_coverage'
+        ):
+            communes[teryt_terc] = (dict(), updated)
+
+        for row in db.execute(
+            f'''
+            SELECT teryt_terc, city_simc, street, {', '.join(COUNT_COLUMNS)}
+            FROM street_coverage
+            '''
+        ):
+            teryt_terc, city_simc, street = row[:3]
+            communes[teryt_terc][0][(city_simc, street)] = Counter(
+                dict(zip(COUNT_COLUMNS, row[3:]))
+            )
+
+    return communes
+
+
+def merge_coverage(filename: str, source_filenames: List[str]) -> None:
+    """
+    Copies rollups of all communes from source databases (newer rollup of
+    the same commune wins).
+    """
+    with closing(_connect(filename)) as db:
+        current = dict(db.execute(
+            'SELECT teryt_terc, updated FROM commune_coverage'
+        ).fetchall())
+
+    for source_filename in source_filenames:
+        for teryt_terc, (counts, updated) in load_coverage(
+            source_filename
+        ).items():
+            if current.get(teryt_terc, '') > updated:
+                continue
+
+            save_coverage(filename, teryt_terc, counts, updated)
+            current[teryt_terc] = updated
+
+    logger.info(
+        _('Merged coverage of {} communes into: {}').format(
+            len(current),
+            filename
+        )
+    )
+
+
+if __name__ == '__main__':
+    merge_coverage(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,14 @@
+import json
+
+from typing import List
+
+from address import Address
+
+
+def write_geojson(addresses: List[Address], filename: str) -> None:
+    """
+    :param addresses: addresses to save as GeoJSON points
+    :param filename: output filepath
+    """
+    with open(filename, 'w') as f:
+        json.dump(Address.addresses_to_geojson(addresses), f, indent=4)
@@ -0,0 +1,195 @@
+import sqlite3
+import struct
+
+from datetime import datetime, timezone
+from os import path
+from typing import List, Optional, Tuple
+
+from address import Address
+
+
+# https://www.geopackage.org/spec130/
+GPKG_APPLICATION_ID = 0x47504B47  # 'GPKG'
+GPKG_USER_VERSION = 10300
+SRS_ID = 4326
+
+# Columns are the same as keys returned by Address.to_osm_tags()
+TAG_COLUMNS = (
+    'addr:place',
+    'addr:city',
+    'addr:street',
+    'addr:city:simc',
+    'addr:housenumber',
+    'addr:postcode',
+    'source:addr'
+)
+
+_SRS_WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+    'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+)
+
+
+def _quote(identifier: str) -> str:
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def _point_blob(lon: float, lat: float) -> bytes:
+    """
+    :return: GeoPackageBinary – header (little endian, no envelope)
+        and WKB point geometry
+    """
+    header = struct.pack('<2sBBi', b'GP', 0, 0b00000001, SRS_ID)
+    wkb = struct.pack('<BIdd', 1, 1, lon, lat)
+    return header + wkb
+
+
+def _create_metadata_tables(conn: sqlite3.Connection) -> None:
+    conn.execute(f'PRAGMA application_id = {GPKG_APPLICATION_ID}')
+    conn.execute(f'PRAGMA user_version = {GPKG_USER_VERSION}')
+    conn.executescript('''
+        CREATE TABLE gpkg_spatial_ref_sys (
+            srs_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL PRIMARY KEY,
+            organization TEXT NOT NULL,
+            organization_coordsys_id INTEGER NOT NULL,
+            definition TEXT NOT NULL,
+            description TEXT
+        );
+        CREATE TABLE gpkg_contents (
+            table_name TEXT NOT NULL PRIMARY KEY,
+            data_type TEXT NOT NULL,
+            identifier TEXT UNIQUE,
+            description TEXT DEFAULT '',
+            last_change DATETIME NOT NULL
+                DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+            min_x DOUBLE,
+            min_y DOUBLE,
+            max_x DOUBLE,
+            max_y DOUBLE,
+            srs_id INTEGER,
+            CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id)
+                REFERENCES gpkg_spatial_ref_sys(srs_id)
+        );
+        CREATE TABLE gpkg_geometry_columns (
+            table_name TEXT NOT NULL,
+            column_name TEXT NOT NULL,
+            geometry_type_name TEXT NOT NULL,
+            srs_id INTEGER NOT NULL,
+            z TINYINT NOT NULL,
+            m TINYINT NOT NULL,
+            CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+            CONSTRAINT fk_gc_tn FOREIGN KEY (table_name)
+                REFERENCES gpkg_contents(table_name),
+            CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id)
+                REFERENCES gpkg_spatial_ref_sys (srs_id)
+        );
+        CREATE TABLE gpkg_extensions (
+            table_name TEXT,
+            column_name TEXT,
+            extension_name TEXT NOT NULL,
+            definition TEXT NOT NULL,
+            scope TEXT NOT NULL,
+            CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name)
+        );
+    ''')
+    conn.executemany(
+        'INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+        [
+            ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', None),
+            ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', None),
+            ('WGS 84 geodetic', SRS_ID, 'EPSG', 4326, _SRS_WGS84_WKT, None),
+        ]
+    )
+
+
+def _bounds(addresses: List[Address]) -> Tuple[Optional[float], ...]:
+    if not addresses:
+        return None, None, None, None
+
+    lons = [addr.point.lon for addr in addresses]
+    lats = [addr.point.lat for addr in addresses]
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def write_geopackage(addresses: List[Address], filename: str) -> None:
+    """
+    Saves addresses as GeoPackage points layer with R-tree spatial index
+    (gpkg_rtree_index extension), so bounding box reads (e.g. in QGIS)
+    don't need to scan the whole layer.
+    Layer name is the same as filename without extension.
+
+    :param addresses: addresses to save as points
+    :param filename: output filepath (overwritten if exists)
+    """
+    table = path.splitext(path.basename(filename))[0]
+    rtree = f'rtree_{table}_geom'
+
+    with open(filename, 'wb'):  # SQLite would append to existing file
+        pass
+
+    conn = sqlite3.connect(filename)
+    try:
+        _create_metadata_tables(conn)
+        tag_columns_sql = ', '.join(f'{_quote(c)} TEXT' for c in TAG_COLUMNS)
+        conn.execute(
+            f'CREATE TABLE {_quote(table)} ('
+            'fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, '
+            f'geom POINT, {tag_columns_sql})'
+        )
+        conn.execute(
+            f'CREATE VIRTUAL TABLE {_quote(rtree)} '
+            'USING rtree(id, minx, maxx, miny, maxy)'
+        )
+
+        placeholders = ', '.join('?' * (len(TAG_COLUMNS) + 2))
+        columns_sql = ', '.join(_quote(c) for c in TAG_COLUMNS)
+        rows = []
+        for fid, addr in enumerate(addresses, start=1):
+            tags = addr.to_osm_tags()
+            rows.append((
+                fid,
+                _point_blob(addr.point.lon, addr.point.lat),
+                *(tags.get(column) for column in TAG_COLUMNS)
+            ))
+        conn.executemany(
+            f'INSERT INTO {_quote(table)} (fid, geom, {columns_sql}) '
+            f'VALUES ({placeholders})',
+            rows
+        )
+        conn.executemany(
+            f'INSERT INTO {_quote(rtree)} VALUES (?, ?, ?, ?, ?)',
+            [
+                (fid, a.point.lon, a.point.lon, a.point.lat, a.point.lat)
+                for fid, a in enumerate(addresses, start=1)
+            ]
+        )
+
+        min_x, min_y, max_x, max_y = _bounds(addresses)
+        last_change = datetime.now(timezone.utc).strftime(
+            '%Y-%m-%dT%H:%M:%S.%fZ'
+        )
+        conn.execute(
+            'INSERT INTO gpkg_contents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                table, 'features', table, '', last_change,
+                min_x, min_y, max_x, max_y, SRS_ID
+            )
+        )
+        conn.execute(
+            'INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)',
+            (table, 'geom', 'POINT', SRS_ID, 0, 0)
+        )
+        conn.execute(
+            'INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+            (
+                table, 'geom', 'gpkg_rtree_index',
+                'http://www.geopackage.org/spec120/#extension_rtree',
+                'write-only'
+            )
+        )
+        conn.commit()
+    finally:
+        conn.close()
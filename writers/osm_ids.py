@@ -0,0 +1,47 @@
+from typing import List, Optional
+
+from address import OsmAddress
+
+
+def batch_osm_addresses(
+    osm_addresses: List[OsmAddress],
+    batch_size: Optional[int] = None
+) -> List[List[OsmAddress]]:
+    """
+    :param osm_addresses: addresses to split into batches
+    :param batch_size: max addresses in one batch, None – one batch for all
+    :return: list of batches (empty list if no addresses)
+    :raises ValueError: if batch_size is negative
+    """
+    if batch_size is not None and batch_size < 0:
+        raise ValueError(f'Negative batch size: {batch_size}')
+
+    if not osm_addresses:
+        return []
+
+    if not batch_size:
+        return [osm_addresses]
+
+    return [
+        osm_addresses[i:i + batch_size]
+        for i in range(0, len(osm_addresses), batch_size)
+    ]
+
+
+def write_osm_ids(
+    lines: List[List[OsmAddress]],
+    filename: str,
+    header: List[str]
+) -> None:
+    """
+    Saves shorten OSM objects identifiers (e.g. n123,w456) – each line
+    can be loaded in the JOSM using "Download object" function.
+
+    :param lines: OSM addresses for each line of file
+    :param filename: output filepath
+    :param header: comment lines written at the beginning of the file
+    """
+    with open(filename, 'w') as f:
+        f.write('\n'.join(f'# {comment}' for comment in header))
+        for line in lines:
+            f.write('\n' + ','.join(addr.shorten_osm_obj for addr in line))
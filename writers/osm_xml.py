@@ -0,0 +1,36 @@
+from lxml import etree
+
+from typing import List
+
+from address import Address
+
+
+GENERATOR = 'osm-emapa-addresses-diff'
+
+
+def write_osm_xml(addresses: List[Address], filename: str) -> None:
+    """
+    Saves addresses as new (negative id) OSM nodes with address tags
+    (tags without values are skipped). File can be opened directly in the
+    JOSM (as a new data layer).
+
+    :param addresses: addresses to save as OSM nodes
+    :param filename: output filepath
+    """
+    with etree.xmlfile(filename, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element('osm', version='0.6', generator=GENERATOR):
+            for node_id, addr in enumerate(addresses, start=1):
+                node = etree.Element(
+                    'node',
+                    id=str(-node_id),
+                    visible='true',
+                    lat=str(addr.point.lat),
+                    lon=str(addr.point.lon)
+                )
+                for key, value in addr.to_osm_tags().items():
+                    # e.g. address without postcode
+                    if value is not None:
+                        etree.SubElement(node, 'tag', k=key, v=value)
+
+                xf.write(node)
@@ -0,0 +1,42 @@
+from os import path
+from typing import Callable, Dict, List, Tuple
+
+from address import Address
+from writers.geojson import write_geojson
+from writers.geopackage import write_geopackage
+from writers.osm_xml import write_osm_xml
+
+
+Writer = Callable[[List[Address], str], None]
+
+# format name: (file extension, writer function)
+OUTPUT_FORMATS: Dict[str, Tuple[str, Writer]] = {
+    'geojson': ('geojson', write_geojson),
+    'gpkg': ('gpkg', write_geopackage),
+    'osm': ('osm', write_osm_xml),
+}
+DEFAULT_OUTPUT_FORMAT = 'geojson'
+
+
+def save_addresses(
+    addresses: List[Address],
+    output_dir: str,
+    name: str,
+    output_format: str = DEFAULT_OUTPUT_FORMAT
+) -> str:
+    """
+    :param addresses: addresses to save
+    :param output_dir: directory for the output file
+    :param name: filename without extension
+    :param output_format: one of OUTPUT_FORMATS keys
+    :raises ValueError: if output format is not registered
+    :return: path to the saved file
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format: {output_format}')
+
+    extension, writer = OUTPUT_FORMATS[output_format]
+    filename = path.join(output_dir, f'{name}.{extension}')
+    writer(addresses, filename)
+
+    return filename
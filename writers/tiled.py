@@ -0,0 +1,133 @@
+import json
+import pathlib
+
+from os import path
+from typing import Any, Dict, List, Optional
+
+from address import Address, OsmAddress
+from utils.tiles import lonlat_to_tile, Tile, tile_bbox
+from writers.osm_ids import batch_osm_addresses, write_osm_ids
+from writers.registry import DEFAULT_OUTPUT_FORMAT, save_addresses
+
+
+TILES_DIRNAME = 'tiles'
+MANIFEST_FILENAME = 'index.json'
+
+
+def _tile_of(addr: Address, zoom: int) -> Tile:
+    return lonlat_to_tile(addr.point.lon, addr.point.lat, zoom)
+
+
+def _tile_dir(output_dir: str, tile: Tile) -> str:
+    z, x, y = tile
+    return path.join(output_dir, TILES_DIRNAME, str(z), str(x), str(y))
+
+
+def save_tiled_report(
+    output_dir: str,
+    zoom: int,
+    address_layers: Dict[str, List[Address]],
+    osm_ids_layers: Dict[str, List[OsmAddress]],
+    osm_blocks_layers: Dict[str, List[List[OsmAddress]]],
+    osm_ids_header: List[str],
+    output_format: str = DEFAULT_OUTPUT_FORMAT,
+    batch_size: Optional[int] = None
+) -> List[str]:
+    """
+    Partitions report files by slippy map tiles at given zoom and saves
+    them as tiles/<z>/<x>/<y>/<layer name>.<ext> with index manifest
+    (tiles/index.json) which contains bbox, files and counts for each tile.
+
+    :param output_dir: commune output directory
+    :param zoom: slippy map zoom of tiles
+    :param address_layers: layer name: addresses (saved using output_format)
+    :param osm_ids_layers: layer name: OSM objects (saved as .txt in batches)
+    :param osm_blocks_layers: layer name: blocks of OSM objects (saved as .txt
+        – 1 block per line), block is assigned to the tile of its 1st address
+    :param osm_ids_header: comment lines for the .txt files
+    :param output_format: format of address layers
+    :param batch_size: max OSM ids in one line of osm_ids_layers files
+    :return: paths to saved files, the manifest file is the last one
+    """
+    tiles: Dict[Tile, Dict[str, Any]] = dict()
+    filenames: List[str] = []
+
+    def tile_entry(tile: Tile) -> Dict[str, Any]:
+        if tile not in tiles:
+            tiles[tile] = {
+                'z': tile[0],
+                'x': tile[1],
+                'y': tile[2],
+                'bbox': list(tile_bbox(tile)),
+                'layers': dict()
+            }
+            pathlib.Path(_tile_dir(output_dir, tile)).mkdir(
+                parents=True,
+                exist_ok=True
+            )
+        return tiles[tile]
+
+    for name, addresses in address_layers.items():
+        partitions: Dict[Tile, List[Address]] = dict()
+        for addr in addresses:
+            partitions.setdefault(_tile_of(addr, zoom), []).append(addr)
+
+        for tile, tile_addresses in partitions.items():
+            entry = tile_entry(tile)
+            filename = save_addresses(
+                tile_addresses,
+                _tile_dir(output_dir, tile),
+                name,
+                output_format
+            )
+            filenames.append(filename)
+            entry['layers'][name] = {
+                'path': path.relpath(filename, output_dir),
+                'count': len(tile_addresses)
+            }
+
+    def save_lines(name: str, tile: Tile, lines: List[List[OsmAddress]]):
+        entry = tile_entry(tile)
+        filename = path.join(_tile_dir(output_dir, tile), f'{name}.txt')
+        write_osm_ids(lines, filename, osm_ids_header)
+        filenames.append(filename)
+        entry['layers'][name] = {
+            'path': path.relpath(filename, output_dir),
+            'count': sum(len(line) for line in lines)
+        }
+
+    for name, osm_addresses in osm_ids_layers.items():
+        osm_partitions: Dict[Tile, List[OsmAddress]] = dict()
+        for addr in osm_addresses:
+            osm_partitions.setdefault(_tile_of(addr, zoom), []).append(addr)
+
+        for tile, tile_addresses in osm_partitions.items():
+            save_lines(
+                name,
+                tile,
+                batch_osm_addresses(tile_addresses, batch_size)
+            )
+
+    for name, blocks in osm_blocks_layers.items():
+        block_partitions: Dict[Tile, List[List[OsmAddress]]] = dict()
+        for block in blocks:
+            tile = _tile_of(block[0], zoom)
+            block_partitions.setdefault(tile, []).append(block)
+
+        for tile, tile_blocks in block_partitions.items():
+            save_lines(name, tile, tile_blocks)
+
+    manifest = {
+        'zoom': zoom,
+        'tiles': [tiles[tile] for tile in sorted(tiles)]
+    }
+    manifest_filename = path.join(output_dir, TILES_DIRNAME, MANIFEST_FILENAME)
+    pathlib.Path(path.dirname(manifest_filename)).mkdir(
+        parents=True,
+        exist_ok=True
+    )
+    with open(manifest_filename, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    filenames.append(manifest_filename)
+
+    return filenames